@@ -0,0 +1,214 @@
+"""
+IVF (inverted file) approximate nearest-neighbour index for the local collection.
+
+Rows are L2-normalized, so spherical k-means centroids partition the
+collection into nlist cells; a query scans only the nprobe cells whose
+centroids are closest. nprobe trades recall for latency (nprobe = nlist is
+exact search).
+
+The index trains itself once the collection reaches min_rows, assigns new
+rows to their nearest centroid incrementally on upsert, and retrains when the
+collection has grown retrain_factor times past the size it was trained on.
+
+Env vars (read by chroma_client):
+  - LOCAL_ANN=ivf enables the index (default: off, exact search)
+  - LOCAL_ANN_NLIST (default: 0 = 4 * sqrt(rows) at training time)
+  - LOCAL_ANN_NPROBE (default: 8)
+  - LOCAL_ANN_MIN_ROWS: rows before training; smaller collections stay exact (default: 20000)
+"""
+import math
+import os
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+_ASSIGN_BATCH = 16384
+
+
+class IVFIndex:
+    def __init__(self, nlist: int = 0, nprobe: int = 8, min_rows: int = 20000, iters: int = 10,
+                 train_per_list: int = 40, max_train_rows: int = 100000, retrain_factor: float = 4.0,
+                 seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.iters = iters
+        self.train_per_list = train_per_list
+        self.max_train_rows = max_train_rows
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self.reset()
+
+    def reset(self) -> None:
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self._size = 0
+        self._lists: List[np.ndarray] = []
+        self._list_sizes = np.zeros(0, dtype=np.int64)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def needs_training(self, rows: int) -> bool:
+        if not self.trained:
+            return rows >= self.min_rows
+        return rows >= self.trained_rows * self.retrain_factor
+
+    # ---- build ----
+    def train(self, vectors: np.ndarray) -> np.ndarray:
+        """Spherical k-means over (a sample of) the normalized rows, then index every row.
+
+        Returns the row -> cell assignments so callers can persist them.
+        """
+        centroids = self.fit(vectors)
+        assignments = self.assign(vectors, centroids)
+        self.install(centroids, vectors.shape[0], assignments)
+        return assignments
+
+    def fit(self, vectors: np.ndarray) -> np.ndarray:
+        """Centroids for vectors, leaving the index as it is (so it can run while queries use it)."""
+        n = vectors.shape[0]
+        nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        # a few dozen points per cell are enough to place the centroids
+        sample_size = min(n, max(nlist, min(self.max_train_rows, self.train_per_list * nlist)))
+        sample_idx = rng.choice(n, size=sample_size, replace=False)
+        sample = np.asarray(vectors[np.sort(sample_idx)], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            # per-cell sums via one sort + reduceat instead of a scatter-add
+            order = np.argsort(assign, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+            empty = counts == 0
+            if empty.any():
+                # re-seed empty cells from random samples
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+            centroids = sums / np.clip(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12, None)
+        return centroids.astype(np.float32)
+
+    def install(self, centroids: np.ndarray, trained_rows: int, assignments: np.ndarray) -> None:
+        """Switch to centroids from fit() and the full row -> cell assignments made with them."""
+        self.centroids = centroids
+        self.trained_rows = trained_rows
+        self.load_assignments(assignments)
+
+    def assign(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None) -> np.ndarray:
+        """Nearest centroid (of the index, or of the given centroids) of each row, in bounded-memory batches."""
+        centroids = self.centroids if centroids is None else centroids
+        out = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], _ASSIGN_BATCH):
+            block = np.asarray(vectors[start:start + _ASSIGN_BATCH], dtype=np.float32)
+            out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return out
+
+    def load_assignments(self, assignments: np.ndarray) -> None:
+        """Rebuild the inverted lists from a full row -> cell assignment array."""
+        nlist = self.centroids.shape[0]
+        assignments = np.asarray(assignments, dtype=np.int32)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        self._lists = [order[bounds[c]:bounds[c + 1]].astype(np.int64) for c in range(nlist)]
+        self._list_sizes = counts.astype(np.int64)
+        self._size = len(assignments)
+
+    def assignments(self) -> np.ndarray:
+        """Row -> cell array for every indexed row (the inverse of the inverted lists)."""
+        out = np.zeros(self._size, dtype=np.int32)
+        for c, rows in enumerate(self._lists):
+            out[rows[:self._list_sizes[c]]] = c
+        return out
+
+    def add(self, vectors: np.ndarray, start_row: int, assignments: Optional[np.ndarray] = None) -> np.ndarray:
+        """Assign rows start_row.. to their nearest cells; returns the new assignments.
+
+        Pass assignments to reuse cells computed earlier (e.g. read from disk).
+        """
+        assign = self.assign(vectors) if assignments is None else np.asarray(assignments, dtype=np.int32)
+        rows = np.arange(start_row, start_row + len(assign), dtype=np.int64)
+        for c in np.unique(assign):
+            new = rows[assign == c]
+            size = self._list_sizes[c]
+            buf = self._lists[c]
+            if size + len(new) > len(buf):
+                # grow by doubling; readers keep whatever view they already took
+                grown = np.empty(max(size + len(new), 2 * len(buf)), dtype=np.int64)
+                grown[:size] = buf[:size]
+                buf = grown
+            buf[size:size + len(new)] = new
+            self._lists[c] = buf
+            self._list_sizes[c] = size + len(new)
+        self._size = start_row + len(assign)
+        return assign
+
+    # ---- search ----
+    def snapshot(self) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """Centroids and per-cell row views, safe to search while rows are being added."""
+        return self.centroids, [self._lists[c][:self._list_sizes[c]] for c in range(len(self._lists))]
+
+    @staticmethod
+    def search(snapshot: Tuple[np.ndarray, List[np.ndarray]], vectors: np.ndarray, queries: np.ndarray,
+               k: int, nprobe: int, allowed: Optional[np.ndarray] = None,
+               scorer: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+               ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, scores) best first per query, scanning the nprobe nearest cells.
+
+        allowed is an optional boolean mask over rows (e.g. a metadata filter);
+        scorer(query, rows) replaces the dot products against vectors (e.g. with
+        a compressed encoding's approximate scores).
+        """
+        centroids, lists = snapshot
+        nprobe = max(1, min(nprobe, len(lists)))
+        cell_scores = queries @ centroids.T
+        probes = np.argpartition(-cell_scores, nprobe - 1, axis=1)[:, :nprobe]
+        size = vectors.shape[0]
+        results = []
+        for qi in range(len(queries)):
+            cand = np.concatenate([lists[c] for c in probes[qi]])
+            cand = cand[cand < size]
+            if allowed is not None:
+                cand = cand[allowed[cand]]
+            if cand.size == 0:
+                results.append((cand, np.zeros(0, dtype=np.float32)))
+                continue
+            cand.sort()  # sequential access into the (possibly memory-mapped) matrix
+            scores = vectors[cand] @ queries[qi] if scorer is None else scorer(queries[qi], cand)
+            kk = min(k, cand.size)
+            best = np.argpartition(-scores, kk - 1)[:kk] if kk < cand.size else np.arange(cand.size)
+            best = best[np.argsort(-scores[best], kind="stable")]
+            results.append((cand[best], scores[best]))
+        return results
+
+    # ---- persistence ----
+    def save(self, path: str) -> None:
+        """Write centroids atomically; row assignments are persisted by the caller."""
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, trained_rows=np.int64(self.trained_rows))
+        os.replace(tmp, path)
+
+    def load_centroids(self, path: str) -> None:
+        """Read what save() wrote; follow with load_assignments()."""
+        self.reset()
+        with np.load(path) as data:
+            self.centroids = data["centroids"].astype(np.float32)
+            self.trained_rows = int(data["trained_rows"])
+
+    def stats(self) -> dict:
+        sizes = self._list_sizes
+        return {
+            "type": "ivf",
+            "trained": self.trained,
+            "nlist": int(len(sizes)),
+            "nprobe": self.nprobe,
+            "indexed_rows": int(self._size),
+            "trained_rows": int(self.trained_rows),
+            "largest_list": int(sizes.max()) if len(sizes) else 0,
+        }
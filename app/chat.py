@@ -1,9 +1,11 @@
+import asyncio
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
-from .llm_provider import get_llm_and_embeddings
-from .retrieval import retrieve_context
-from .webscrape import search_and_fetch
+from .llm_provider import get_llm_and_embeddings, get_async_llm_and_embeddings, get_llm_model_id
+from .response_cache import get_response_cache
+from .retrieval import retrieve_context, retrieve_chunks, aretrieve_context
+from .webscrape import search_and_fetch, asearch_and_fetch
 
 
 def build_chat_prompt(
@@ -68,12 +70,21 @@ def build_chat_prompt(
 essential_keys = ("answer", "sources", "used")
 
 
-def chat_answer(question: str) -> Dict[str, Any]:
+def chat_answer(question: str, where: Optional[Dict[str, Any]] = None, user: Optional[str] = None) -> Dict[str, Any]:
     """Original chat answer without conversation context (for backward compatibility)"""
     llm, _ = get_llm_and_embeddings()
 
     # Retrieve from vector DB
-    rag_docs, rag_meta = retrieve_context(question, top_k=int(os.getenv("RETRIEVAL_K", "5")))
+    found = retrieve_chunks(question, top_k=int(os.getenv("RETRIEVAL_K", "5")), where=where, user=user)
+    rag_docs, rag_meta = found.docs, found.metas
+
+    # Same question over the same retrieved chunks: reuse the earlier answer
+    cache = get_response_cache()
+    provider, model = get_llm_model_id()
+    if cache is not None:
+        cached = cache.get("chat", provider, model, found.collection, question, found.ids, found.qvec)
+        if cached is not None:
+            return cached
 
     # Light web fetch (Wikipedia fallback)
     web_docs, web_sources = search_and_fetch(question, max_docs=2)
@@ -81,7 +92,7 @@ def chat_answer(question: str) -> Dict[str, Any]:
     prompt = build_chat_prompt(question, rag_docs, web_docs)
     answer_text = llm(prompt)
 
-    return {
+    result = {
         "answer": answer_text,
         "sources": {
             "rag": rag_meta,
@@ -93,18 +104,23 @@ def chat_answer(question: str) -> Dict[str, Any]:
             "model": os.getenv("LLM_PROVIDER", "local"),
         },
     }
+    if cache is not None:
+        cache.put("chat", provider, model, found.collection, question, found.ids, result, found.qvec)
+    return result
 
 
 def chat_answer_with_context(
     question: str, 
     conversation_history: List[Dict[str, str]] = None,
-    user_context: Optional[Dict[str, Any]] = None
+    user_context: Optional[Dict[str, Any]] = None,
+    where: Optional[Dict[str, Any]] = None,
+    user: Optional[str] = None,
 ) -> Dict[str, Any]:
     """Enhanced chat answer with conversation history and user's financial context"""
     llm, _ = get_llm_and_embeddings()
 
     # Retrieve from vector DB
-    rag_docs, rag_meta = retrieve_context(question, top_k=int(os.getenv("RETRIEVAL_K", "5")))
+    rag_docs, rag_meta = retrieve_context(question, top_k=int(os.getenv("RETRIEVAL_K", "5")), where=where, user=user)
 
     # Light web fetch (Wikipedia fallback)
     web_docs, web_sources = search_and_fetch(question, max_docs=2)
@@ -126,3 +142,46 @@ def chat_answer_with_context(
         },
     }
 
+
+async def aprepare_chat_prompt(
+    question: str,
+    conversation_history: List[Dict[str, str]] = None,
+    user_context: Optional[Dict[str, Any]] = None,
+    where: Optional[Dict[str, Any]] = None,
+    user: Optional[str] = None,
+) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    """Gather RAG and web context concurrently and build the chat prompt.
+
+    Returns (prompt, sources, used) so callers can either await a full answer
+    or stream it token by token.
+    """
+    (rag_docs, rag_meta), (web_docs, web_sources) = await asyncio.gather(
+        aretrieve_context(question, top_k=int(os.getenv("RETRIEVAL_K", "5")), where=where, user=user),
+        asearch_and_fetch(question, max_docs=2),
+    )
+    prompt = build_chat_prompt(question, rag_docs, web_docs, conversation_history, user_context)
+    sources = {
+        "rag": rag_meta,
+        "web": web_sources,
+    }
+    used = {
+        "rag": bool(rag_docs),
+        "web": bool(web_docs),
+        "model": os.getenv("LLM_PROVIDER", "local"),
+        "personalized": bool(user_context),
+    }
+    return prompt, sources, used
+
+
+async def achat_answer_with_context(
+    question: str,
+    conversation_history: List[Dict[str, str]] = None,
+    user_context: Optional[Dict[str, Any]] = None,
+    where: Optional[Dict[str, Any]] = None,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Async chat_answer_with_context: retrieval and web fetch run concurrently, LLM call is awaited"""
+    agenerate, _ = get_async_llm_and_embeddings()
+    prompt, sources, used = await aprepare_chat_prompt(question, conversation_history, user_context, where, user)
+    answer_text = await agenerate(prompt)
+    return {"answer": answer_text, "sources": sources, "used": used}
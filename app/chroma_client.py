@@ -1,114 +1,332 @@
+import logging
 import os
-from typing import Optional
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .ann_index import IVFIndex
+from .ingest_manifest import get_ingest_manifest
+from .lexical_index import drop_lexical_index, get_lexical_index
+from .vector_codecs import make_codec
+from .vector_store import MemoryCollection, PersistentCollection
+
+logger = logging.getLogger(__name__)
 
 # Persist in-memory collections across calls
 _MEMORY_COLLECTIONS = {}
 
+# chromadb clients keyed by (host, port) ("" and 0 for the in-process client), and
+# collection handles keyed by (host, port, collection name)
+_CLIENTS: Dict[Tuple[str, int], Any] = {}
+_COLLECTIONS: Dict[Tuple[str, int, str], "_CachedCollection"] = {}
+_CLIENTS_LOCK = threading.RLock()
+_CLIENT_STATS = {"clients_created": 0, "collections_opened": 0, "revalidations": 0, "reconnects": 0,
+                 "evictions": 0}
+# monotonic time each collection name was last handed out, for idle eviction
+_LAST_USED: Dict[str, float] = {}
+
+
+def _ann_index() -> Optional[IVFIndex]:
+    """IVF index for a fallback collection when LOCAL_ANN=ivf (see app/ann_index.py)."""
+    if os.getenv("LOCAL_ANN", "").lower() != "ivf":
+        return None
+    return IVFIndex(
+        nlist=int(os.getenv("LOCAL_ANN_NLIST", "0")),
+        nprobe=int(os.getenv("LOCAL_ANN_NPROBE", "8")),
+        min_rows=int(os.getenv("LOCAL_ANN_MIN_ROWS", "20000")),
+    )
+
+
+def _collection_options(persistent: bool) -> Dict[str, Any]:
+    """Index, codec and compaction settings for a fallback collection (see app/vector_store.py).
+
+    LOCAL_CODEC only applies with LOCAL_VECTOR_DIR: the codes are kept next to
+    the float32 rows used for re-ranking, so without a memory-mapped matrix
+    they would add to RAM per chunk instead of saving it.
+    """
+    codec_name = os.getenv("LOCAL_CODEC", "")
+    if codec_name and not persistent:
+        logger.warning("LOCAL_CODEC=%s ignored: codecs need LOCAL_VECTOR_DIR to keep float32 rows on disk",
+                       codec_name)
+        codec_name = ""
+    return {
+        "index": _ann_index(),
+        "codec": make_codec(codec_name, pq_m=int(os.getenv("LOCAL_PQ_M", "0")),
+                            min_rows=int(os.getenv("LOCAL_CODEC_MIN_ROWS", "10000"))),
+        "rerank": int(os.getenv("LOCAL_CODEC_RERANK", "10")),
+        "compact_ratio": float(os.getenv("LOCAL_COMPACT_RATIO", "0.25")),
+        "compact_min_rows": int(os.getenv("LOCAL_COMPACT_MIN_ROWS", "1000")),
+    }
+
+
+def _client_key() -> Tuple[str, int]:
+    host = os.getenv("CHROMA_HOST")
+    return (host, int(os.getenv("CHROMA_PORT", "8000"))) if host else ("", 0)
+
+
+def _tune_http_pool(client) -> None:
+    """Size the keep-alive pool of the requests.Session behind chromadb's HTTP API.
+
+    Env vars:
+      - CHROMA_HTTP_POOL: connections kept alive per host (default: 20)
+    """
+    session = getattr(getattr(client, "_server", None), "_session", None)
+    if session is None:
+        return
+    from requests.adapters import HTTPAdapter
+
+    size = int(os.getenv("CHROMA_HTTP_POOL", "20"))
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def _get_client(key: Tuple[str, int]):
+    """Process-wide chromadb client for (host, port); raises ImportError without chromadb."""
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                import chromadb  # type: ignore
+                if key[0]:
+                    client = chromadb.HttpClient(host=key[0], port=key[1])
+                    _tune_http_pool(client)
+                else:
+                    from chromadb.config import Settings  # type: ignore
+                    client = chromadb.Client(Settings())
+                _CLIENTS[key] = client
+                _CLIENT_STATS["clients_created"] += 1
+    return client
+
+
+def _open_collection(key: Tuple[str, int, str]):
+    """Re-validate the client behind key (heartbeat, reconnect if dead) and reopen the collection."""
+    client_key = (key[0], key[1])
+    with _CLIENTS_LOCK:
+        _CLIENT_STATS["revalidations"] += 1
+        client = _CLIENTS.get(client_key)
+        try:
+            if client is None:
+                raise RuntimeError("no client")
+            client.heartbeat()
+        except Exception:
+            _CLIENTS.pop(client_key, None)
+            _CLIENT_STATS["reconnects"] += 1
+            client = _get_client(client_key)
+        _CLIENT_STATS["collections_opened"] += 1
+        return client.get_or_create_collection(name=key[2])
+
+
+# errors worth a reconnect: transport failures (requests' are OSErrors, httpx's are matched by
+# class name) and a collection deleted or recreated under a cached id
+_TRANSPORT_ERRORS = frozenset({"TransportError", "TimeoutException", "RemoteProtocolError", "NetworkError"})
+_STALE_ERRORS = frozenset({"InvalidCollectionException", "NotFoundError"})
+_STALE_MESSAGE = re.compile(r"collection\b.*\b(does not exist|not found)", re.IGNORECASE)
+
+
+def _reconnectable(error: Exception) -> bool:
+    if isinstance(error, OSError):
+        return True
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & (_TRANSPORT_ERRORS | _STALE_ERRORS)) or bool(_STALE_MESSAGE.search(str(error)))
+
+
+class _CachedCollection:
+    """Cached chromadb collection handle.
+
+    A call that fails on the connection, or on a collection deleted and
+    recreated by another process (stale id), re-validates the client and
+    reopens the collection once before giving up; that covers dropped
+    keep-alive connections and a restarted server. Any other error (a bad
+    where filter, a dimension mismatch) is the caller's and is raised at
+    once. Attributes not wrapped here pass straight through.
+    """
+
+    def __init__(self, key: Tuple[str, int, str], collection):
+        self._key = key
+        self._collection = collection
+
+    @property
+    def name(self) -> str:
+        return self._collection.name
+
+    def _call(self, method: str, *args, **kwargs):
+        try:
+            return getattr(self._collection, method)(*args, **kwargs)
+        except Exception as e:
+            if not _reconnectable(e):
+                raise
+            try:
+                self._collection = _open_collection(self._key)
+            except Exception:
+                pass
+            return getattr(self._collection, method)(*args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._call("upsert", *args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._call("query", *args, **kwargs)
+
+    def count(self):
+        return self._call("count")
+
+    def get(self, *args, **kwargs):
+        return self._call("get", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self._collection, item)
+
+
 def get_chroma_collection(collection_name: Optional[str] = None):
     """Return a ChromaDB collection.
 
     If CHROMA_HOST is set, connect to the remote server; otherwise use an in-memory client
-    suitable for tests and local dev.
+    suitable for tests and local dev. Clients and collection handles are cached per
+    process, so steady-state calls make no extra round trips to Chroma.
     """
     collection_name = collection_name or os.getenv("CHROMA_COLLECTION", "documents")
-    host = os.getenv("CHROMA_HOST")
-    port = int(os.getenv("CHROMA_PORT", "8000"))
+    _LAST_USED[collection_name] = time.monotonic()
 
     try:
-        if host:
-            import chromadb  # type: ignore
-            client = chromadb.HttpClient(host=host, port=port)
-        else:
-            import chromadb  # type: ignore
-            from chromadb.config import Settings  # type: ignore
-            client = chromadb.Client(Settings())
-
-        return client.get_or_create_collection(name=collection_name)
+        key = _client_key() + (collection_name,)
+        coll = _COLLECTIONS.get(key)
+        if coll is None:
+            with _CLIENTS_LOCK:
+                coll = _COLLECTIONS.get(key)
+                if coll is None:
+                    handle = _get_client(key[:2]).get_or_create_collection(name=collection_name)
+                    _CLIENT_STATS["collections_opened"] += 1
+                    coll = _CachedCollection(key, handle)
+                    _COLLECTIONS[key] = coll
+        return coll
     except ImportError:
-        # Fallback: minimal in-memory collection compatible with .upsert and .name
-        class _MemoryCollection:
-            def __init__(self, name: str):
-                self.name = name
-                self._store = []
-
-            def upsert(self, ids=None, documents=None, metadatas=None, embeddings=None):
-                ids = ids or []
-                documents = documents or []
-                metadatas = metadatas or []
-                embeddings = embeddings or []
-                for i, d, m, e in zip(ids, documents, metadatas, embeddings):
-                    self._store.append({"id": i, "doc": d, "meta": m, "emb": e})
-
-            def query(self, query_embeddings=None, n_results: int = 5, include=None):
-                # very simple cosine similarity search over stored vectors
-                include = include or ["documents", "metadatas", "distances"]
-                if not query_embeddings:
-                    return {k: [[]] for k in include}
-                import math
-
-                def cosine(a, b):
-                    dot = sum(x * y for x, y in zip(a, b))
-                    na = math.sqrt(sum(x * x for x in a)) + 1e-9
-                    nb = math.sqrt(sum(y * y for y in b)) + 1e-9
-                    return dot / (na * nb)
-
-                q = query_embeddings[0]
-                scored = []
-                for row in self._store:
-                    emb = row.get("emb") or []
-                    if len(emb) != len(q):
-                        continue
-                    scored.append((cosine(q, emb), row))
-                scored.sort(key=lambda x: x[0], reverse=True)
-                top = scored[:n_results]
-                out = {"documents": [[]], "metadatas": [[]], "distances": [[]]}
-                for score, row in top:
-                    out["documents"][0].append(row["doc"]) if "documents" in include else None
-                    out["metadatas"][0].append(row["meta"]) if "metadatas" in include else None
-                    out["distances"][0].append(1 - score) if "distances" in include else None
-                return out
-
-            def count(self):
-                return len(self._store)
-
+        # Fallback: in-process matrix-backed collection with the same upsert/query/count surface,
+        # memory-mapped under LOCAL_VECTOR_DIR when set so it survives restarts
         coll = _MEMORY_COLLECTIONS.get(collection_name)
         if coll is None:
-            coll = _MemoryCollection(collection_name)
-            _MEMORY_COLLECTIONS[collection_name] = coll
+            with _CLIENTS_LOCK:
+                coll = _MEMORY_COLLECTIONS.get(collection_name)
+                if coll is None:
+                    vector_dir = os.getenv("LOCAL_VECTOR_DIR")
+                    if vector_dir:
+                        coll = PersistentCollection(collection_name, os.path.join(vector_dir, collection_name),
+                                                    **_collection_options(persistent=True))
+                    else:
+                        coll = MemoryCollection(collection_name, **_collection_options(persistent=False))
+                    _MEMORY_COLLECTIONS[collection_name] = coll
         return coll
 
 
+def evict_idle_collections(idle_seconds: float) -> List[str]:
+    """Drop collections unused for idle_seconds from the process caches; returns their names.
+
+    Chroma handles and LOCAL_VECTOR_DIR collections (with their lexical indexes)
+    reopen on their next use. Purely in-memory fallback collections hold the
+    only copy of their rows, so they stay, and so does a LOCAL_VECTOR_DIR
+    collection with a write or compaction in progress: dropping it then would
+    let the next request open a second instance over the same files while the
+    first is still changing them. A thread still reading a dropped instance
+    finishes on its own snapshot.
+    """
+    cutoff = time.monotonic() - idle_seconds
+    evicted = []
+    with _CLIENTS_LOCK:
+        for name, used in list(_LAST_USED.items()):
+            if used > cutoff:
+                continue
+            memory = _MEMORY_COLLECTIONS.get(name)
+            if memory is not None:
+                if not isinstance(memory, PersistentCollection):
+                    continue
+                with memory.quiesced() as idle:
+                    if not idle:
+                        continue
+                    del _MEMORY_COLLECTIONS[name]
+            for key in [k for k in _COLLECTIONS if k[2] == name]:
+                del _COLLECTIONS[key]
+            del _LAST_USED[name]
+            drop_lexical_index(name)
+            evicted.append(name)
+        _CLIENT_STATS["evictions"] += len(evicted)
+    return evicted
+
+
+def _drop_derived_state(collection_name: str) -> None:
+    """After a reset: clear the lexical postings, ingest manifest and cached answers built from the old contents."""
+    from .response_cache import get_response_cache
+
+    lexical = get_lexical_index(collection_name)
+    if lexical is not None:
+        lexical.clear()
+    manifest = get_ingest_manifest()
+    if manifest is not None:
+        manifest.forget(collection_name)
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate_collection(collection_name)
+
+
 def reset_chroma_collection(collection_name: Optional[str] = None) -> int:
     """Reset (delete and recreate) the given collection. Returns previous count.
 
     Works with both remote/local chromadb and the in-memory fallback.
     """
     collection_name = collection_name or os.getenv("CHROMA_COLLECTION", "documents")
-    host = os.getenv("CHROMA_HOST")
     try:
-        if host:
-            import chromadb  # type: ignore
-            client = chromadb.HttpClient(host=host, port=int(os.getenv("CHROMA_PORT", "8000")))
-        else:
-            import chromadb  # type: ignore
-            from chromadb.config import Settings  # type: ignore
-            client = chromadb.Client(Settings())
+        key = _client_key() + (collection_name,)
+        client = _get_client(key[:2])
         # get current count then delete and recreate
         try:
-            existing = client.get_or_create_collection(name=collection_name)
-            before = existing.count()
+            before = get_chroma_collection(collection_name).count()
         except Exception:
             before = 0
-        try:
-            client.delete_collection(name=collection_name)  # type: ignore
-        except Exception:
-            pass
-        client.get_or_create_collection(name=collection_name)
+        with _CLIENTS_LOCK:
+            try:
+                client.delete_collection(name=collection_name)  # type: ignore
+            except Exception:
+                pass
+            # the cached handle points at the deleted collection's id
+            _COLLECTIONS.pop(key, None)
+            get_chroma_collection(collection_name)
+        _drop_derived_state(collection_name)
         return int(before)
     except ImportError:
         # in-memory fallback
-        coll = get_chroma_collection(collection_name)
-        before = len(getattr(coll, "_store", []))
-        if hasattr(coll, "_store"):
-            coll._store.clear()  # type: ignore[attr-defined]
+        before = get_chroma_collection(collection_name).clear()
+        _drop_derived_state(collection_name)
         return int(before)
+
+
+def delete_source(source: str, collection_name: Optional[str] = None) -> int:
+    """Delete every chunk ingested from one source; returns how many were removed.
+
+    Only answers built from those chunks are dropped from the response cache.
+    """
+    from .response_cache import get_response_cache
+
+    collection = get_chroma_collection(collection_name)
+    found = collection.get(where={"source": source}, include=[])
+    ids = list(found.get("ids") or [])
+    if not ids:
+        return 0
+    collection.delete(ids=ids)
+    lexical = get_lexical_index(collection.name)
+    if lexical is not None:
+        lexical.delete(ids)
+    manifest = get_ingest_manifest()
+    if manifest is not None:
+        manifest.forget(collection.name, source)
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate_chunks(collection.name, ids)
+    return len(ids)
+
+
+def chroma_client_stats() -> dict:
+    return dict(_CLIENT_STATS, clients=len(_CLIENTS), collections=len(_COLLECTIONS))
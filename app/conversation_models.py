@@ -1,7 +1,7 @@
 """
 Pydantic models for conversation and message data
 """
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -78,6 +78,8 @@ class ChatRequest(BaseModel):
     """Chat request with optional session"""
     query: str
     session_id: Optional[str] = None
+    # metadata filter for retrieval (chromadb `where` syntax)
+    where: Optional[Dict[str, Any]] = None
 
 
 class ChatResponse(BaseModel):
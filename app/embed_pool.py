@@ -0,0 +1,135 @@
+"""
+Multi-process embedding worker pool for bulk ingest.
+
+Each worker process loads the local embedding model once (in
+its initializer) and encodes one shard of a large chunk list; shards are
+reassembled in their original order. Small batches stay in-process.
+
+Env vars:
+  - EMBED_POOL_WORKERS (default: 0 = pool disabled)
+  - EMBED_POOL_MIN_TEXTS: smallest batch sent to the pool (default: 64)
+  - EMBED_POOL_SHARD_SIZE: max texts per worker task (default: 256)
+  - EMBED_POOL_THREADS: torch threads per worker (default: 1)
+"""
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_POOLS: Dict[tuple, "EmbeddingWorkerPool"] = {}
+_POOLS_LOCK = threading.Lock()
+
+# Set in each worker process by _init_worker
+_WORKER_MODEL = None
+
+
+def _init_worker(model_name: str, threads: int, backend: str) -> None:
+    global _WORKER_MODEL
+    if backend.startswith("onnx"):
+        # spawned workers inherit the parent's LOCAL_EMBED_ONNX_* env
+        os.environ["LOCAL_EMBED_ONNX_THREADS"] = str(max(1, threads))
+        from .onnx_embedder import load_onnx_embedder
+        _WORKER_MODEL = load_onnx_embedder(model_name)
+        return
+    try:
+        import torch  # type: ignore
+        # one process per core: keep each worker's intra-op pool from oversubscribing
+        torch.set_num_threads(max(1, threads))
+    except Exception:
+        pass
+    from sentence_transformers import SentenceTransformer  # type: ignore
+    _WORKER_MODEL = SentenceTransformer(model_name)
+
+
+def _encode_shard(texts: List[str]) -> np.ndarray:
+    return np.asarray(_WORKER_MODEL.encode(texts), dtype=np.float32)
+
+
+def shard_bounds(n: int, workers: int, max_shard: int) -> List[tuple]:
+    """Split range(n) into contiguous (start, end) shards, at least one per worker."""
+    if n <= 0:
+        return []
+    size = max(1, min(max_shard, math.ceil(n / max(1, workers))))
+    return [(start, min(n, start + size)) for start in range(0, n, size)]
+
+
+class EmbeddingWorkerPool:
+    def __init__(self, model_name: str, workers: int, shard_size: int = 256, threads_per_worker: int = 1,
+                 backend: str = "sentence_transformers"):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers
+        self.shard_size = shard_size
+        # spawn: forking a process that already holds torch threads can deadlock
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads_per_worker, backend),
+        )
+        self.calls = 0
+        self.shards = 0
+        self.texts = 0
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts across the workers; rows come back in input order."""
+        texts = list(texts)
+        bounds = shard_bounds(len(texts), self.workers, self.shard_size)
+        parts = list(self._executor.map(_encode_shard, [texts[a:b] for a, b in bounds]))
+        self.calls += 1
+        self.shards += len(bounds)
+        self.texts += len(texts)
+        if not parts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(parts, axis=0)
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "workers": self.workers,
+            "shard_size": self.shard_size,
+            "calls": self.calls,
+            "shards": self.shards,
+            "texts": self.texts,
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_embedding_pool(model_name: str, backend: str = "sentence_transformers") -> Optional[EmbeddingWorkerPool]:
+    """Return the shared worker pool for model_name, or None if EMBED_POOL_WORKERS is 0."""
+    workers = int(os.getenv("EMBED_POOL_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    key = (model_name, backend, workers)
+    pool = _POOLS.get(key)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(key)
+            if pool is None:
+                pool = EmbeddingWorkerPool(
+                    model_name,
+                    workers,
+                    shard_size=int(os.getenv("EMBED_POOL_SHARD_SIZE", "256")),
+                    threads_per_worker=int(os.getenv("EMBED_POOL_THREADS", "1")),
+                    backend=backend,
+                )
+                _POOLS[key] = pool
+    return pool
+
+
+def embedding_pool_stats() -> List[dict]:
+    return [pool.stats() for pool in list(_POOLS.values())]
+
+
+def close_embedding_pools() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
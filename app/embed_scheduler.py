@@ -0,0 +1,171 @@
+"""
+Micro-batching scheduler in front of a provider's embed_texts.
+
+Concurrent /query, /chat and /ingest calls each embed a handful of texts.
+The scheduler coalesces requests that arrive within a short window (up to
+a max batch size) into one batched encode and hands each caller back its
+own rows.
+
+Env vars:
+  - EMBED_BATCH_WINDOW_MS (default: 0 = scheduler disabled)
+  - EMBED_MAX_BATCH (default: 64)
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+# Upper bounds of the batch-size histogram buckets
+_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class _Request:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+class EmbeddingScheduler:
+    def __init__(self, embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+                 window_ms: float = 5.0, max_batch: int = 64):
+        self.embed_fn = embed_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._carry: Optional[_Request] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # metrics
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.bypassed = 0
+        self.max_queue_depth = 0
+        self.batch_histogram = {b: 0 for b in _BATCH_BUCKETS}
+        self.batch_histogram["inf"] = 0
+
+    def _ensure_worker(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embed-scheduler", daemon=True)
+                    self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queue texts for the next batch. The future resolves to a float32 matrix."""
+        if self._closed:
+            raise RuntimeError("embedding scheduler is closed")
+        req = _Request(list(texts))
+        self._ensure_worker()
+        self._queue.put(req)
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return req.future
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # Requests that already fill a batch gain nothing from waiting
+        if len(texts) >= self.max_batch:
+            with self._lock:
+                self.bypassed += 1
+                self.requests += 1
+                self.texts += len(texts)
+            return np.asarray(self.embed_fn(list(texts)), dtype=np.float32)
+        return self.submit(texts).result()
+
+    def _next(self, timeout: Optional[float]) -> Optional[_Request]:
+        if self._carry is not None:
+            req, self._carry = self._carry, None
+            return req
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _run(self) -> None:
+        try:
+            self._loop()
+        finally:
+            # anything submitted while closing is failed rather than left hanging
+            while True:
+                try:
+                    req = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if req is not None:
+                    req.future.set_exception(RuntimeError("embedding scheduler is closed"))
+
+    def _loop(self) -> None:
+        while True:
+            first = self._next(None)
+            if first is None:
+                return
+            batch = [first]
+            size = len(first.texts)
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    req = self._next(remaining)
+                except queue.Empty:
+                    break
+                if req is None:
+                    self._closed = True
+                    break
+                if size + len(req.texts) > self.max_batch:
+                    self._carry = req
+                    break
+                batch.append(req)
+                size += len(req.texts)
+            self._execute(batch, size)
+            if self._closed and self._carry is None and self._queue.empty():
+                return
+
+    def _execute(self, batch: List[_Request], size: int) -> None:
+        all_texts: List[str] = []
+        for req in batch:
+            all_texts.extend(req.texts)
+        try:
+            vectors = np.asarray(self.embed_fn(all_texts), dtype=np.float32)
+        except Exception as e:
+            for req in batch:
+                req.future.set_exception(e)
+        else:
+            offset = 0
+            for req in batch:
+                req.future.set_result(vectors[offset:offset + len(req.texts)])
+                offset += len(req.texts)
+        with self._lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.texts += size
+            bucket = next((b for b in _BATCH_BUCKETS if size <= b), "inf")
+            self.batch_histogram[bucket] += 1
+
+    def stats(self) -> dict:
+        embedded_batches = self.batches + self.bypassed
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "queue_depth": self._queue.qsize() + (1 if self._carry is not None else 0),
+            "max_queue_depth": self.max_queue_depth,
+            "requests": self.requests,
+            "texts": self.texts,
+            "batches": self.batches,
+            "bypassed": self.bypassed,
+            "avg_batch_size": (self.texts / embedded_batches) if embedded_batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in self.batch_histogram.items()},
+        }
+
+    def close(self) -> None:
+        """Stop the worker after the queued requests have been served."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
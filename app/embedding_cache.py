@@ -0,0 +1,175 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Vectors are stored in SQLite keyed by (embedding model id, dimension,
+sha256 of the text), so re-ingesting a document or repeating a question
+never re-embeds identical text. Least-recently-used rows are evicted once
+the cache grows past EMBED_CACHE_MAX_ENTRIES.
+
+Env vars:
+  - EMBED_CACHE_ENABLED (default: true)
+  - EMBED_CACHE_PATH (default: ./data/cache/embeddings.sqlite3)
+  - EMBED_CACHE_MAX_ENTRIES (default: 500000)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+_CACHES: Dict[str, "EmbeddingCache"] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int = 500000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, dim INTEGER NOT NULL, sha TEXT NOT NULL,"
+            " vec BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, dim, sha))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def lookup(self, model_id: str, dim: int, shas: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Bulk lookup by text hash. Returns {sha: float32 vector} for the hits."""
+        found: Dict[str, np.ndarray] = {}
+        if not shas:
+            return found
+        now = time.time()
+        unique = list(dict.fromkeys(shas))
+        with self._lock:
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT sha, vec FROM embeddings WHERE model = ? AND dim = ? AND sha IN ({marks})",
+                    (model_id, dim, *batch),
+                ).fetchall()
+                for sha, blob in rows:
+                    found[sha] = np.frombuffer(blob, dtype=np.float32)
+                if rows:
+                    hit_shas = [r[0] for r in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND dim = ? AND sha IN ({','.join('?' * len(hit_shas))})",
+                        (now, model_id, dim, *hit_shas),
+                    )
+            self._conn.commit()
+        return found
+
+    def store(self, model_id: str, dim: int, items: Sequence[Tuple[str, np.ndarray]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(model_id, dim, sha, np.ascontiguousarray(vec, dtype=np.float32).tobytes(), now) for sha, vec in items]
+        with self._lock:
+            cur = self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dim, sha, vec, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._count += max(cur.rowcount, 0)
+            if self._count > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self) -> None:
+        # Other processes may share the file, so recount before trimming
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.evictions += excess
+        self._count -= excess
+
+    def _partition(self, model_id: str, dim: int, texts: List[str]):
+        shas = [text_sha256(t) for t in texts]
+        found = self.lookup(model_id, dim, shas)
+        missing: Dict[str, str] = {}
+        for sha, text in zip(shas, texts):
+            if sha not in found and sha not in missing:
+                missing[sha] = text
+        with self._lock:
+            self.hits += len(texts) - sum(1 for sha in shas if sha in missing)
+            self.misses += len(missing)
+        return shas, found, missing
+
+    def _assemble(self, model_id: str, dim: int, shas: List[str], found: Dict[str, np.ndarray],
+                  missing: Dict[str, str], computed) -> np.ndarray:
+        if missing:
+            new_items = list(zip(missing.keys(), np.asarray(computed, dtype=np.float32)))
+            self.store(model_id, dim, new_items)
+            found.update(new_items)
+        if not shas:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.stack([found[sha] for sha in shas]).astype(np.float32, copy=False)
+
+    def embed(self, model_id: str, dim: int, texts: List[str],
+              compute: Callable[[List[str]], Sequence[Sequence[float]]]) -> np.ndarray:
+        """Return a float32 (len(texts), d) matrix, calling compute only for uncached texts."""
+        shas, found, missing = self._partition(model_id, dim, texts)
+        computed = compute(list(missing.values())) if missing else None
+        return self._assemble(model_id, dim, shas, found, missing, computed)
+
+    async def aembed(self, model_id: str, dim: int, texts: List[str],
+                     acompute: Callable[[List[str]], Awaitable[Sequence[Sequence[float]]]]) -> np.ndarray:
+        """Async variant of embed: awaits acompute for the uncached texts."""
+        shas, found, missing = self._partition(model_id, dim, texts)
+        computed = await acompute(list(missing.values())) if missing else None
+        return self._assemble(model_id, dim, shas, found, missing, computed)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": int(self._count),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide cache for EMBED_CACHE_PATH, or None if disabled."""
+    if os.getenv("EMBED_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    path = os.getenv("EMBED_CACHE_PATH", "./data/cache/embeddings.sqlite3")
+    cache = _CACHES.get(path)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.get(path)
+            if cache is None:
+                cache = EmbeddingCache(path, max_entries=int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "500000")))
+                _CACHES[path] = cache
+    return cache
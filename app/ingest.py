@@ -1,31 +1,27 @@
-import io
+import bisect
+import codecs
+import hashlib
 import os
-from typing import List, Tuple
+import tempfile
+import time
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
 
 from .llm_provider import get_llm_and_embeddings
 from .chroma_client import get_chroma_collection
+from .ingest_manifest import IngestManifest, ManifestEntry, chunk_digest, file_sha256, get_ingest_manifest
+from .lexical_index import get_lexical_index
+from .pdf_extract import iter_pdf_pages
+from .response_cache import get_response_cache
+from .sharding import ingest_collection
 
 
-def extract_text_from_pdf_bytes(data: bytes) -> str:
-    """Try to extract text using PyMuPDF; fallback to pdfminer.six."""
-    try:
-        import fitz  # PyMuPDF
-        text_parts: List[str] = []
-        with fitz.open(stream=data, filetype="pdf") as doc:
-            for page in doc:
-                text_parts.append(page.get_text())
-        return "\n".join(text_parts).strip()
-    except Exception:
-        # fallback to pdfminer
-        try:
-            from pdfminer.high_level import extract_text
-            text = extract_text(io.BytesIO(data))
-            return (text or "").strip()
-        except Exception:
-            return ""
-
-
-def simple_chunk(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+
+
+def simple_chunk(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Naive fixed-size chunker with overlap."""
     if not text:
         return []
@@ -43,36 +39,382 @@ def simple_chunk(text: str, chunk_size: int = 800, overlap: int = 100) -> List[s
     return chunks
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+def _join_pages(pages: Iterable[str], starts: Optional[List[int]] = None) -> Iterator[str]:
+    """"\n".join(pages).strip(), streamed: whitespace is held back until more text follows it.
+
+    starts, if given, receives the character offset at which each page begins.
+    """
+    offset, started, pending = 0, False, ""
+    for page in pages:
+        if started:
+            pending += "\n"
+        else:
+            page = page.lstrip()
+            started = bool(page)
+        if starts is not None:
+            starts.append(offset + len(pending))
+        body = page.rstrip()
+        if body:
+            yield pending + body
+            offset += len(pending) + len(body)
+            pending = page[len(body):]
+        else:
+            pending += page
+
+
+def iter_text_file(path: str, block_size: int = 1 << 20) -> Iterator[str]:
+    """UTF-8 text of a file in blocks; multi-byte characters split across blocks are kept whole."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield decoder.decode(block)
+    yield decoder.decode(b"", final=True)
+
+
+def _digested(pages: Iterable[str], digests: List[bytes]) -> Iterator[str]:
+    for page in pages:
+        digests.append(chunk_digest(page))
+        yield page
+
+
+def iter_file_text(path: str, filename: str, page_starts: Optional[List[int]] = None,
+                   page_hashes: Optional[List[bytes]] = None) -> Iterator[str]:
+    """Text segments of a file on disk, chosen by the filename's extension.
+
+    For PDFs, page_starts receives each page's character offset and
+    page_hashes each page's digest (for the ingest manifest) as pages are read.
+    """
+    if filename.lower().endswith(".pdf"):
+        pages = iter_pdf_pages(path)
+        return _join_pages(_digested(pages, page_hashes) if page_hashes is not None else pages, page_starts)
+    return iter_text_file(path)
+
+
+def page_span(page_starts: List[int], start: int, length: int) -> dict:
+    """1-based first and last page of the text at start..start+length, for chunk metadata."""
+    last = start + max(0, length - 1)
+    return {"page_start": max(1, bisect.bisect_right(page_starts, start)),
+            "page_end": max(1, bisect.bisect_right(page_starts, last))}
+
+
+def iter_chunks(segments: Iterable[str], chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """simple_chunk over the concatenation of segments, holding at most one chunk plus one segment.
+
+    Chunk i starts at character i * (chunk_size - overlap) of the text.
+    """
+    buf = ""
+    for segment in segments:
+        buf += segment
+        start = 0
+        while len(buf) - start > chunk_size:
+            yield buf[start:start + chunk_size]
+            start += chunk_size - overlap
+        buf = buf[start:]
+    yield from simple_chunk(buf, chunk_size, overlap)
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
     _, embedder = get_llm_and_embeddings()
     vectors = embedder(texts)
-    return vectors
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _chunk_ids(metadata: dict, positions: Iterable[int]) -> List[str]:
+    return [f"doc_{metadata.get('source','upload')}_{i}" for i in positions]
+
+
+def _upsert_batch(collection, chunks: List[str], metadata: dict, positions: Iterable[int],
+                  extra: Optional[List[dict]] = None) -> List[str]:
+    """Embed and upsert the chunks at positions of a document (vector store and lexical index); returns their ids.
+
+    extra holds per-chunk metadata (e.g. pages) merged over the document's.
+    """
+    ids = _chunk_ids(metadata, positions)
+    metadatas = [dict(metadata, **e) for e in extra] if extra else [metadata] * len(chunks)
+    _write_batch(collection, ids, chunks, metadatas, embed_texts(chunks))
+    return ids
+
+
+def _write_batch(collection, ids: List[str], chunks: List[str], metadatas: List[dict], vectors: np.ndarray) -> None:
+    """Upsert embedded chunks into the vector store and the lexical index."""
+    collection.upsert(ids=ids, documents=chunks, metadatas=metadatas, embeddings=vectors.tolist())
+    lexical = get_lexical_index(collection.name)
+    if lexical is not None:
+        lexical.add(ids, chunks)
+
+
+def _refresh_batch(collection, metadata: dict, positions: List[int], extra: List[Optional[dict]]) -> List[str]:
+    """Rewrite the metadata of unchanged chunks (ingested_at, pages), reusing their stored text and vectors.
+
+    extra[k] is the per-chunk metadata of positions[k], if any. Returns the rewritten ids.
+    """
+    ids = _chunk_ids(metadata, positions)
+    stored = collection.get(ids=ids, include=["embeddings", "documents"])
+    rows = {id_: (doc, vec) for id_, doc, vec in zip(stored["ids"], stored.get("documents") or [],
+                                                      stored.get("embeddings") or [])}
+    keep = [k for k, id_ in enumerate(ids) if id_ in rows]
+    if keep:
+        collection.upsert(ids=[ids[k] for k in keep], documents=[rows[ids[k]][0] for k in keep],
+                          metadatas=[dict(metadata, **extra[k]) if extra[k] else metadata for k in keep],
+                          embeddings=[list(rows[ids[k]][1]) for k in keep])
+    return [ids[k] for k in keep]
+
+
+def refresh_unchanged(collection, metadata: dict, kept: List[Tuple[int, Optional[dict]]], batch_size: int) -> None:
+    """_refresh_batch over (position, per-chunk metadata) pairs, batch_size at a time."""
+    for start in range(0, len(kept), batch_size):
+        part = kept[start:start + batch_size]
+        _invalidate_answers(collection, _refresh_batch(collection, metadata, [i for i, _ in part],
+                                                       [e for _, e in part]))
+
+
+def _source_ids(collection, metadata: dict) -> List[str]:
+    if "source" not in metadata:
+        return []
+    found = collection.get(where={"source": metadata["source"]}, include=[])
+    return list(found.get("ids") or [])
+
+
+def _drop_stale(collection, metadata: dict, count: int) -> List[str]:
+    """A shorter re-upload of the same source leaves its old tail chunks behind: drop them."""
+    current = set(_chunk_ids(metadata, range(count)))
+    stale = [i for i in _source_ids(collection, metadata) if i not in current]
+    if stale:
+        collection.delete(ids=stale)
+        lexical = get_lexical_index(collection.name)
+        if lexical is not None:
+            lexical.delete(stale)
+    return stale
+
 
+def _invalidate_answers(collection, ids: List[str]) -> None:
+    """Cached answers built from these chunk ids may now be stale."""
+    cache = get_response_cache()
+    if cache is not None and ids:
+        cache.invalidate_chunks(collection.name, ids)
 
-def upsert_chunks(chunks: List[str], metadata: dict) -> Tuple[int, str]:
-    collection = get_chroma_collection()
-    ids = [f"doc_{metadata.get('source','upload')}_{i}" for i in range(len(chunks))]
-    vectors = embed_texts(chunks)
-    collection.upsert(ids=ids, documents=chunks, metadatas=[metadata] * len(chunks), embeddings=vectors)
+
+def upsert_chunks(chunks: List[str], metadata: dict, collection_name: Optional[str] = None) -> Tuple[int, str]:
+    collection = get_chroma_collection(collection_name)
+    ids = _upsert_batch(collection, chunks, metadata, range(len(chunks)))
+    _invalidate_answers(collection, ids + _drop_stale(collection, metadata, len(chunks)))
     return len(chunks), collection.name
 
 
-def ingest_file_bytes(filename: str, content: bytes) -> dict:
-    name_lower = filename.lower()
-    if name_lower.endswith(".pdf"):
-        text = extract_text_from_pdf_bytes(content)
-    elif name_lower.endswith(".txt"):
-        text = content.decode("utf-8", errors="ignore")
-    elif name_lower.endswith((".csv", ".tsv")):
-        # simple CSV/TSV to text rows
-        try:
-            decoded = content.decode("utf-8", errors="ignore")
-            text = decoded
-        except Exception:
-            text = ""
-    else:
-        text = content.decode("utf-8", errors="ignore")
-
-    chunks = simple_chunk(text)
-    count, coll = (0, "") if not chunks else upsert_chunks(chunks, metadata={"source": filename})
-    return {"filename": filename, "chunks": count, "collection": coll}
+# progress(stage, **counters), e.g. progress("embedding", pages=12, chunks=300, embedded=256)
+Progress = Callable[..., None]
+
+
+def _no_progress(stage: str, **counters: int) -> None:
+    pass
+
+
+class ChunkStreamResult(NamedTuple):
+    chunks: int
+    collection: str
+    embedded: int
+    deleted: int
+    hashes: List[bytes]
+    unchanged: bool
+
+
+def upsert_chunk_stream(chunks: Iterable[str], metadata: dict, collection_name: Optional[str] = None,
+                        batch_size: Optional[int] = None,
+                        chunk_metadata: Optional[Callable[[int, str], dict]] = None,
+                        previous: Optional[Sequence[bytes]] = None,
+                        progress: Optional[Progress] = None,
+                        same_content: Optional[Callable[[], bool]] = None) -> ChunkStreamResult:
+    """upsert_chunks for a chunk iterator: embeds and upserts batch_size chunks at a time.
+
+    chunk_metadata(i, chunk) adds per-chunk metadata. previous holds the chunk
+    digests of the version already in the collection; chunks whose digest is
+    unchanged at their position are not embedded again. Once the stream is in,
+    their metadata is rewritten with the text and vectors already stored,
+    unless same_content() says the extracted content is the previous
+    version's, in which case the result is unchanged. Stale tail
+    chunks of an earlier version are only dropped once the whole stream is in.
+    progress(stage, chunks=..., embedded=...) is called as chunks are read
+    ("extracting"), around each batch ("embedding") and before the cleanup
+    ("finalizing").
+
+    Env vars:
+      - INGEST_BATCH_CHUNKS: chunks per embed/upsert batch (default: 256)
+    """
+    batch_size = batch_size or int(os.getenv("INGEST_BATCH_CHUNKS", "256"))
+    collection = get_chroma_collection(collection_name)
+    report = progress or _no_progress
+    previous = previous or []
+    hashes: List[bytes] = []
+    embedded = 0
+    batch: List[str] = []
+    positions: List[int] = []
+    extra: List[dict] = []
+    # (position, per-chunk metadata) of unchanged chunks; their text is already stored
+    kept: List[Tuple[int, Optional[dict]]] = []
+    for i, chunk in enumerate(chunks):
+        digest = chunk_digest(chunk)
+        hashes.append(digest)
+        report("extracting", chunks=len(hashes), embedded=embedded)
+        pages = chunk_metadata(i, chunk) if chunk_metadata is not None else None
+        if i < len(previous) and previous[i] == digest:
+            kept.append((i, pages))
+            continue
+        if pages is not None:
+            extra.append(pages)
+        batch.append(chunk)
+        positions.append(i)
+        if len(batch) >= batch_size:
+            report("embedding", chunks=len(hashes), embedded=embedded)
+            _invalidate_answers(collection, _upsert_batch(collection, batch, metadata, positions, extra))
+            embedded += len(batch)
+            batch, positions, extra = [], [], []
+    if batch:
+        report("embedding", chunks=len(hashes), embedded=embedded)
+        _invalidate_answers(collection, _upsert_batch(collection, batch, metadata, positions, extra))
+        embedded += len(batch)
+    report("finalizing", chunks=len(hashes), embedded=embedded)
+    if hashes and embedded == 0 and len(hashes) == len(previous) and same_content is not None and same_content():
+        return ChunkStreamResult(len(hashes), collection.name, 0, 0, hashes, True)
+    refresh_unchanged(collection, metadata, kept, batch_size)
+    stale: List[str] = []
+    if hashes:
+        stale = _drop_stale(collection, metadata, len(hashes))
+        _invalidate_answers(collection, stale)
+    return ChunkStreamResult(len(hashes), collection.name, embedded, len(stale), hashes, False)
+
+
+def _metadata(filename: str, user: Optional[str]) -> dict:
+    metadata = {"source": filename, "ingested_at": int(time.time())}
+    if user:
+        metadata["user"] = user
+    return metadata
+
+
+def ingest_file_bytes(filename: str, content: bytes, user: Optional[str] = None,
+                      collection_name: Optional[str] = None) -> dict:
+    """Extract, chunk, embed and upsert one file.
+
+    Each chunk carries metadata {source, ingested_at (unix seconds), user?}
+    that retrieval `where` filters can select on. Chunks go to collection_name,
+    or by default to the user's shard (the one collection unless SHARD_BY=user).
+    The bytes go through a temporary file and ingest_file_path.
+    """
+    fd, path = tempfile.mkstemp(prefix="ingest-", suffix=os.path.splitext(filename)[1],
+                                dir=os.getenv("INGEST_SPOOL_DIR") or None)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(content)
+        return ingest_file_path(path, filename, user=user, collection_name=collection_name)
+    finally:
+        os.remove(path)
+
+
+def _hashed(segments: Iterable[str], digest) -> Iterator[str]:
+    for segment in segments:
+        digest.update(segment.encode("utf-8"))
+        yield segment
+
+
+def _manifest_entry(manifest: IngestManifest, collection_name: str, metadata: dict,
+                    user: Optional[str]) -> Optional[ManifestEntry]:
+    """The manifest's entry for a source, if it is the same user's and the collection still holds its chunks."""
+    entry = manifest.get(collection_name, metadata["source"])
+    if entry is None or entry.user != (user or "") or not entry.chunk_hashes:
+        return None
+    stored = _source_ids(get_chroma_collection(collection_name), metadata)
+    return entry if sorted(stored) == sorted(_chunk_ids(metadata, range(len(entry.chunk_hashes)))) else None
+
+
+def same_content(entry: Optional[ManifestEntry], text_hash: str, page_hashes: List[bytes]) -> bool:
+    """Whether a re-saved file extracted to the same text, page by page, as its manifest entry.
+
+    Its chunks and their page spans are then the stored ones, so nothing needs rewriting.
+    """
+    return entry is not None and entry.text_hash == text_hash and entry.page_hashes == page_hashes
+
+
+def _unchanged_result(manifest: IngestManifest, filename: str, collection_name: str, entry: ManifestEntry) -> dict:
+    manifest.skipped += 1
+    return {"filename": filename, "chunks": len(entry.chunk_hashes), "collection": collection_name,
+            "embedded": 0, "deleted": 0, "unchanged": True}
+
+
+def ingest_file_path(path: str, filename: Optional[str] = None, user: Optional[str] = None,
+                     collection_name: Optional[str] = None, progress: Optional[Progress] = None) -> dict:
+    """Streaming ingest of a file on disk.
+
+    Pages (or 1 MB text blocks) are chunked as they are read and embedded in
+    INGEST_BATCH_CHUNKS batches, so memory depends on the batch size rather
+    than the file size. PDF chunks also carry page_start/page_end (1-based).
+
+    With the ingest manifest (app/ingest_manifest.py) an unchanged file is
+    skipped, and a changed one only embeds the chunks that differ. A file
+    whose bytes changed but whose extracted text and pages did not (e.g. a
+    re-saved PDF) is reported unchanged and its chunks are left as they are. The result
+    reports how many chunks were embedded and deleted, and whether the file
+    was unchanged. progress gets the stage plus pages, chunks and embedded counts.
+    """
+    page_starts: List[int] = []
+
+    def report(stage: str, **counters: int) -> None:
+        if progress is not None:
+            progress(stage, pages=len(page_starts), **counters)
+
+    report("hashing", chunks=0, embedded=0)
+    filename = filename or os.path.basename(path)
+    collection_name = collection_name or ingest_collection(user)
+    metadata = _metadata(filename, user)
+    manifest = get_ingest_manifest()
+    file_hash = file_sha256(path) if manifest is not None else None
+    previous = None
+    entry = _manifest_entry(manifest, collection_name, metadata, user) if manifest is not None else None
+    if entry is not None:
+        if entry.file_hash == file_hash:
+            return _unchanged_result(manifest, filename, collection_name, entry)
+        previous = entry.chunk_hashes
+
+    text_hash = hashlib.sha256()
+    page_hashes: List[bytes] = []
+    chunks = iter_chunks(_hashed(iter_file_text(path, filename, page_starts, page_hashes), text_hash))
+
+    def pages(i: int, chunk: str) -> dict:
+        return page_span(page_starts, i * (CHUNK_SIZE - CHUNK_OVERLAP), len(chunk))
+
+    result = upsert_chunk_stream(chunks, metadata, collection_name, previous=previous,
+                                 chunk_metadata=pages if filename.lower().endswith(".pdf") else None,
+                                 progress=report,
+                                 same_content=lambda: same_content(entry, text_hash.hexdigest(), page_hashes))
+    if manifest is not None and result.chunks:
+        manifest.record(collection_name, filename, user or "", file_hash, text_hash.hexdigest(), result.hashes,
+                        page_hashes)
+        if result.unchanged:
+            manifest.skipped += 1
+    return {"filename": filename, "chunks": result.chunks, "collection": result.collection if result.chunks else "",
+            "embedded": result.embedded, "deleted": result.deleted, "unchanged": result.unchanged}
+
+
+async def spool_upload(upload, directory: Optional[str] = None, block_size: int = 1 << 20) -> str:
+    """Copy an upload (anything with an async read(n)) to a temporary file; returns its path.
+
+    The caller removes the file. Env vars:
+      - INGEST_SPOOL_DIR: where uploads are spooled (default: the system temp dir)
+    """
+    directory = directory or os.getenv("INGEST_SPOOL_DIR") or None
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    suffix = os.path.splitext(getattr(upload, "filename", None) or "")[1]
+    fd, path = tempfile.mkstemp(prefix="ingest-", suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await upload.read(block_size)
+                if not block:
+                    break
+                out.write(block)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
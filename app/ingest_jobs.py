@@ -0,0 +1,342 @@
+"""
+Background ingest jobs.
+
+POST /ingest/jobs spools the upload under INGEST_JOBS_DIR, records a job in a
+small SQLite table and returns its id at once; INGEST_JOB_WORKERS threads run
+ingest_file_path on queued jobs. A job reports its stage (queued, hashing,
+extracting, embedding, finalizing, done or failed), progress counters
+(pages, chunks, embedded, deleted) and per-stage timings. Jobs that were
+queued when the process stopped are picked up again on start; finished jobs
+are pruned after INGEST_JOB_RETENTION_SECONDS.
+
+Several API processes may share INGEST_JOBS_DIR. A running job holds a lease
+(owner and expiry) that its process renews every third of
+INGEST_JOB_LEASE_SECONDS. Only jobs whose lease ran out, because their
+process died, are queued again, by whichever process notices first.
+
+Env vars:
+  - INGEST_JOBS_DIR (default: ./data/jobs)
+  - INGEST_JOB_WORKERS (default: 2)
+  - INGEST_JOB_RETENTION_SECONDS (default: 604800 = 7 days)
+  - INGEST_JOB_LEASE_SECONDS (default: 60)
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from .ingest import ingest_file_path
+
+logger = logging.getLogger(__name__)
+
+_QUEUE: Optional["IngestJobQueue"] = None
+_QUEUE_LOCK = threading.Lock()
+
+_COLUMNS = ("id", "user", "filename", "path", "collection", "status", "stage", "pages", "chunks", "embedded",
+            "deleted", "timings", "result", "error", "created_at", "started_at", "finished_at")
+# lease bookkeeping, kept out of job responses
+_LEASE_COLUMNS = {"owner": "TEXT", "lease_until": "REAL"}
+# progress is written to the table at most this often (stage changes always are)
+_FLUSH_SECONDS = 0.5
+
+
+class IngestJobQueue:
+    def __init__(self, directory: str, workers: int = 2, retention_seconds: float = 7 * 86400,
+                 lease_seconds: float = 60.0):
+        self.directory = directory
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        # identifies this queue's leases among the processes sharing the table
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.uploads = os.path.join(directory, "uploads")
+        os.makedirs(self.uploads, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, user TEXT NOT NULL, filename TEXT NOT NULL, path TEXT NOT NULL,"
+            " collection TEXT NOT NULL, status TEXT NOT NULL, stage TEXT NOT NULL,"
+            " pages INTEGER NOT NULL DEFAULT 0, chunks INTEGER NOT NULL DEFAULT 0,"
+            " embedded INTEGER NOT NULL DEFAULT 0, deleted INTEGER NOT NULL DEFAULT 0,"
+            " timings TEXT NOT NULL DEFAULT '{}', result TEXT, error TEXT,"
+            " created_at REAL NOT NULL, started_at REAL, finished_at REAL, owner TEXT, lease_until REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, kind in _LEASE_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user, created_at)")
+        self._conn.commit()
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        # workers still running, and whether close() left the connection for the last of them
+        self._live = 0
+        self._close_pending = False
+        self._closed = False
+        self.completed = 0
+        self.failed = 0
+        self.reclaimed = 0
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        """Prune old jobs, requeue unfinished ones (oldest first) and start the workers."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = self._conn.execute(
+                "SELECT path FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)).fetchall()
+            self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+            self._conn.commit()
+            self._reclaim_locked()
+            pending = [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()]
+        for (path,) in expired:
+            _unlink(path)
+        for job_id in pending:
+            self._queue.put(job_id)
+        self._live = max(1, self.workers)
+        for i in range(self._live):
+            thread = threading.Thread(target=self._work, name=f"ingest-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._keep_leases, name="ingest-job-lease", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> bool:
+        """Let the workers finish their current job; queued jobs stay queued for the next start.
+
+        Returns whether every worker exited within timeout.
+        """
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        stopped = not any(thread.is_alive() for thread in self._threads)
+        self._threads = []
+        # jobs not yet claimed stay queued in the table
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return stopped
+
+    # ---- leases ----
+    def _keep_leases(self) -> None:
+        """Renew this process's leases and requeue jobs whose owner stopped renewing theirs."""
+        while not self._stopping.wait(self.lease_seconds / 3):
+            with self._lock:
+                if self._closed:
+                    return
+                self._conn.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                    (time.time() + self.lease_seconds, self.owner),
+                )
+                self._conn.commit()
+                reclaimed = self._reclaim_locked()
+            for job_id in reclaimed:
+                self._queue.put(job_id)
+
+    def _reclaim_locked(self) -> List[str]:
+        """Requeue running jobs whose lease expired; the ingest manifest skips the work they finished."""
+        ids = [r[0] for r in self._conn.execute(
+            "SELECT id FROM jobs WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)"
+            " ORDER BY created_at", (time.time(),)).fetchall()]
+        for job_id in ids:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', owner = NULL, lease_until = NULL"
+                " WHERE id = ? AND status = 'running'", (job_id,),
+            )
+        self._conn.commit()
+        self.reclaimed += len(ids)
+        return ids
+
+    # ---- jobs ----
+    def submit(self, path: str, filename: str, user: str, collection: str) -> dict:
+        """Queue an ingest of path (already under self.uploads; the job removes it when done)."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, user, filename, path, collection, status, stage, created_at)"
+                " VALUES (?, ?, ?, ?, ?, 'queued', 'queued', ?)",
+                (job_id, user, filename, path, collection, time.time()),
+            )
+            self._conn.commit()
+        self._queue.put(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._load(job_id)
+        if job is not None:
+            job.pop("path")
+        return job
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        """The job with its server-side spool path, which get() and list() leave out."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row is not None else None
+
+    def list(self, user: str, limit: int = 50) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE user = ? ORDER BY created_at DESC LIMIT ?",
+                (user, limit),
+            ).fetchall()
+        jobs = [_job(row) for row in rows]
+        for job in jobs:
+            job.pop("path")
+        return jobs
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def _work(self) -> None:
+        try:
+            while not self._stopping.is_set():
+                job_id = self._queue.get()
+                if job_id is None or self._stopping.is_set():
+                    return
+                try:
+                    self._run(job_id)
+                except Exception:
+                    logger.exception("ingest job %s crashed", job_id)
+        finally:
+            with self._lock:
+                self._live -= 1
+                if self._live == 0 and self._close_pending:
+                    self._close_locked()
+
+    def _run(self, job_id: str) -> None:
+        started = time.time()
+        with self._lock:
+            # claim the job: another worker (or process sharing the table) may have taken it
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'hashing', started_at = ?, error = NULL,"
+                " owner = ?, lease_until = ? WHERE id = ? AND status = 'queued'",
+                (started, self.owner, started + self.lease_seconds, job_id),
+            ).rowcount
+            self._conn.commit()
+        job = self._load(job_id)
+        if not claimed or job is None:
+            return
+        timings: Dict[str, float] = {"queued": round(started - job["created_at"], 3)}
+        state = {"stage": "hashing", "since": time.monotonic(), "flushed": 0.0}
+        latest: Dict[str, int] = {}
+
+        def lap(now: float) -> None:
+            timings[state["stage"]] = round(timings.get(state["stage"], 0.0) + now - state["since"], 3)
+            state["since"] = now
+
+        def progress(stage: str, **counters: int) -> None:
+            now = time.monotonic()
+            latest.update(counters)
+            changed = stage != state["stage"]
+            if changed:
+                lap(now)
+                state["stage"] = stage
+            if changed or now - state["flushed"] >= _FLUSH_SECONDS:
+                state["flushed"] = now
+                self._update(job_id, stage=stage, timings=json.dumps(timings), **counters)
+
+        try:
+            result = ingest_file_path(job["path"], job["filename"], user=job["user"],
+                                      collection_name=job["collection"], progress=progress)
+        except Exception as e:
+            lap(time.monotonic())
+            self.failed += 1
+            self._update(job_id, status="failed", stage="failed", error=str(e), timings=json.dumps(timings),
+                         finished_at=time.time(), **latest)
+            return
+        finally:
+            # finished either way: the spooled upload is not needed again
+            _unlink(job["path"])
+        lap(time.monotonic())
+        self.completed += 1
+        latest.update(chunks=result["chunks"], embedded=result["embedded"], deleted=result["deleted"])
+        self._update(job_id, status="done", stage="done", result=json.dumps(result), timings=json.dumps(timings),
+                     finished_at=time.time(), **latest)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": self.workers, "queued": self._queue.qsize(), "jobs": counts,
+                "completed": self.completed, "failed": self.failed, "reclaimed": self.reclaimed}
+
+    def close(self) -> None:
+        """Stop the workers; the connection closes once the last of them has exited."""
+        self.stop()
+        with self._lock:
+            if self._live > 0:
+                logger.warning("closing the ingest job queue with %d job(s) still running", self._live)
+                self._close_pending = True
+            else:
+                self._close_locked()
+
+    def _close_locked(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._conn.close()
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _job(row: tuple) -> dict:
+    job = dict(zip(_COLUMNS, row))
+    job["timings"] = json.loads(job["timings"] or "{}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["progress"] = {k: job.pop(k) for k in ("pages", "chunks", "embedded", "deleted")}
+    end = job["finished_at"] or time.time()
+    job["elapsed"] = round(end - job["created_at"], 3)
+    return job
+
+
+def get_ingest_jobs() -> IngestJobQueue:
+    """Return the process-wide job queue (started on first use)."""
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                q = IngestJobQueue(
+                    os.getenv("INGEST_JOBS_DIR", "./data/jobs"),
+                    workers=int(os.getenv("INGEST_JOB_WORKERS", "2")),
+                    retention_seconds=float(os.getenv("INGEST_JOB_RETENTION_SECONDS", str(7 * 86400))),
+                    lease_seconds=float(os.getenv("INGEST_JOB_LEASE_SECONDS", "60")),
+                )
+                q.start()
+                _QUEUE = q
+    return _QUEUE
+
+
+def ingest_job_stats() -> Optional[dict]:
+    return _QUEUE.stats() if _QUEUE is not None else None
+
+
+def close_ingest_jobs() -> None:
+    global _QUEUE
+    with _QUEUE_LOCK:
+        if _QUEUE is not None:
+            _QUEUE.close()
+            _QUEUE = None
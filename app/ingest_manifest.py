@@ -0,0 +1,140 @@
+"""
+Ingest manifest: what each collection last ingested from each source.
+
+For every (collection, source) the manifest keeps the uploading user and the
+sha256 of the file, of its extracted text, of each PDF page and of each chunk
+by position. Re-ingesting an unchanged file is then skipped outright, and a
+changed one only embeds the chunks whose content differs (removed chunks are
+deleted as before).
+
+Only digests are stored, never document text, so the manifest stays small
+and holds nothing a deleted document could be read back from.
+
+Env vars:
+  - INGEST_MANIFEST_ENABLED (default: true)
+  - INGEST_MANIFEST_PATH (default: ./data/cache/ingest_manifest.sqlite3)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+_MANIFESTS: Dict[str, "IngestManifest"] = {}
+_MANIFESTS_LOCK = threading.Lock()
+
+# chunk and page hashes are stored as one blob of fixed-width digests per document
+_DIGEST = 16
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_digest(chunk: str) -> bytes:
+    return hashlib.sha256(chunk.encode("utf-8")).digest()[:_DIGEST]
+
+
+def _digests(blob) -> List[bytes]:
+    blob = bytes(blob or b"")
+    return [blob[i:i + _DIGEST] for i in range(0, len(blob), _DIGEST)]
+
+
+class ManifestEntry(NamedTuple):
+    user: str
+    file_hash: str
+    text_hash: str
+    chunk_hashes: List[bytes]
+    updated_at: float
+    page_hashes: List[bytes]
+
+
+class IngestManifest:
+    def __init__(self, path: str):
+        self.path = path
+        self.skipped = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " collection TEXT NOT NULL, source TEXT NOT NULL, user TEXT NOT NULL, file_hash TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL, chunk_hashes BLOB NOT NULL, updated_at REAL NOT NULL,"
+            " page_hashes BLOB NOT NULL DEFAULT x'', PRIMARY KEY (collection, source))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        if "page_hashes" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN page_hashes BLOB NOT NULL DEFAULT x''")
+        # manifests written before pages were only digested cached their full text here
+        self._conn.execute("DROP TABLE IF EXISTS extracted_pages")
+        self._conn.execute("DROP TABLE IF EXISTS extracted")
+        self._conn.commit()
+
+    # ---- documents ----
+    def get(self, collection: str, source: str) -> Optional[ManifestEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user, file_hash, text_hash, chunk_hashes, updated_at, page_hashes FROM documents"
+                " WHERE collection = ? AND source = ?",
+                (collection, source),
+            ).fetchone()
+        if row is None:
+            return None
+        return ManifestEntry(row[0], row[1], row[2], _digests(row[3]), row[4], _digests(row[5]))
+
+    def record(self, collection: str, source: str, user: str, file_hash: str, text_hash: str,
+               chunk_hashes: List[bytes], page_hashes: Optional[List[bytes]] = None) -> None:
+        """page_hashes: chunk_digest of each extracted page, for PDFs."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents"
+                " (collection, source, user, file_hash, text_hash, chunk_hashes, updated_at, page_hashes)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection, source, user, file_hash, text_hash, b"".join(chunk_hashes), time.time(),
+                 b"".join(page_hashes or [])),
+            )
+            self._conn.commit()
+
+    def forget(self, collection: str, source: Optional[str] = None) -> None:
+        """Drop the entries of one source, or of the whole collection (after a reset)."""
+        with self._lock:
+            if source is None:
+                self._conn.execute("DELETE FROM documents WHERE collection = ?", (collection,))
+            else:
+                self._conn.execute("DELETE FROM documents WHERE collection = ? AND source = ?", (collection, source))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {
+            "path": self.path,
+            "documents": int(documents),
+            "skipped": self.skipped,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_ingest_manifest() -> Optional[IngestManifest]:
+    """Return the process-wide manifest for INGEST_MANIFEST_PATH, or None if disabled."""
+    if os.getenv("INGEST_MANIFEST_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    path = os.getenv("INGEST_MANIFEST_PATH", "./data/cache/ingest_manifest.sqlite3")
+    manifest = _MANIFESTS.get(path)
+    if manifest is None:
+        with _MANIFESTS_LOCK:
+            manifest = _MANIFESTS.get(path)
+            if manifest is None:
+                manifest = IngestManifest(path)
+                _MANIFESTS[path] = manifest
+    return manifest
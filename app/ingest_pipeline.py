@@ -0,0 +1,401 @@
+"""
+Pipelined bulk ingest of many documents.
+
+Documents move through three stages joined by bounded queues, so one file's
+extraction overlaps another's embedding and a third's upsert:
+
+  extract  INGEST_PIPELINE_EXTRACT_WORKERS threads hash, read and chunk files
+           (large PDFs still fan out to the PDF_EXTRACT_WORKERS pool)
+  embed    chunks of any documents are packed into INGEST_BATCH_CHUNKS
+           batches; up to INGEST_PIPELINE_EMBED_WORKERS batches embed at once
+  upsert   the calling thread writes batches in order, then finishes each
+           document (stale tail chunks, ingest manifest)
+
+Small files therefore share embedding batches instead of each paying for
+one. The ingest manifest still skips unchanged files and chunks, and the
+writer refreshes the metadata of unchanged chunks when it finishes their
+document, exactly as ingest_file_path does. Used by POST /ingest/bulk and scripts/bulk_ingest.py.
+
+Env vars:
+  - INGEST_PIPELINE_EXTRACT_WORKERS (default: 2)
+  - INGEST_PIPELINE_EMBED_WORKERS (default: 1)
+  - INGEST_PIPELINE_QUEUE_CHUNKS: chunks buffered ahead of the embed stage (default: 4 batches)
+  - INGEST_BULK_EXTENSIONS: files taken from directories and archives
+    (default: .pdf,.txt,.md,.csv,.json,.html,.htm,.xml)
+  - INGEST_BULK_MAX_FILES: files per bulk ingest, archive members included (default: 10000)
+  - INGEST_BULK_MAX_BYTES: bytes unpacked from all the archives of one bulk ingest (default: 2 GiB)
+"""
+import hashlib
+import os
+import posixpath
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import ingest
+from .chroma_client import get_chroma_collection
+from .ingest_manifest import ManifestEntry, chunk_digest, file_sha256, get_ingest_manifest
+from .pdf_extract import ordered_map
+from .sharding import ingest_collection
+
+_ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# end of the chunk stream
+_DONE = object()
+
+
+class _Document:
+    """One file on its way through the pipeline."""
+
+    def __init__(self, path: str, source: str, user: Optional[str], collection: str):
+        self.path = path
+        self.source = source
+        self.user = user
+        self.collection = collection
+        self.metadata = ingest._metadata(source, user)
+        self.pdf = source.lower().endswith(".pdf")
+        self.page_starts: List[int] = []
+        self.page_hashes: List[bytes] = []
+        self.entry: Optional[ManifestEntry] = None
+        # (position, per-chunk metadata) of chunks unchanged since the manifest entry
+        self.kept: List[Tuple[int, Optional[dict]]] = []
+        self.hashes: List[bytes] = []
+        self.file_hash: Optional[str] = None
+        self.text_hash = hashlib.sha256()
+        self.embedded = 0
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(_ARCHIVE_SUFFIXES)
+
+
+def _wanted(name: str) -> bool:
+    parts = name.replace("\\", "/").split("/")
+    if any(p.startswith(".") or p == "__MACOSX" for p in parts if p):
+        return False
+    extensions = os.getenv("INGEST_BULK_EXTENSIONS", ".pdf,.txt,.md,.csv,.json,.html,.htm,.xml")
+    return name.lower().endswith(tuple(e.strip().lower() for e in extensions.split(",") if e.strip()))
+
+
+def _member_path(name: str) -> Optional[str]:
+    """An archive member's normalised relative path, or None if it would escape the target directory."""
+    name = posixpath.normpath(name.replace("\\", "/"))
+    if name.startswith(("/", "../")) or name in (".", "..") or ":" in name.split("/")[0]:
+        return None
+    return name
+
+
+class UnpackBudget:
+    """Files and unpacked bytes one bulk ingest may still take, shared by all of its archives."""
+
+    def __init__(self, max_files: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_files = max_files or int(os.getenv("INGEST_BULK_MAX_FILES", "10000"))
+        self.max_bytes = max_bytes or int(os.getenv("INGEST_BULK_MAX_BYTES", str(2 << 30)))
+        self.files = 0
+        self.bytes = 0
+
+    def take_file(self) -> None:
+        if self.files >= self.max_files:
+            raise ValueError(f"bulk ingest has more than {self.max_files} files")
+        self.files += 1
+
+    def take_bytes(self, count: int) -> None:
+        self.bytes += count
+        if self.bytes > self.max_bytes:
+            raise ValueError(f"archives unpack to more than {self.max_bytes} bytes")
+
+
+def unpack_archive(path: str, dest: str, budget: Optional[UnpackBudget] = None) -> List[Tuple[str, str]]:
+    """Extract the wanted files of a zip or tar archive under dest; returns (path, source) pairs.
+
+    The source is the member's path inside the archive. Links, devices and
+    members pointing outside dest are skipped; ValueError if the archive is
+    unreadable or unpacks past the budget (by default a fresh one from
+    INGEST_BULK_MAX_FILES / INGEST_BULK_MAX_BYTES).
+    """
+    budget = budget or UnpackBudget()
+    items: List[Tuple[str, str]] = []
+
+    def copy(member_name: str, src) -> None:
+        source = _member_path(member_name)
+        if source is None or not _wanted(source):
+            return
+        budget.take_file()
+        target = os.path.join(dest, *source.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as out:
+            while True:
+                block = src.read(1 << 20)
+                if not block:
+                    break
+                budget.take_bytes(len(block))
+                out.write(block)
+        items.append((target, source))
+
+    try:
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        with zf.open(info) as src:
+                            copy(info.filename, src)
+        else:
+            with tarfile.open(path) as tf:
+                for member in tf:
+                    if member.isfile():
+                        src = tf.extractfile(member)
+                        if src is not None:
+                            copy(member.name, src)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ValueError(f"not a readable zip or tar archive ({type(e).__name__})")
+    return items
+
+
+def iter_directory(root: str) -> Iterator[Tuple[str, str]]:
+    """(path, source) for the wanted files under root, sources relative to root, in sorted order."""
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            source = os.path.relpath(path, root).replace(os.sep, "/")
+            if _wanted(source):
+                yield path, source
+
+
+def _put(q: "queue.Queue", item, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _extract(doc: _Document, chunks: "queue.Queue", stop: threading.Event) -> None:
+    """Hash and chunk one document onto the queue, ending with the document itself as its end marker."""
+    try:
+        manifest = get_ingest_manifest()
+        previous: List[bytes] = []
+        if manifest is not None:
+            doc.file_hash = file_sha256(doc.path)
+            doc.entry = ingest._manifest_entry(manifest, doc.collection, doc.metadata, doc.user)
+            if doc.entry is not None:
+                if doc.entry.file_hash == doc.file_hash:
+                    doc.result = ingest._unchanged_result(manifest, doc.source, doc.collection, doc.entry)
+                    return
+                previous = doc.entry.chunk_hashes
+        segments = ingest._hashed(ingest.iter_file_text(doc.path, doc.source, doc.page_starts, doc.page_hashes),
+                                  doc.text_hash)
+        for i, chunk in enumerate(ingest.iter_chunks(segments)):
+            if stop.is_set():
+                return
+            digest = chunk_digest(chunk)
+            doc.hashes.append(digest)
+            extra = ingest.page_span(doc.page_starts, i * (ingest.CHUNK_SIZE - ingest.CHUNK_OVERLAP),
+                                     len(chunk)) if doc.pdf else None
+            if i < len(previous) and previous[i] == digest:
+                doc.kept.append((i, extra))
+                continue
+            _put(chunks, (doc, i, chunk, extra), stop)
+    except Exception as e:
+        doc.error = str(e)
+    finally:
+        _put(chunks, doc, stop)
+
+
+def _batches(chunks: "queue.Queue", batch_size: int) -> Iterator[Tuple[list, List[_Document]]]:
+    """Pack the chunk stream into (chunks, finished documents) batches of up to batch_size chunks.
+
+    A document's end marker travels with the batch holding its last chunk,
+    so it is finished only after all of its chunks have been written.
+    """
+    batch: list = []
+    ended: List[_Document] = []
+    while True:
+        item = chunks.get()
+        if item is _DONE:
+            break
+        if isinstance(item, _Document):
+            ended.append(item)
+            if not batch:
+                yield [], ended
+                ended = []
+            continue
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch, ended
+            batch, ended = [], []
+    if batch or ended:
+        yield batch, ended
+
+
+def _embed(batch: list, ended: List[_Document]):
+    """Runs on the embed pool; an error fails the documents in the batch instead of the whole ingest."""
+    if not batch:
+        return batch, ended, None, None
+    try:
+        return batch, ended, ingest.embed_texts([chunk for _, _, chunk, _ in batch]), None
+    except Exception as e:
+        return batch, ended, None, str(e)
+
+
+def _write(batch: list, vectors, error: Optional[str]) -> None:
+    groups: Dict[str, List[int]] = {}
+    for k, (doc, _, _, _) in enumerate(batch):
+        groups.setdefault(doc.collection, []).append(k)
+    for name, rows in groups.items():
+        docs = {id(batch[k][0]): batch[k][0] for k in rows}
+        if error is None:
+            try:
+                collection = get_chroma_collection(name)
+                ids = [ingest._chunk_ids(batch[k][0].metadata, [batch[k][1]])[0] for k in rows]
+                metadatas = [dict(batch[k][0].metadata, **batch[k][3]) if batch[k][3] else batch[k][0].metadata
+                             for k in rows]
+                ingest._write_batch(collection, ids, [batch[k][2] for k in rows], metadatas, vectors[rows])
+                ingest._invalidate_answers(collection, ids)
+                for k in rows:
+                    batch[k][0].embedded += 1
+                continue
+            except Exception as e:
+                error = str(e)
+        for doc in docs.values():
+            doc.error = doc.error or error
+
+
+def _finish(doc: _Document, batch_size: int) -> dict:
+    """Refresh the document's unchanged chunks, drop its stale ones and record it in the manifest."""
+    if doc.error is not None:
+        return {"filename": doc.source, "error": doc.error}
+    if doc.result is not None:
+        return doc.result
+    deleted: List[str] = []
+    unchanged = False
+    if doc.hashes:
+        collection = get_chroma_collection(doc.collection)
+        unchanged = (doc.embedded == 0 and doc.entry is not None and len(doc.hashes) == len(doc.entry.chunk_hashes)
+                     and ingest.same_content(doc.entry, doc.text_hash.hexdigest(), doc.page_hashes))
+        if not unchanged:
+            ingest.refresh_unchanged(collection, doc.metadata, doc.kept, batch_size)
+            deleted = ingest._drop_stale(collection, doc.metadata, len(doc.hashes))
+            ingest._invalidate_answers(collection, deleted)
+        manifest = get_ingest_manifest()
+        if manifest is not None:
+            manifest.record(doc.collection, doc.source, doc.user or "", doc.file_hash, doc.text_hash.hexdigest(),
+                            doc.hashes, doc.page_hashes)
+            if unchanged:
+                manifest.skipped += 1
+    return {"filename": doc.source, "chunks": len(doc.hashes), "collection": doc.collection if doc.hashes else "",
+            "embedded": doc.embedded, "deleted": len(deleted), "unchanged": unchanged}
+
+
+def ingest_documents(items: Iterable[Tuple[str, str]], user: Optional[str] = None,
+                     collection_name: Optional[str] = None, batch_size: Optional[int] = None,
+                     extract_workers: Optional[int] = None, embed_workers: Optional[int] = None,
+                     on_document: Optional[Callable[[dict], None]] = None) -> dict:
+    """Ingest (path, source) pairs through the pipeline; returns totals and one result per file.
+
+    Files go to collection_name, or by default to the user's shard. A file
+    that fails is reported with an error and does not stop the others; a
+    source named twice is only ingested the first time, and its later copies
+    are reported as skipped. on_document gets each file's result as it
+    completes, so documents = succeeded + failed + skipped.
+    """
+    batch_size = batch_size or int(os.getenv("INGEST_BATCH_CHUNKS", "256"))
+    extract_workers = max(1, extract_workers or int(os.getenv("INGEST_PIPELINE_EXTRACT_WORKERS", "2")))
+    embed_workers = max(1, embed_workers or int(os.getenv("INGEST_PIPELINE_EMBED_WORKERS", "1")))
+    collection_name = collection_name or ingest_collection(user)
+    chunks: "queue.Queue" = queue.Queue(maxsize=int(os.getenv("INGEST_PIPELINE_QUEUE_CHUNKS", str(4 * batch_size))))
+    stop = threading.Event()
+    results: List[dict] = []
+    results_lock = threading.Lock()
+    seen = set()
+    sources = iter(items)
+    sources_lock = threading.Lock()
+
+    def report(result: dict) -> None:
+        with results_lock:
+            results.append(result)
+            if on_document is not None:
+                on_document(result)
+
+    def next_document() -> Optional[_Document]:
+        with sources_lock:
+            for path, source in sources:
+                if source in seen:
+                    report({"filename": source, "skipped": "duplicate source in this ingest"})
+                    continue
+                seen.add(source)
+                return _Document(path, source, user, collection_name)
+        return None
+
+    def extractor() -> None:
+        while not stop.is_set():
+            doc = next_document()
+            if doc is None:
+                return
+            _extract(doc, chunks, stop)
+
+    def complete(doc: _Document) -> None:
+        try:
+            result = _finish(doc, batch_size)
+        except Exception as e:
+            result = {"filename": doc.source, "error": str(e)}
+        report(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=extractor, name=f"ingest-extract-{i}", daemon=True)
+               for i in range(extract_workers)]
+    for thread in threads:
+        thread.start()
+
+    def closer() -> None:
+        for thread in threads:
+            thread.join()
+        _put(chunks, _DONE, stop)
+
+    threading.Thread(target=closer, name="ingest-extract-join", daemon=True).start()
+    try:
+        with ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="ingest-embed") as pool:
+            for batch, ended, vectors, error in ordered_map(pool, _embed, _batches(chunks, batch_size),
+                                                            window=2 * embed_workers):
+                _write(batch, vectors, error)
+                for doc in ended:
+                    complete(doc)
+    finally:
+        stop.set()
+    seconds = time.perf_counter() - started
+    done = [r for r in results if "error" not in r and "skipped" not in r]
+    return {
+        "documents": len(results),
+        "chunks": sum(r["chunks"] for r in done),
+        "embedded": sum(r["embedded"] for r in done),
+        "deleted": sum(r["deleted"] for r in done),
+        "unchanged": sum(1 for r in done if r["unchanged"]),
+        "failed": sum(1 for r in results if "error" in r),
+        "skipped": sum(1 for r in results if "skipped" in r),
+        "seconds": round(seconds, 3),
+        "documents_per_second": round(len(results) / seconds, 2) if seconds > 0 else 0.0,
+        "files": results,
+    }
+
+
+def collect_paths(paths: Iterable[str], scratch: str) -> List[Tuple[str, str]]:
+    """(path, source) pairs for files, directories (walked) and archives (unpacked under scratch).
+
+    The archives share one UnpackBudget; local files and directories are not limited.
+    """
+    items: List[Tuple[str, str]] = []
+    budget = UnpackBudget()
+    for n, path in enumerate(paths):
+        if os.path.isdir(path):
+            items.extend(iter_directory(path))
+        elif is_archive(path):
+            items.extend(unpack_archive(path, os.path.join(scratch, str(n)), budget))
+        else:
+            items.append((path, os.path.basename(path)))
+    return items
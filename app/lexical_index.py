@@ -0,0 +1,337 @@
+"""
+BM25 lexical index over ingested chunks, one SQLite file per collection.
+
+Embeddings blur exact tokens such as tickers, form numbers or "Q3"; this
+index matches them literally. Text is lowercased and split into word tokens
+that keep inner ".", "-" and "/" (so "10-K", "BRK.B" and "Q3" stay whole).
+
+Every add() appends one postings block per term: the chunks' doc numbers
+delta-encoded and the term frequencies, each stored in the narrowest
+unsigned integer width that fits, which is usually one byte per entry.
+Re-added chunk ids and delete()d ids are marked dead and skipped at query
+time. Once dead docs pass a quarter of the index, compact() rewrites each
+term's blocks into one block of live docs only.
+
+Doc lengths and liveness are mirrored in NumPy arrays so a query only reads
+the postings of its own terms. Other processes' commits are picked up through
+PRAGMA data_version.
+
+Env vars:
+  - LEXICAL_INDEX_ENABLED (default: true with RETRIEVAL_MODE=hybrid, else false:
+    the vector-only mode never reads the postings)
+  - LEXICAL_INDEX_DIR (default: ./data/lexical), holding <collection>.sqlite3
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+_WIDTHS = (np.uint8, np.uint16, np.uint32, np.uint64)
+_TOKEN_RE = re.compile(r"\w+(?:[./-]\w+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which "
+    "who will with".split()
+)
+
+_INDEXES: Dict[str, "LexicalIndex"] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def _pack(values: np.ndarray) -> bytes:
+    """One width byte, then the values in the narrowest unsigned dtype that holds them."""
+    top = int(values.max()) if len(values) else 0
+    for code, dtype in enumerate(_WIDTHS):
+        if top <= np.iinfo(dtype).max:
+            return bytes([code]) + values.astype(dtype).tobytes()
+    raise ValueError("value out of range")
+
+
+def _unpack(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=_WIDTHS[blob[0]], offset=1).astype(np.int64)
+
+
+def _pack_docs(docs: np.ndarray) -> bytes:
+    # first doc number, then the gaps between consecutive ones
+    return _pack(np.diff(docs, prepend=0))
+
+
+def _unpack_docs(blob: bytes) -> np.ndarray:
+    return np.cumsum(_unpack(blob))
+
+
+class LexicalIndex:
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, compact_ratio: float = 0.25,
+                 compact_min_docs: int = 1000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.compact_min_docs = compact_min_docs
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # autocommit mode: writes use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, length INTEGER NOT NULL,"
+            " live INTEGER NOT NULL DEFAULT 1)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_chunk ON docs(chunk_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, docs BLOB NOT NULL, tfs BLOB NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_term ON postings(term)")
+        self._version = None
+        with self._lock:
+            self._sync_locked()
+
+    # ---- in-memory mirror of the docs table ----
+    def _load_locked(self) -> None:
+        rows = np.asarray(self._conn.execute("SELECT doc, length, live FROM docs").fetchall(),
+                          dtype=np.int64).reshape(-1, 3)
+        size = int(rows[:, 0].max()) + 1 if len(rows) else 0
+        self._lengths = np.zeros(size, dtype=np.int32)
+        self._live = np.zeros(size, dtype=bool)
+        self._lengths[rows[:, 0]] = rows[:, 1]
+        self._live[rows[:, 0]] = rows[:, 2] > 0
+        self._dead = int(len(rows) - self._live.sum())
+        self._total_length = int(self._lengths[self._live].sum())
+
+    def _sync_locked(self) -> None:
+        """Reload the mirror when another connection has committed since the last look."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            self._load_locked()
+            self._version = version
+
+    def _mark_dead_locked(self, chunk_ids: Sequence[str]) -> int:
+        dead: List[int] = []
+        for start in range(0, len(chunk_ids), _SQL_BATCH):
+            batch = list(chunk_ids[start:start + _SQL_BATCH])
+            marks = ",".join("?" * len(batch))
+            dead.extend(r[0] for r in self._conn.execute(
+                f"SELECT doc FROM docs WHERE live = 1 AND chunk_id IN ({marks})", batch).fetchall())
+            self._conn.execute(f"UPDATE docs SET live = 0 WHERE live = 1 AND chunk_id IN ({marks})", batch)
+        if dead:
+            rows = np.asarray(dead, dtype=np.int64)
+            self._live[rows] = False
+            self._total_length -= int(self._lengths[rows].sum())
+            self._dead += len(rows)
+        return len(dead)
+
+    # ---- writes ----
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str]) -> None:
+        """Index chunks, replacing any earlier version of the same ids."""
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync_locked()
+                self._mark_dead_locked(list(chunk_ids))
+                start = len(self._lengths)
+                lengths = np.zeros(len(chunk_ids), dtype=np.int32)
+                postings: Dict[str, Tuple[List[int], List[int]]] = {}
+                for offset, text in enumerate(texts):
+                    tokens = tokenize(text)
+                    lengths[offset] = len(tokens)
+                    for term, tf in Counter(tokens).items():
+                        docs, tfs = postings.setdefault(term, ([], []))
+                        docs.append(start + offset)
+                        tfs.append(tf)
+                self._conn.executemany(
+                    "INSERT INTO docs (doc, chunk_id, length, live) VALUES (?, ?, ?, 1)",
+                    [(start + i, cid, int(n)) for i, (cid, n) in enumerate(zip(chunk_ids, lengths))],
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, docs, tfs) VALUES (?, ?, ?)",
+                    [(term, _pack_docs(np.asarray(docs, dtype=np.int64)), _pack(np.asarray(tfs, dtype=np.int64)))
+                     for term, (docs, tfs) in postings.items()],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._load_locked()
+                raise
+            self._lengths = np.concatenate([self._lengths, lengths])
+            self._live = np.concatenate([self._live, np.ones(len(lengths), dtype=bool)])
+            self._total_length += int(lengths.sum())
+        self._maybe_compact()
+
+    def delete(self, chunk_ids: Sequence[str]) -> int:
+        """Mark chunks dead; returns how many were live."""
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync_locked()
+                removed = self._mark_dead_locked(list(chunk_ids))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._load_locked()
+                raise
+        self._maybe_compact()
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.execute("COMMIT")
+            self._load_locked()
+
+    def _maybe_compact(self) -> None:
+        with self._lock:
+            due = self._dead >= self.compact_min_docs and self._dead >= self.compact_ratio * len(self._lengths)
+        if due:
+            self.compact()
+
+    def compact(self) -> int:
+        """Rewrite every term's blocks as one block of live docs; returns the dead docs dropped."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync_locked()
+                live = self._live
+                merged = []
+                term, docs, tfs = None, [], []
+                for row_term, doc_blob, tf_blob in self._conn.execute(
+                        "SELECT term, docs, tfs FROM postings ORDER BY term, rowid").fetchall():
+                    if row_term != term:
+                        if docs:
+                            merged.append((term, docs, tfs))
+                        term, docs, tfs = row_term, [], []
+                    docs.append(_unpack_docs(doc_blob))
+                    tfs.append(_unpack(tf_blob))
+                if docs:
+                    merged.append((term, docs, tfs))
+                rows = []
+                for term, docs, tfs in merged:
+                    d, t = np.concatenate(docs), np.concatenate(tfs)
+                    keep = live[d]
+                    if keep.any():
+                        rows.append((term, _pack_docs(d[keep]), _pack(t[keep])))
+                self._conn.execute("DELETE FROM postings")
+                self._conn.executemany("INSERT INTO postings (term, docs, tfs) VALUES (?, ?, ?)", rows)
+                dropped = self._conn.execute("DELETE FROM docs WHERE live = 0").rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._load_locked()
+                raise
+            self._dead = 0
+            return dropped
+
+    # ---- search ----
+    def search(self, text: str, k: int = 10) -> List[Tuple[str, float]]:
+        """(chunk id, BM25 score) of the k best live chunks, best first."""
+        return self.search_batch([text], k)[0]
+
+    def search_batch(self, texts: Sequence[str], k: int = 10) -> List[List[Tuple[str, float]]]:
+        terms_per_text = [list(dict.fromkeys(tokenize(t))) for t in texts]
+        all_terms = list(dict.fromkeys(t for terms in terms_per_text for t in terms))
+        with self._lock:
+            self._sync_locked()
+            lengths, live = self._lengths, self._live
+            n_live = int(live.sum())
+            avg_length = self._total_length / n_live if n_live else 0.0
+            postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+            for start in range(0, len(all_terms), _SQL_BATCH):
+                batch = all_terms[start:start + _SQL_BATCH]
+                blocks: Dict[str, Tuple[List[np.ndarray], List[np.ndarray]]] = {}
+                for term, doc_blob, tf_blob in self._conn.execute(
+                        f"SELECT term, docs, tfs FROM postings WHERE term IN ({','.join('?' * len(batch))})",
+                        batch).fetchall():
+                    docs, tfs = blocks.setdefault(term, ([], []))
+                    docs.append(_unpack_docs(doc_blob))
+                    tfs.append(_unpack(tf_blob))
+                for term, (docs, tfs) in blocks.items():
+                    d, t = np.concatenate(docs), np.concatenate(tfs)
+                    keep = live[d]
+                    postings[term] = (d[keep], t[keep])
+        results = []
+        for terms in terms_per_text:
+            parts = [(postings[t], t) for t in terms if t in postings and len(postings[t][0])]
+            if not parts or not n_live:
+                results.append([])
+                continue
+            docs_all, weights = [], []
+            for (docs, tfs), _ in parts:
+                idf = math.log(1.0 + (n_live - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * lengths[docs] / max(avg_length, 1e-9))
+                weights.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+                docs_all.append(docs)
+            uniq, inverse = np.unique(np.concatenate(docs_all), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(weights))
+            kk = min(k, len(uniq))
+            best = np.argpartition(-scores, kk - 1)[:kk] if kk < len(uniq) else np.arange(len(uniq))
+            best = best[np.argsort(-scores[best], kind="stable")]
+            results.append([(int(uniq[i]), float(scores[i])) for i in best])
+        wanted = sorted({doc for found in results for doc, _ in found})
+        names: Dict[int, str] = {}
+        with self._lock:
+            for start in range(0, len(wanted), _SQL_BATCH):
+                batch = wanted[start:start + _SQL_BATCH]
+                names.update(self._conn.execute(
+                    f"SELECT doc, chunk_id FROM docs WHERE doc IN ({','.join('?' * len(batch))})", batch).fetchall())
+        return [[(names[doc], score) for doc, score in found if doc in names] for found in results]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._sync_locked()
+            terms, blocks = self._conn.execute("SELECT COUNT(DISTINCT term), COUNT(*) FROM postings").fetchone()
+            return {
+                "path": self.path,
+                "docs": int(self._live.sum()),
+                "dead_docs": self._dead,
+                "terms": int(terms),
+                "blocks": int(blocks),
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _index_path(collection_name: str) -> str:
+    return os.path.join(os.getenv("LEXICAL_INDEX_DIR", "./data/lexical"), f"{collection_name}.sqlite3")
+
+
+def get_lexical_index(collection_name: str) -> Optional[LexicalIndex]:
+    """Return the process-wide lexical index of a collection, or None if disabled."""
+    default = "true" if os.getenv("RETRIEVAL_MODE", "vector").lower() == "hybrid" else "false"
+    if os.getenv("LEXICAL_INDEX_ENABLED", default).lower() not in ("1", "true", "yes"):
+        return None
+    path = _index_path(collection_name)
+    index = _INDEXES.get(path)
+    if index is None:
+        with _INDEXES_LOCK:
+            index = _INDEXES.get(path)
+            if index is None:
+                index = LexicalIndex(path)
+                _INDEXES[path] = index
+    return index
+
+
+def drop_lexical_index(collection_name: str) -> None:
+    """Forget the cached handle of an idle collection's index; the next get reopens the file.
+
+    The connection is left to close when the last in-flight search releases it.
+    """
+    with _INDEXES_LOCK:
+        _INDEXES.pop(_index_path(collection_name), None)
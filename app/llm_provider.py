@@ -1,5 +1,16 @@
+import asyncio
 import os
-from typing import Callable, Tuple, Optional
+import sqlite3
+import threading
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple, Optional
+
+import numpy as np
+
+from .embed_pool import close_embedding_pools, get_embedding_pool
+from .embed_scheduler import EmbeddingScheduler
+from .embedding_cache import get_embedding_cache
+from .provider_limits import EMBED_LIMITER_SUFFIX, get_provider_limiter, reset_provider_limiters
 
 # This module exposes get_llm and get_embeddings factories.
 # Optional heavy ML/LLM libraries are imported lazily. If you see
@@ -7,6 +18,120 @@ from typing import Callable, Tuple, Optional
 # optional packages into the project's virtualenv or configure the
 # Python interpreter in your editor to use `.venv`.
 
+# Process-wide registry: provider closures keyed by provider config, and loaded
+# models/clients keyed by whatever identifies them (model name, path, api key).
+_PROVIDERS: Dict[tuple, Tuple[Callable, Callable]] = {}
+_MODELS: Dict[tuple, Any] = {}
+_SCHEDULERS: Dict[tuple, EmbeddingScheduler] = {}
+_ASYNC_PROVIDERS: Dict[tuple, Tuple[Callable[[str], Awaitable[Any]], Callable]] = {}
+_STREAM_PROVIDERS: Dict[tuple, Callable[[str], AsyncIterator[str]]] = {}
+# (event loop, httpx.AsyncClient) shared by every async provider call
+_ASYNC_HTTP: Optional[Tuple[Any, Any]] = None
+_REGISTRY_LOCK = threading.RLock()
+
+
+def _get_model(key: tuple, factory: Callable[[], Any]) -> Any:
+    """Return the cached object for key, building it once with factory.
+
+    Factories may return None to record "unavailable" so failed optional
+    imports are not retried on every request.
+    """
+    try:
+        return _MODELS[key]
+    except KeyError:
+        pass
+    with _REGISTRY_LOCK:
+        if key not in _MODELS:
+            _MODELS[key] = factory()
+        return _MODELS[key]
+
+
+# Native output sizes of the OpenAI embedding models (part of the cache key)
+_OPENAI_EMBED_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def hash_embed(texts: List[str], dim: int) -> np.ndarray:
+    """Deterministic byte-hash embedding used when no real embedder is available.
+
+    Component j of a text's vector is the sum of its UTF-8 bytes at positions
+    i with i % dim == j, modulo 1000 (the same values the original per-byte
+    loop produced). All texts are scattered in one bincount.
+    Returns a contiguous float32 (len(texts), dim) matrix.
+    """
+    encoded = [t.encode("utf-8") for t in texts]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros((len(encoded), dim), dtype=np.float32)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    rows = np.repeat(np.arange(len(encoded), dtype=np.int64), lengths)
+    positions = np.arange(total, dtype=np.int64) - np.repeat(starts, lengths)
+    flat = rows * dim + positions % dim
+    sums = np.bincount(flat, weights=data, minlength=len(encoded) * dim)
+    return np.ascontiguousarray(np.mod(sums, 1000).reshape(len(encoded), dim), dtype=np.float32)
+
+
+def _cached_embed(model_id: str, dim: int, texts: List[str], compute: Callable) -> np.ndarray:
+    """Embed through the persistent embedding cache when it is enabled."""
+    cache = get_embedding_cache()
+    if cache is not None:
+        try:
+            return cache.embed(model_id, dim, list(texts), compute)
+        except sqlite3.Error:
+            # a broken cache file must not change which embedder answers
+            pass
+    return np.asarray(compute(texts), dtype=np.float32)
+
+
+async def _acached_embed(model_id: str, dim: int, texts: List[str], acompute: Callable) -> np.ndarray:
+    cache = get_embedding_cache()
+    if cache is not None:
+        try:
+            return await cache.aembed(model_id, dim, list(texts), acompute)
+        except sqlite3.Error:
+            pass
+    return np.asarray(await acompute(texts), dtype=np.float32)
+
+
+def get_async_http_client():
+    """Return the pooled keep-alive httpx.AsyncClient for the running event loop.
+
+    Env vars:
+      - LLM_HTTP_MAX_CONNECTIONS (default: 100)
+      - LLM_HTTP_MAX_KEEPALIVE (default: 20)
+      - LLM_HTTP_KEEPALIVE_EXPIRY seconds (default: 30)
+      - LLM_HTTP_TIMEOUT seconds (default: 60)
+      - LLM_HTTP_CONNECT_TIMEOUT seconds (default: 10)
+    """
+    global _ASYNC_HTTP
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    if _ASYNC_HTTP is None or _ASYNC_HTTP[0] is not loop or _ASYNC_HTTP[1].is_closed:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30")),
+        )
+        timeout = httpx.Timeout(float(os.getenv("LLM_HTTP_TIMEOUT", "60")),
+                                connect=float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", "10")))
+        _ASYNC_HTTP = (loop, httpx.AsyncClient(limits=limits, timeout=timeout))
+    return _ASYNC_HTTP[1]
+
+
+async def close_async_http_client() -> None:
+    global _ASYNC_HTTP
+    if _ASYNC_HTTP is not None:
+        client = _ASYNC_HTTP[1]
+        _ASYNC_HTTP = None
+        await client.aclose()
+
+
 def get_openai_clients():
     try:
         from langchain import OpenAI
@@ -18,17 +143,23 @@ def get_openai_clients():
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     embed_model = os.getenv("OPENAI_EMBEDDING", "text-embedding-3-small")
 
+    api_key = os.getenv("OPENAI_API_KEY")
+
     def llm_generate(prompt: str):
         if OpenAI is None:
             raise RuntimeError("OpenAI/langchain packages not installed")
-        llm = OpenAI(model_name=model, openai_api_key=os.getenv("OPENAI_API_KEY"))
+        llm = _get_model(("openai_llm", model, api_key),
+                         lambda: OpenAI(model_name=model, openai_api_key=api_key))
         return llm(prompt)
 
     def embed_texts(texts):
         if OpenAIEmbeddings is None:
             raise RuntimeError("OpenAI/langchain packages not installed")
-        emb = OpenAIEmbeddings(model=embed_model, openai_api_key=os.getenv("OPENAI_API_KEY"))
-        return emb.embed_documents(texts)
+        emb = _get_model(("openai_embed", embed_model, api_key),
+                         lambda: OpenAIEmbeddings(model=embed_model, openai_api_key=api_key))
+        # only cache misses reach the API, through the embedding limiter
+        return _cached_embed(f"openai:{embed_model}", _OPENAI_EMBED_DIMS.get(embed_model, 0),
+                             texts, lambda batch: _embed_limiter("openai").call(emb.embed_documents, batch))
 
     return llm_generate, embed_texts
 
@@ -68,8 +199,11 @@ def get_gemini_clients():
         try:
             if USE_OLD_SDK:
                 # Old SDK pattern (google.generativeai)
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(model_name)
+                def _old_model():
+                    genai.configure(api_key=api_key)
+                    return genai.GenerativeModel(model_name)
+
+                model = _get_model(("gemini_old", model_name, api_key), _old_model)
                 resp = model.generate_content(prompt)
                 if hasattr(resp, "text") and resp.text:
                     return resp.text
@@ -84,7 +218,7 @@ def get_gemini_clients():
                     return ""
             else:
                 # New SDK pattern (google.genai.Client)
-                client = genai.Client(api_key=api_key)
+                client = _get_model(("gemini_client", api_key), lambda: genai.Client(api_key=api_key))
                 response = client.models.generate_content(
                     model=model_name,
                     contents=prompt
@@ -95,14 +229,7 @@ def get_gemini_clients():
 
     def embed_texts(texts):
         # Keep lightweight fallback embedding to avoid heavy deps by default
-        dim = int(os.getenv("LOCAL_EMBED_DIM", "384"))
-        vectors = []
-        for t in texts:
-            v = [0] * dim
-            for i, ch in enumerate(t.encode("utf-8")):
-                v[i % dim] = (v[i % dim] + ch) % 1000
-            vectors.append([float(x) for x in v])
-        return vectors
+        return hash_embed(texts, int(os.getenv("LOCAL_EMBED_DIM", "384")))
 
     return llm_generate, embed_texts
 
@@ -121,7 +248,7 @@ def get_local_clients():
         def llm_generate(prompt: str):
             if Llama is None:
                 raise RuntimeError("llama_cpp not installed")
-            llm = Llama(model_path=model_path)
+            llm = _get_model(("llama_cpp", model_path), lambda: Llama(model_path=model_path))
             res = llm.create(prompt=prompt, max_tokens=512)
             return res["choices"][0]["text"]
 
@@ -130,35 +257,295 @@ def get_local_clients():
         tgi_url = os.getenv("LOCAL_LLM_URL", "http://localhost:8080/v1/models/model:predict")
 
         def llm_generate(prompt: str):
-            r = requests.post(tgi_url, json={"inputs": prompt, "parameters": {"max_new_tokens": 512}})
+            session = _get_model(("tgi_session",), requests.Session)
+            r = session.post(tgi_url, json={"inputs": prompt, "parameters": {"max_new_tokens": 512}})
             r.raise_for_status()
             return r.json()
 
     else:
         raise RuntimeError(f"Unsupported LOCAL_LLM_TYPE={provider}")
 
-    # embeddings using sentence-transformers
+    embed_model_name = os.getenv("LOCAL_EMBED_MODEL", "all-MiniLM-L6-v2")
+    backend = _local_embed_backend()
+
+    # embeddings using sentence-transformers (PyTorch or ONNX Runtime)
     def embed_texts(texts):
+        model = _get_model((backend, embed_model_name),
+                           lambda: _load_local_embedder(backend, embed_model_name))
         try:
-            from sentence_transformers import SentenceTransformer  # type: ignore
-            model = SentenceTransformer(os.getenv("LOCAL_EMBED_MODEL", "all-MiniLM-L6-v2"))
-            return [m.tolist() for m in model.encode(texts)]
+            if model is None:
+                raise RuntimeError("sentence-transformers not available")
+            return _cached_embed(f"{backend}:{embed_model_name}",
+                                 model.get_sentence_embedding_dimension() or 0,
+                                 texts, lambda batch: _encode_local(model, embed_model_name, batch))
         except Exception:
             # cheap deterministic fallback embedding (no external deps)
-            dim = int(os.getenv("LOCAL_EMBED_DIM", "384"))
-            vectors = []
-            for t in texts:
-                v = [0] * dim
-                for i, ch in enumerate(t.encode("utf-8")):
-                    v[i % dim] = (v[i % dim] + ch) % 1000
-                vectors.append([float(x) for x in v])
-            return vectors
+            return hash_embed(texts, int(os.getenv("LOCAL_EMBED_DIM", "384")))
 
     return llm_generate, embed_texts
 
 
-def get_llm_and_embeddings() -> Tuple[Callable[[str], str], Callable]:
+def get_openai_async_clients():
+    """Return (agenerate, aembed) for OpenAI over the pooled HTTP client.
+
+    Uses the REST API directly (OPENAI_BASE_URL, default https://api.openai.com/v1).
+    """
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    embed_model = os.getenv("OPENAI_EMBEDDING", "text-embedding-3-small")
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+    def _headers():
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY not set")
+        return {"Authorization": f"Bearer {api_key}"}
+
+    async def agenerate(prompt: str):
+        r = await get_async_http_client().post(
+            f"{base_url}/chat/completions",
+            headers=_headers(),
+            json={"model": model, "messages": [{"role": "user", "content": prompt}]},
+        )
+        r.raise_for_status()
+        return r.json()["choices"][0]["message"]["content"]
+
+    async def _aembed_remote(texts):
+        r = await get_async_http_client().post(
+            f"{base_url}/embeddings", headers=_headers(), json={"model": embed_model, "input": list(texts)},
+        )
+        r.raise_for_status()
+        data = sorted(r.json()["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in data]
+
+    async def aembed(texts):
+        return await _acached_embed(f"openai:{embed_model}", _OPENAI_EMBED_DIMS.get(embed_model, 0),
+                                    texts, lambda batch: _embed_limiter("openai").acall(_aembed_remote, batch))
+
+    return agenerate, aembed
+
+
+def get_gemini_async_clients(embed_texts: Callable):
+    """Return (agenerate, aembed) for Gemini via the REST generateContent API."""
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+    base_url = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+    async def agenerate(prompt: str):
+        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY/GOOGLE_API_KEY not set")
+        try:
+            r = await get_async_http_client().post(
+                f"{base_url}/models/{model_name}:generateContent",
+                headers={"x-goog-api-key": api_key},
+                json={"contents": [{"parts": [{"text": prompt}]}]},
+            )
+            r.raise_for_status()
+            parts = []
+            for cand in r.json().get("candidates", []) or []:
+                for part in (cand.get("content") or {}).get("parts", []) or []:
+                    if part.get("text"):
+                        parts.append(part["text"])
+            return "".join(parts)
+        except Exception as e:
+            raise RuntimeError(f"Gemini API error: {str(e)}")
+
+    return agenerate, _background_aembed(embed_texts)
+
+
+def _background_aembed(embed_texts: Callable) -> Callable:
+    """aembed for an in-process embedder, kept off the event loop.
+
+    With EMBED_BATCH_WINDOW_MS the call joins the scheduler's next batch;
+    otherwise it runs in a worker thread, since even a cheap embedder goes
+    through the embedding cache's SQLite lookups.
+    """
+    async def aembed(texts):
+        scheduler = get_embedding_scheduler()
+        if scheduler is not None:
+            return await asyncio.wrap_future(scheduler.submit(texts))
+        return await asyncio.to_thread(embed_texts, texts)
+
+    return aembed
+
+
+def get_local_async_clients(llm_generate: Callable, embed_texts: Callable):
+    """Return (agenerate, aembed) for local models.
+
+    TGI goes over the pooled HTTP client; llama.cpp and sentence-transformers
+    are in-process CPU work and run in a worker thread (or the embedding
+    scheduler's thread when micro-batching is enabled).
+    """
+    provider = os.getenv("LOCAL_LLM_TYPE", "llama_cpp")
+
+    if provider == "tgi":
+        tgi_url = os.getenv("LOCAL_LLM_URL", "http://localhost:8080/v1/models/model:predict")
+
+        async def agenerate(prompt: str):
+            r = await get_async_http_client().post(
+                tgi_url, json={"inputs": prompt, "parameters": {"max_new_tokens": 512}})
+            r.raise_for_status()
+            return r.json()
+    else:
+        async def agenerate(prompt: str):
+            return await asyncio.to_thread(llm_generate, prompt)
+
+    return agenerate, _background_aembed(embed_texts)
+
+
+async def _iter_sse_data(response) -> AsyncIterator[str]:
+    """Yield the payload of each `data:` line of a server-sent-events response."""
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            payload = line[5:].strip()
+            if payload:
+                yield payload
+
+
+def get_openai_stream_client() -> Callable[[str], AsyncIterator[str]]:
+    """Return astream(prompt) yielding OpenAI chat completion tokens as they arrive."""
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+    async def astream(prompt: str):
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENAI_API_KEY not set")
+        body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True}
+        async with get_async_http_client().stream(
+            "POST", f"{base_url}/chat/completions", headers={"Authorization": f"Bearer {api_key}"}, json=body,
+        ) as r:
+            r.raise_for_status()
+            async for payload in _iter_sse_data(r):
+                if payload == "[DONE]":
+                    break
+                for choice in json.loads(payload).get("choices", []):
+                    token = (choice.get("delta") or {}).get("content")
+                    if token:
+                        yield token
+
+    return astream
+
+
+def get_gemini_stream_client() -> Callable[[str], AsyncIterator[str]]:
+    """Return astream(prompt) over Gemini's streamGenerateContent (SSE) API."""
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+    base_url = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+    async def astream(prompt: str):
+        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY/GOOGLE_API_KEY not set")
+        async with get_async_http_client().stream(
+            "POST", f"{base_url}/models/{model_name}:streamGenerateContent",
+            params={"alt": "sse"}, headers={"x-goog-api-key": api_key},
+            json={"contents": [{"parts": [{"text": prompt}]}]},
+        ) as r:
+            r.raise_for_status()
+            async for payload in _iter_sse_data(r):
+                for cand in json.loads(payload).get("candidates", []) or []:
+                    for part in (cand.get("content") or {}).get("parts", []) or []:
+                        if part.get("text"):
+                            yield part["text"]
+
+    return astream
+
+
+def get_local_stream_client() -> Callable[[str], AsyncIterator[str]]:
+    """Return astream(prompt) for llama.cpp (stream=True) or TGI (/generate_stream).
+
+    Env vars:
+      - LOCAL_LLM_STREAM_URL (default: http://localhost:8080/generate_stream)
+    """
+    provider = os.getenv("LOCAL_LLM_TYPE", "llama_cpp")
+
+    if provider == "tgi":
+        stream_url = os.getenv("LOCAL_LLM_STREAM_URL", "http://localhost:8080/generate_stream")
+
+        async def astream(prompt: str):
+            body = {"inputs": prompt, "parameters": {"max_new_tokens": 512}}
+            async with get_async_http_client().stream("POST", stream_url, json=body) as r:
+                r.raise_for_status()
+                async for payload in _iter_sse_data(r):
+                    token = json.loads(payload).get("token") or {}
+                    if token.get("text") and not token.get("special"):
+                        yield token["text"]
+
+        return astream
+
+    model_path = os.getenv("LOCAL_LLM_PATH", "./models/ggml-model.bin")
+
+    async def astream(prompt: str):
+        try:
+            from llama_cpp import Llama  # type: ignore
+        except Exception:
+            raise RuntimeError("llama_cpp not installed")
+        llm = await asyncio.to_thread(_get_model, ("llama_cpp", model_path), lambda: Llama(model_path=model_path))
+        chunks = await asyncio.to_thread(llm.create_completion, prompt=prompt, max_tokens=512, stream=True)
+        done = object()
+        # each token is produced by CPU-bound llama.cpp code, so pull them off the loop
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, done)
+            if chunk is done:
+                break
+            token = chunk["choices"][0]["text"]
+            if token:
+                yield token
+
+    return astream
+
+
+def _local_embed_backend() -> str:
+    """Cache/registry name of the local embedding backend (LOCAL_EMBED_BACKEND)."""
+    if os.getenv("LOCAL_EMBED_BACKEND", "torch").lower() != "onnx":
+        return "sentence_transformers"
+    quantized = os.getenv("LOCAL_EMBED_ONNX_QUANTIZE", "true").lower() in ("1", "true", "yes")
+    return "onnx_int8" if quantized else "onnx"
+
+
+def _load_local_embedder(backend: str, name: str):
+    if backend.startswith("onnx"):
+        try:
+            from .onnx_embedder import load_onnx_embedder
+            return load_onnx_embedder(name)
+        except Exception:
+            return None
+    return _load_sentence_transformer(name)
+
+
+def _encode_local(model, model_name: str, texts: List[str]):
+    """Encode with the in-process model, or shard large batches over the worker pool."""
+    pool = get_embedding_pool(model_name, _local_embed_backend())
+    if pool is not None and len(texts) >= int(os.getenv("EMBED_POOL_MIN_TEXTS", "64")):
+        try:
+            return pool.encode(texts)
+        except Exception:
+            # a broken pool is rebuilt on the next call; this batch is encoded here
+            close_embedding_pools()
+    return model.encode(texts)
+
+
+def _load_sentence_transformer(name: str):
+    try:
+        from sentence_transformers import SentenceTransformer  # type: ignore
+        return SentenceTransformer(name)
+    except Exception:
+        return None
+
+
+def _provider_config_key() -> tuple:
+    """Env settings that select a provider and its models."""
     provider = os.getenv("LLM_PROVIDER", "local").lower()
+    names = {
+        "openai": ("OPENAI_MODEL", "OPENAI_EMBEDDING", "OPENAI_API_KEY"),
+        "gemini": ("GEMINI_MODEL", "GEMINI_API_KEY", "GOOGLE_API_KEY", "LOCAL_EMBED_DIM"),
+        "local": ("LOCAL_LLM_TYPE", "LOCAL_LLM_PATH", "LOCAL_LLM_URL", "LOCAL_EMBED_MODEL", "LOCAL_EMBED_DIM",
+                  "LOCAL_EMBED_BACKEND", "LOCAL_EMBED_ONNX_DIR", "LOCAL_EMBED_ONNX_QUANTIZE"),
+    }.get(provider, ())
+    names += ("EMBED_BATCH_WINDOW_MS", "EMBED_MAX_BATCH")
+    return (provider,) + tuple(os.getenv(n) for n in names)
+
+
+def _build_llm_and_embeddings(provider: str) -> Tuple[Callable[[str], str], Callable]:
     if provider == "openai":
         return get_openai_clients()
     if provider == "gemini":
@@ -166,3 +553,150 @@ def get_llm_and_embeddings() -> Tuple[Callable[[str], str], Callable]:
     if provider == "local":
         return get_local_clients()
     raise RuntimeError(f"Unknown LLM_PROVIDER={provider}")
+
+
+def _limiter_name(provider: str) -> str:
+    """Limiter bucket for a provider: one per remote API, or per local LLM type."""
+    if provider == "local":
+        return os.getenv("LOCAL_LLM_TYPE", "llama_cpp")
+    return provider
+
+
+def _embed_limiter(provider: str):
+    """Limiter for a provider's remote embedding calls.
+
+    Embedding endpoints have their own rate limits, so they get their own
+    bucket (settings <PROVIDER>_EMBED_*, e.g. OPENAI_EMBED_RATE_LIMIT, then
+    LLM_*), reported beside the provider's LLM limiter.
+    """
+    return get_provider_limiter(f"{provider}{EMBED_LIMITER_SUFFIX}")
+
+
+def get_llm_and_embeddings() -> Tuple[Callable[[str], str], Callable]:
+    """Return (llm_generate, embed_texts) for the configured provider.
+
+    The pair is built once per provider config and reused for the life of the
+    process; models and API clients behind it are loaded on first use.
+    """
+    key = _provider_config_key()
+    pair = _PROVIDERS.get(key)
+    if pair is None:
+        with _REGISTRY_LOCK:
+            pair = _PROVIDERS.get(key)
+            if pair is None:
+                llm, embedder = _build_llm_and_embeddings(key[0])
+                # rate limit, bound concurrency and retry transient provider errors
+                llm = get_provider_limiter(_limiter_name(key[0])).wrap(llm)
+                window_ms = float(os.getenv("EMBED_BATCH_WINDOW_MS", "0"))
+                if window_ms > 0:
+                    # coalesce concurrent small embed calls into batched encodes
+                    scheduler = EmbeddingScheduler(embedder, window_ms=window_ms,
+                                                   max_batch=int(os.getenv("EMBED_MAX_BATCH", "64")))
+                    _SCHEDULERS[key] = scheduler
+                    embedder = scheduler.embed
+                pair = (llm, embedder)
+                _PROVIDERS[key] = pair
+    return pair
+
+
+def get_llm_model_id() -> Tuple[str, str]:
+    """Return (provider, model) naming the LLM that answers for the current config."""
+    provider = os.getenv("LLM_PROVIDER", "local").lower()
+    if provider == "openai":
+        return provider, os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    if provider == "gemini":
+        return provider, os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+    if os.getenv("LOCAL_LLM_TYPE", "llama_cpp") == "tgi":
+        return provider, "tgi:" + os.getenv("LOCAL_LLM_URL", "http://localhost:8080/v1/models/model:predict")
+    return provider, "llama_cpp:" + os.getenv("LOCAL_LLM_PATH", "./models/ggml-model.bin")
+
+
+def get_embedding_scheduler() -> Optional[EmbeddingScheduler]:
+    """Return the micro-batching scheduler of the current provider config, if enabled."""
+    return _SCHEDULERS.get(_provider_config_key())
+
+
+def get_async_llm_and_embeddings() -> Tuple[Callable[[str], Awaitable[Any]], Callable]:
+    """Return (agenerate, aembed) for the configured provider.
+
+    Async counterpart of get_llm_and_embeddings for endpoints that await the
+    provider instead of holding a threadpool worker per in-flight request.
+    """
+    key = _provider_config_key()
+    pair = _ASYNC_PROVIDERS.get(key)
+    if pair is None:
+        llm, embedder = get_llm_and_embeddings()
+        with _REGISTRY_LOCK:
+            pair = _ASYNC_PROVIDERS.get(key)
+            if pair is None:
+                if key[0] == "openai":
+                    pair = get_openai_async_clients()
+                elif key[0] == "gemini":
+                    pair = get_gemini_async_clients(embedder)
+                else:
+                    pair = get_local_async_clients(llm, embedder)
+                if not (key[0] == "local" and _limiter_name(key[0]) == "llama_cpp"):
+                    # local llama.cpp agenerate runs the already-limited sync llm
+                    pair = (get_provider_limiter(_limiter_name(key[0])).awrap(pair[0]), pair[1])
+                _ASYNC_PROVIDERS[key] = pair
+    return pair
+
+
+def get_llm_stream() -> Callable[[str], AsyncIterator[str]]:
+    """Return astream(prompt), an async iterator of tokens for the configured provider."""
+    key = _provider_config_key()
+    astream = _STREAM_PROVIDERS.get(key)
+    if astream is None:
+        with _REGISTRY_LOCK:
+            astream = _STREAM_PROVIDERS.get(key)
+            if astream is None:
+                if key[0] == "openai":
+                    astream = get_openai_stream_client()
+                elif key[0] == "gemini":
+                    astream = get_gemini_stream_client()
+                elif key[0] == "local":
+                    astream = get_local_stream_client()
+                else:
+                    raise RuntimeError(f"Unknown LLM_PROVIDER={key[0]}")
+                astream = get_provider_limiter(_limiter_name(key[0])).wrap_stream(astream)
+                _STREAM_PROVIDERS[key] = astream
+    return astream
+
+
+def warmup_llm_and_embeddings() -> Tuple[Callable[[str], str], Callable]:
+    """Build the configured provider and load its local models up front.
+
+    Called at startup so the first request does not pay for model loading.
+    """
+    llm, embedder = get_llm_and_embeddings()
+    embedder(["warmup"])
+    if os.getenv("LLM_PROVIDER", "local").lower() == "local" and os.getenv("LOCAL_LLM_TYPE", "llama_cpp") == "llama_cpp":
+        model_path = os.getenv("LOCAL_LLM_PATH", "./models/ggml-model.bin")
+
+        def _load_llama():
+            try:
+                from llama_cpp import Llama  # type: ignore
+                return Llama(model_path=model_path)
+            except Exception:
+                return None
+
+        # Only cache a successful load; llm_generate reports the error otherwise
+        if _get_model(("llama_cpp", model_path), _load_llama) is None:
+            with _REGISTRY_LOCK:
+                _MODELS.pop(("llama_cpp", model_path), None)
+    return llm, embedder
+
+
+def reload_llm_and_embeddings() -> Tuple[Callable[[str], str], Callable]:
+    """Drop all cached providers and models, then warm up the current config."""
+    with _REGISTRY_LOCK:
+        for scheduler in _SCHEDULERS.values():
+            scheduler.close()
+        _SCHEDULERS.clear()
+        close_embedding_pools()
+        _ASYNC_PROVIDERS.clear()
+        _STREAM_PROVIDERS.clear()
+        _PROVIDERS.clear()
+        _MODELS.clear()
+        reset_provider_limiters()
+    return warmup_llm_and_embeddings()
@@ -1,16 +1,35 @@
+import asyncio
+import json
 import os
-from typing import List
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
-from .llm_provider import get_llm_and_embeddings
-from .ingest import ingest_file_bytes
-from .retrieval import retrieve_context, build_rag_prompt
+from .llm_provider import (
+    warmup_llm_and_embeddings, reload_llm_and_embeddings, get_embedding_scheduler,
+    get_async_llm_and_embeddings, get_llm_stream, get_llm_model_id, close_async_http_client,
+)
+from .ingest import ingest_file_path, spool_upload
+from .ingest_pipeline import UnpackBudget, ingest_documents, is_archive, unpack_archive
+from .ingest_jobs import close_ingest_jobs, get_ingest_jobs, ingest_job_stats
+from .lexical_index import get_lexical_index
+from .metadata_index import validate_where
+from .retrieval import aretrieve_chunks, aretrieve_chunks_batch, build_rag_prompt
+from .response_cache import get_response_cache
 from .chat import chat_answer
 from .recommendations import generate_recommendations
-from .chroma_client import reset_chroma_collection
+from .chroma_client import chroma_client_stats, delete_source, reset_chroma_collection
+from .sharding import ingest_collection
+from .embedding_cache import get_embedding_cache
+from .embed_pool import embedding_pool_stats, close_embedding_pools
+from .pdf_extract import close_pdf_pools, pdf_pool_stats
+from .provider_limits import provider_limit_stats
 from .auth import (
     init_db, get_db, handle_signup, handle_login,
     SignupRequest, LoginRequest, TokenResponse, decode_token,
@@ -74,6 +93,29 @@ if ML_ENDPOINTS_AVAILABLE:
 
 class QueryRequest(BaseModel):
     query: str
+    # metadata filter for retrieval (chromadb `where` syntax), e.g. {"source": "10k.pdf"}
+    where: Optional[Dict[str, Any]] = None
+
+
+class QueryBatchRequest(BaseModel):
+    queries: List[str]
+    where: Optional[Dict[str, Any]] = None
+
+
+# Keep proxies from buffering server-sent events
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _check_where(where: Optional[Dict[str, Any]]) -> None:
+    """A malformed metadata filter is the client's mistake: 400 before any retrieval."""
+    try:
+        validate_where(where)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid where filter: {e}")
 
 
 @app.on_event("startup")
@@ -88,9 +130,9 @@ def startup_event():
         init_financial_db()
     except Exception as e:
         print(f"Financial DB init failed: {e}")
-    # initialize provider
+    # initialize provider and load its models once for the process
     try:
-        app.state.llm, app.state.embed = get_llm_and_embeddings()
+        app.state.llm, app.state.embed = warmup_llm_and_embeddings()
     except Exception as e:
         # provider may not be fully configured yet; keep app running and fail at call time
         app.state.llm = None
@@ -104,6 +146,19 @@ def startup_event():
     except Exception:
         app.state.anomaly_model = None
         app.state.anomaly_model_path = None
+    # resume background ingest jobs left over from the last run
+    try:
+        get_ingest_jobs()
+    except Exception as e:
+        print(f"Ingest job queue init failed: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_async_http_client()
+    close_embedding_pools()
+    close_pdf_pools()
+    close_ingest_jobs()
 
 
 @app.get("/health")
@@ -143,35 +198,198 @@ def _require_auth_optional(authorization: str | None = Header(default=None)):
     return sub
 
 
+def _target_collection(user: Optional[str], shared: bool) -> str:
+    """The caller's shard, or the shared shard with ?shared=true (400 if none is configured)."""
+    try:
+        return ingest_collection(user if user else "anonymous", shared)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/ingest")
-async def ingest(file: UploadFile = File(...), _user=Depends(_require_auth_optional)):
-    content = await file.read()
+async def ingest(file: UploadFile = File(...), shared: bool = False, _user=Depends(_require_auth_optional)):
+    """Spool the upload to disk, then extract, chunk and embed it in bounded batches off the event loop."""
+    collection_name = _target_collection(_user, shared)
+    path = await spool_upload(file)
     try:
-        result = ingest_file_bytes(file.filename, content)
+        result = await run_in_threadpool(ingest_file_path, path, file.filename, user=_user if _user else "anonymous",
+                                         collection_name=collection_name)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        os.remove(path)
+
+
+@app.post("/ingest/bulk")
+async def ingest_bulk(files: List[UploadFile] = File(...), shared: bool = False,
+                      _user=Depends(_require_auth_optional)):
+    """Ingest several files and/or zip/tar archives through the pipelined executor in one request."""
+    collection_name = _target_collection(_user, shared)
+    # one budget for the whole request, however many archives it holds
+    budget = UnpackBudget()
+    if len(files) > budget.max_files:
+        raise HTTPException(status_code=400, detail=f"At most {budget.max_files} files per bulk ingest")
+    scratch = tempfile.mkdtemp(prefix="ingest-bulk-", dir=os.getenv("INGEST_SPOOL_DIR") or None)
+    try:
+        items = []
+        for n, upload in enumerate(files):
+            path = await spool_upload(upload, scratch)
+            name = upload.filename or f"upload-{n}"
+            if is_archive(name):
+                items.extend(await run_in_threadpool(unpack_archive, path, os.path.join(scratch, str(n)), budget))
+                os.remove(path)
+            else:
+                budget.take_file()
+                items.append((path, name))
+        return await run_in_threadpool(ingest_documents, items, user=_user if _user else "anonymous",
+                                       collection_name=collection_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+@app.post("/ingest/jobs", status_code=202)
+async def submit_ingest_job(file: UploadFile = File(...), shared: bool = False,
+                            _user=Depends(_require_auth_optional)):
+    """Spool the upload and queue it for background ingest; poll GET /ingest/jobs/{id} for progress."""
+    collection_name = _target_collection(_user, shared)
+    try:
+        jobs = get_ingest_jobs()
+        path = await spool_upload(file, jobs.uploads)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        return await run_in_threadpool(jobs.submit, path, file.filename or "upload",
+                                       _user if _user else "anonymous", collection_name)
+    except Exception as e:
+        # the job was never recorded, so nothing else will remove the spooled file
+        os.remove(path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ingest/jobs")
+def list_ingest_jobs(limit: int = 50, _user=Depends(_require_auth_optional)):
+    """The caller's most recent ingest jobs, newest first."""
+    try:
+        return get_ingest_jobs().list(_user if _user else "anonymous", limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ingest/jobs/{job_id}")
+def get_ingest_job(job_id: str, _user=Depends(_require_auth_optional)):
+    """Status, stage, progress counters and per-stage timings of one ingest job."""
+    try:
+        job = get_ingest_jobs().get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Ingest job not found")
+        if job["user"] != (_user if _user else "anonymous"):
+            raise HTTPException(status_code=403, detail="Access denied to this ingest job")
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/query")
-def query(req: QueryRequest, _user=Depends(_require_auth_optional)):
+async def query(req: QueryRequest, _user=Depends(_require_auth_optional)):
     if app.state.llm is None:
         raise HTTPException(status_code=500, detail={"error": "LLM provider not configured", "reason": getattr(app.state, 'llm_error', 'unknown')})
+    _check_where(req.where)
     try:
         # Retrieve context from vector store and perform RAG
-        docs, metas = retrieve_context(req.query, top_k=int(os.getenv("RETRIEVAL_K", "5")))
-        prompt = build_rag_prompt(req.query, docs)
-        resp = app.state.llm(prompt)
-        return {"query": req.query, "response": resp, "sources": metas}
+        found = await aretrieve_chunks(req.query, top_k=int(os.getenv("RETRIEVAL_K", "5")), where=req.where,
+                                       user=_user if _user else "anonymous")
+        return await _answer_query(req.query, found)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _answer_query(question: str, found) -> dict:
+    """Answer one question from its retrieved chunks, through the response cache."""
+    agenerate, _ = get_async_llm_and_embeddings()
+    cache = get_response_cache()
+    provider, model = get_llm_model_id()
+    if cache is not None:
+        cached = cache.get("query", provider, model, found.collection, question, found.ids, found.qvec)
+        if cached is not None:
+            return {"query": question, "response": cached, "sources": found.metas}
+    resp = await agenerate(build_rag_prompt(question, found.docs))
+    if cache is not None:
+        cache.put("query", provider, model, found.collection, question, found.ids, resp, found.qvec)
+    return {"query": question, "response": resp, "sources": found.metas}
+
+
+@app.post("/query/batch")
+async def query_batch(req: QueryBatchRequest, _user=Depends(_require_auth_optional)):
+    """Answer several questions: one embedding call and one multi-query vector search for all of them."""
+    if app.state.llm is None:
+        raise HTTPException(status_code=500, detail={"error": "LLM provider not configured", "reason": getattr(app.state, 'llm_error', 'unknown')})
+    max_batch = int(os.getenv("QUERY_BATCH_MAX", "32"))
+    if len(req.queries) > max_batch:
+        raise HTTPException(status_code=400, detail=f"At most {max_batch} queries per batch")
+    _check_where(req.where)
+    try:
+        found = await aretrieve_chunks_batch(req.queries, top_k=int(os.getenv("RETRIEVAL_K", "5")), where=req.where,
+                                             user=_user if _user else "anonymous")
+        results = await asyncio.gather(*(_answer_query(q, f) for q, f in zip(req.queries, found)))
+        return {"results": list(results)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/query/stream")
+async def query_stream(req: QueryRequest, _user=Depends(_require_auth_optional)):
+    """Streaming variant of /query: `sources`, then `token` events, then `done` with the full response."""
+    if app.state.llm is None:
+        raise HTTPException(status_code=500, detail={"error": "LLM provider not configured", "reason": getattr(app.state, 'llm_error', 'unknown')})
+    _check_where(req.where)
+    try:
+        found = await aretrieve_chunks(req.query, top_k=int(os.getenv("RETRIEVAL_K", "5")), where=req.where,
+                                       user=_user if _user else "anonymous")
+        cache = get_response_cache()
+        provider, model = get_llm_model_id()
+        cached = None
+        if cache is not None:
+            cached = cache.get("query", provider, model, found.collection, req.query, found.ids, found.qvec)
+        prompt = build_rag_prompt(req.query, found.docs)
+        astream = get_llm_stream()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        yield _sse("sources", {"query": req.query, "sources": found.metas})
+        if cached is not None:
+            yield _sse("token", {"token": cached})
+            yield _sse("done", {"query": req.query, "response": cached})
+            return
+        parts: List[str] = []
+        try:
+            async for token in astream(prompt):
+                parts.append(token)
+                yield _sse("token", {"token": token})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        resp = "".join(parts)
+        if cache is not None:
+            cache.put("query", provider, model, found.collection, req.query, found.ids, resp, found.qvec)
+        yield _sse("done", {"query": req.query, "response": resp})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
 @app.get("/collections/stats")
-def collection_stats(_user=Depends(_require_auth_optional)):
+def collection_stats(shared: bool = False, _user=Depends(_require_auth_optional)):
+    collection_name = _target_collection(_user, shared)
     try:
         from .chroma_client import get_chroma_collection
-        coll = get_chroma_collection()
+        coll = get_chroma_collection(collection_name)
         count = None
         # Prefer native count if available
         if hasattr(coll, "count"):
@@ -183,24 +401,73 @@ def collection_stats(_user=Depends(_require_auth_optional)):
         if count is None:
             count = getattr(coll, "_store", None)
             count = len(count) if isinstance(count, list) else 0
-        return {"collection": getattr(coll, "name", "documents"), "count": int(count)}
+        out = {"collection": getattr(coll, "name", "documents"), "count": int(count)}
+        if hasattr(coll, "index_stats"):
+            out["index"] = coll.index_stats()
+        lexical = get_lexical_index(out["collection"])
+        if lexical is not None:
+            out["lexical"] = lexical.stats()
+        return out
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/collections/reset")
-def collection_reset(_user=Depends(_require_auth_optional)):
+def collection_reset(shared: bool = False, _user=Depends(_require_auth_optional)):
+    collection_name = _target_collection(_user, shared)
     try:
-        before = reset_chroma_collection()
+        before = reset_chroma_collection(collection_name)
         # fetch count after reset
         from .chroma_client import get_chroma_collection
-        coll = get_chroma_collection()
+        coll = get_chroma_collection(collection_name)
         after = getattr(coll, "count", lambda: len(getattr(coll, "_store", [])))()
         return {"collection": getattr(coll, "name", "documents"), "before": int(before), "after": int(after)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.delete("/collections/sources/{source:path}")
+def collection_delete_source(source: str, shared: bool = False, _user=Depends(_require_auth_optional)):
+    """Remove every chunk ingested from one source, leaving the rest of the collection."""
+    collection_name = _target_collection(_user, shared)
+    try:
+        deleted = delete_source(source, collection_name)
+        from .chroma_client import get_chroma_collection
+        coll = get_chroma_collection(collection_name)
+        return {"collection": getattr(coll, "name", "documents"), "source": source, "deleted": deleted}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/providers/reload")
+def providers_reload(_user=Depends(_require_auth_optional)):
+    """Drop cached LLM/embedding clients and models and load them again from env."""
+    try:
+        app.state.llm, app.state.embed = reload_llm_and_embeddings()
+        app.state.llm_error = None
+        return {"status": "ok", "provider": os.getenv("LLM_PROVIDER", "local")}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/metrics")
+def metrics(_user=Depends(_require_auth_optional)):
+    """Counters from the retrieval/embedding performance layers."""
+    cache = get_embedding_cache()
+    scheduler = get_embedding_scheduler()
+    responses = get_response_cache()
+    return {
+        "embedding_cache": cache.stats() if cache is not None else None,
+        "embedding_scheduler": scheduler.stats() if scheduler is not None else None,
+        "response_cache": responses.stats() if responses is not None else None,
+        "embedding_pools": embedding_pool_stats(),
+        "pdf_pools": pdf_pool_stats(),
+        "ingest_jobs": ingest_job_stats(),
+        "provider_limits": provider_limit_stats(),
+        "chroma": chroma_client_stats(),
+    }
+
+
 # -------- Anomaly Detection ---------
 class AnomalyJSONRequest(BaseModel):
     records: list[dict]
@@ -278,41 +545,49 @@ def anomaly_status():
 # -------- Chat (RAG + Web + LLM) ---------
 # -------- Chat with Conversation History ---------
 
+async def _start_chat_turn(req: ChatRequest, user_id: str):
+    """Resolve the session, save the user message and build the conversation context."""
+    # Get or create session
+    if req.session_id:
+        session = await run_in_threadpool(get_conversation_session, req.session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail=f"Session {req.session_id} not found")
+        # Verify user owns this session
+        if session.user_id != user_id:
+            raise HTTPException(status_code=403, detail="Access denied to this session")
+    else:
+        # Get most recent active session or create new one
+        session = await run_in_threadpool(get_or_create_active_session, user_id)
+
+    # Save user message
+    await run_in_threadpool(save_message, session.session_id, "user", req.query)
+
+    # Build conversation context from history with financial data
+    conversation_context = await run_in_threadpool(
+        build_conversation_context, session.session_id, max_messages=10, user_id=user_id
+    )
+    return session, conversation_context
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest, _user=Depends(_require_auth_optional)):
+async def chat(req: ChatRequest, _user=Depends(_require_auth_optional)):
     """
     Chat endpoint with conversation history support.
     If session_id is provided, continues that conversation.
     If not, creates a new session or uses the most recent active one.
     """
+    _check_where(req.where)
     try:
         # Determine user_id (use authenticated user or anonymous)
         user_id = _user if _user else "anonymous"
-        
-        # Get or create session
-        if req.session_id:
-            session = get_conversation_session(req.session_id)
-            if not session:
-                raise HTTPException(status_code=404, detail=f"Session {req.session_id} not found")
-            # Verify user owns this session
-            if session.user_id != user_id:
-                raise HTTPException(status_code=403, detail="Access denied to this session")
-        else:
-            # Get most recent active session or create new one
-            session = get_or_create_active_session(user_id)
-        
-        # Save user message
-        save_message(session.session_id, "user", req.query)
-        
-        # Build conversation context from history with financial data
-        conversation_context = build_conversation_context(session.session_id, max_messages=10, user_id=user_id)
+        session, conversation_context = await _start_chat_turn(req, user_id)
         
         # Get chat answer with context
-        from .chat import chat_answer_with_context
-        result = chat_answer_with_context(req.query, conversation_context)
+        from .chat import achat_answer_with_context
+        result = await achat_answer_with_context(req.query, conversation_context, where=req.where, user=user_id)
         
         # Save assistant response
-        assistant_msg = save_message(session.session_id, "assistant", result["answer"])
+        assistant_msg = await run_in_threadpool(save_message, session.session_id, "assistant", result["answer"])
         
         return ChatResponse(
             answer=result["answer"],
@@ -325,6 +600,42 @@ def chat(req: ChatRequest, _user=Depends(_require_auth_optional)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, _user=Depends(_require_auth_optional)):
+    """
+    Streaming variant of /chat (server-sent events).
+    Emits `sources`, then one `token` event per chunk, then `done` once the
+    full answer has been saved to the conversation.
+    """
+    _check_where(req.where)
+    try:
+        user_id = _user if _user else "anonymous"
+        session, conversation_context = await _start_chat_turn(req, user_id)
+        from .chat import aprepare_chat_prompt
+        prompt, sources, used = await aprepare_chat_prompt(req.query, conversation_context, where=req.where, user=user_id)
+        astream = get_llm_stream()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        yield _sse("sources", {"session_id": session.session_id, "sources": sources, "used": used})
+        parts: List[str] = []
+        try:
+            async for token in astream(prompt):
+                parts.append(token)
+                yield _sse("token", {"token": token})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        # Persist the complete answer once the stream has finished
+        assistant_msg = await run_in_threadpool(save_message, session.session_id, "assistant", "".join(parts))
+        yield _sse("done", {"session_id": session.session_id, "message_index": assistant_msg.message_index})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
 # -------- Conversation Management Endpoints ---------
 
 @app.post("/conversations/new", response_model=ConversationResponse)
@@ -0,0 +1,179 @@
+"""
+Inverted index from metadata key/value to row numbers for the local collection.
+
+Resolves chromadb-style `where` filters to a sorted array of candidate rows
+before any vector is scored, so filtered queries only touch their slice of
+the collection. Supported operators: $eq, $ne, $in, $nin, $gt, $gte, $lt,
+$lte, combined with $and / $or (several top-level keys are an implicit $and).
+A bare value is shorthand for $eq. validate_where rejects malformed filters
+with a ValueError before anything is searched.
+"""
+import operator
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+_RANGE_OPS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+_SCALARS = (str, int, float, bool)
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+class _RowList:
+    """Growable int64 array of row numbers, appended in increasing order."""
+
+    __slots__ = ("rows", "size")
+
+    def __init__(self):
+        self.rows = np.empty(8, dtype=np.int64)
+        self.size = 0
+
+    def append(self, row: int) -> None:
+        if self.size == len(self.rows):
+            grown = np.empty(2 * len(self.rows), dtype=np.int64)
+            grown[:self.size] = self.rows[:self.size]
+            self.rows = grown
+        self.rows[self.size] = row
+        self.size += 1
+
+    def view(self) -> np.ndarray:
+        return self.rows[:self.size]
+
+
+def _comparable(a: Any, b: Any) -> bool:
+    numeric = (int, float)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool)
+    return (isinstance(a, numeric) and isinstance(b, numeric)) or (isinstance(a, str) and isinstance(b, str))
+
+
+def _kind(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    return "number" if isinstance(value, (int, float)) else "str"
+
+
+def _validate_condition(key: str, cond: Any) -> None:
+    if not isinstance(cond, dict):
+        if not isinstance(cond, _SCALARS):
+            raise ValueError(f"where[{key!r}] must be a string, number or boolean (use $in for a list)")
+        return
+    if not cond:
+        raise ValueError(f"where[{key!r}] has no operator")
+    for op, arg in cond.items():
+        if op in ("$eq", "$ne"):
+            if not isinstance(arg, _SCALARS):
+                raise ValueError(f"{op} on {key!r} takes a string, number or boolean")
+        elif op in ("$in", "$nin"):
+            if not isinstance(arg, list) or not arg or not all(isinstance(v, _SCALARS) for v in arg):
+                raise ValueError(f"{op} on {key!r} takes a non-empty list of strings, numbers or booleans")
+            if len({_kind(v) for v in arg}) > 1:
+                raise ValueError(f"{op} on {key!r} mixes value types")
+        elif op in _RANGE_OPS:
+            if isinstance(arg, bool) or not isinstance(arg, (int, float, str)):
+                raise ValueError(f"{op} on {key!r} takes a number or a string")
+        else:
+            raise ValueError(f"Unsupported where operator {op!r}")
+
+
+def validate_where(where: Any) -> None:
+    """Raise ValueError unless where is a well-formed filter in the syntax above (None and {} mean no filter)."""
+    if where is None:
+        return
+    if not isinstance(where, dict):
+        raise ValueError("where must be an object")
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(cond, list) or not cond:
+                raise ValueError(f"{key} takes a non-empty list of filters")
+            for sub in cond:
+                if not isinstance(sub, dict) or not sub:
+                    raise ValueError(f"{key} takes a non-empty list of filters")
+                validate_where(sub)
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported where operator {key!r}")
+        else:
+            _validate_condition(key, cond)
+
+
+def _posting_key(value: Any) -> tuple:
+    """Postings are keyed by (is bool, value): True == 1 in Python, but a filter on 1 must not match True."""
+    return (isinstance(value, bool), value)
+
+
+class MetadataIndex:
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._postings: Dict[str, Dict[tuple, _RowList]] = {}
+
+    def add(self, start_row: int, metadatas: Iterable[Optional[Dict[str, Any]]]) -> None:
+        for offset, meta in enumerate(metadatas):
+            for key, value in (meta or {}).items():
+                if isinstance(value, (list, dict)):
+                    continue
+                self._postings.setdefault(key, {}).setdefault(_posting_key(value), _RowList()).append(start_row + offset)
+
+    def _union(self, key: str, values: Iterable[Any]) -> np.ndarray:
+        by_value = self._postings.get(key, {})
+        parts = [by_value[k].view() for k in map(_posting_key, values) if k in by_value]
+        if not parts:
+            return _EMPTY
+        if len(parts) == 1:
+            return parts[0]
+        return np.unique(np.concatenate(parts))
+
+    def _match_key(self, key: str, cond: Any) -> np.ndarray:
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        result: Optional[np.ndarray] = None
+        values = [v for _, v in self._postings.get(key, {})]
+        for op, arg in cond.items():
+            if op == "$eq":
+                rows = self._union(key, [arg])
+            elif op == "$ne":
+                rows = self._union(key, [v for v in values if _posting_key(v) != _posting_key(arg)])
+            elif op == "$in":
+                rows = self._union(key, list(arg))
+            elif op == "$nin":
+                excluded = {_posting_key(v) for v in arg}
+                rows = self._union(key, [v for v in values if _posting_key(v) not in excluded])
+            elif op in _RANGE_OPS:
+                cmp = _RANGE_OPS[op]
+                rows = self._union(key, [v for v in values if _comparable(v, arg) and cmp(v, arg)])
+            else:
+                raise ValueError(f"Unsupported where operator {op!r}")
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+        return _EMPTY if result is None else result
+
+    def rows(self, where: Dict[str, Any]) -> np.ndarray:
+        """Sorted row numbers matching the filter; ValueError if it is malformed."""
+        if not where:
+            raise ValueError("where filter must not be empty")
+        validate_where(where)
+        return self._rows(where)
+
+    def _rows(self, where: Dict[str, Any]) -> np.ndarray:
+        parts: List[np.ndarray] = []
+        for key, cond in where.items():
+            if key == "$and":
+                sub = [self._rows(w) for w in cond]
+                rows = sub[0] if sub else _EMPTY
+                for other in sub[1:]:
+                    rows = np.intersect1d(rows, other, assume_unique=True)
+            elif key == "$or":
+                sub = [self._rows(w) for w in cond]
+                rows = np.unique(np.concatenate(sub)) if sub else _EMPTY
+            else:
+                rows = self._match_key(key, cond)
+            parts.append(rows)
+        result = parts[0]
+        for other in parts[1:]:
+            result = np.intersect1d(result, other, assume_unique=True)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._postings),
+            "values": sum(len(v) for v in self._postings.values()),
+        }
@@ -0,0 +1,131 @@
+"""
+ONNX Runtime CPU embedding backend for the local sentence-transformers model.
+
+The Hugging Face transformer behind LOCAL_EMBED_MODEL is exported to ONNX
+once (and optionally dynamically quantized to int8); inference then runs on
+onnxruntime with mean pooling and L2 normalization, matching what
+sentence-transformers does for the MiniLM family.
+
+Env vars:
+  - LOCAL_EMBED_BACKEND=onnx selects this backend (default: torch)
+  - LOCAL_EMBED_ONNX_DIR (default: ./models/onnx/<model name>)
+  - LOCAL_EMBED_ONNX_QUANTIZE (default: true, int8 dynamic quantization)
+  - LOCAL_EMBED_ONNX_NORMALIZE (default: true)
+  - LOCAL_EMBED_ONNX_MAX_LENGTH (default: 256)
+  - LOCAL_EMBED_ONNX_THREADS (default: 0 = onnxruntime decides)
+"""
+import os
+from typing import List, Optional
+
+import numpy as np
+
+_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def hf_model_id(model_name: str) -> str:
+    """sentence-transformers accepts bare names like all-MiniLM-L6-v2; the Hub needs the org."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def default_onnx_dir(model_name: str) -> str:
+    return os.path.join("models", "onnx", hf_model_id(model_name).replace("/", "__"))
+
+
+def export_onnx(model_name: str, out_dir: str, opset: int = 14) -> str:
+    """Export the transformer and its tokenizer to out_dir. Needs torch + transformers."""
+    import torch  # type: ignore
+    from transformers import AutoModel, AutoTokenizer  # type: ignore
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "model.onnx")
+    tokenizer = AutoTokenizer.from_pretrained(hf_model_id(model_name))
+    model = AutoModel.from_pretrained(hf_model_id(model_name))
+    model.eval()
+    dummy = tokenizer(["an example sentence"], return_tensors="pt")
+    names = [n for n in _INPUT_NAMES if n in dummy]
+    axes = {n: {0: "batch", 1: "sequence"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(dummy[n] for n in names), path,
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes=axes, opset_version=opset,
+        )
+    tokenizer.save_pretrained(out_dir)
+    return path
+
+
+def quantize_onnx(src: str, dst: str) -> str:
+    """Dynamic int8 quantization of the weights (activations stay float)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    return dst
+
+
+class OnnxEmbedder:
+    """Drop-in for the parts of SentenceTransformer the provider uses."""
+
+    def __init__(self, model_name: str, onnx_dir: Optional[str] = None, quantize: bool = True,
+                 normalize: bool = True, max_length: int = 256, threads: int = 0):
+        import onnxruntime as ort  # type: ignore
+        from tokenizers import Tokenizer  # type: ignore
+
+        self.model_name = model_name
+        self.onnx_dir = onnx_dir or default_onnx_dir(model_name)
+        self.quantized = quantize
+        self.normalize = normalize
+
+        fp32_path = os.path.join(self.onnx_dir, "model.onnx")
+        if not os.path.exists(fp32_path):
+            export_onnx(model_name, self.onnx_dir)
+        path = fp32_path
+        if quantize:
+            path = os.path.join(self.onnx_dir, "model.int8.onnx")
+            if not os.path.exists(path):
+                quantize_onnx(fp32_path, path)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.onnx_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self._inputs = [i.name for i in self.session.get_inputs()]
+        self._dim = int(self.encode(["dimension probe"]).shape[1])
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        out = []
+        for start in range(0, len(texts), batch_size):
+            encs = self.tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            ids = np.asarray([e.ids for e in encs], dtype=np.int64)
+            mask = np.asarray([e.attention_mask for e in encs], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+            hidden = self.session.run(None, {n: feeds[n] for n in self._inputs})[0]
+            # mean pooling over real (unpadded) tokens
+            m = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32))
+        if not out:
+            return np.zeros((0, getattr(self, "_dim", 0)), dtype=np.float32)
+        return np.concatenate(out, axis=0)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dim
+
+
+def load_onnx_embedder(model_name: str) -> OnnxEmbedder:
+    """Build an OnnxEmbedder from the LOCAL_EMBED_ONNX_* env vars."""
+    return OnnxEmbedder(
+        model_name,
+        onnx_dir=os.getenv("LOCAL_EMBED_ONNX_DIR") or None,
+        quantize=os.getenv("LOCAL_EMBED_ONNX_QUANTIZE", "true").lower() in ("1", "true", "yes"),
+        normalize=os.getenv("LOCAL_EMBED_ONNX_NORMALIZE", "true").lower() in ("1", "true", "yes"),
+        max_length=int(os.getenv("LOCAL_EMBED_ONNX_MAX_LENGTH", "256")),
+        threads=int(os.getenv("LOCAL_EMBED_ONNX_THREADS", "0")),
+    )
@@ -0,0 +1,160 @@
+"""
+Page-level PDF text extraction, optionally spread over a process pool.
+
+A large document is split into page ranges; each worker process opens the
+file itself (PyMuPDF, else pdfminer.six) and returns the text of its pages,
+which come back in page order. At most two ranges per worker are in flight,
+so memory stays bounded however long the document is. Small documents, and
+everything when the pool is disabled, are extracted in-process, range by
+range. A range PyMuPDF opens but cannot read is re-extracted with pdfminer.six.
+
+Env vars:
+  - PDF_EXTRACT_WORKERS (default: 0 = in-process)
+  - PDF_PARALLEL_MIN_PAGES: fewer pages stay in-process (default: 32)
+  - PDF_PAGES_PER_TASK: pages per worker task (default: 16)
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+_POOLS: Dict[int, "PdfWorkerPool"] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _backend(path: str) -> Tuple[Optional[str], int]:
+    """("fitz" or "pdfminer", page count) for the first library that can open path, else (None, 0)."""
+    try:
+        import fitz  # PyMuPDF
+        with fitz.open(path) as doc:
+            return "fitz", len(doc)
+    except Exception:
+        pass
+    try:
+        from pdfminer.pdfpage import PDFPage
+        with open(path, "rb") as f:
+            return "pdfminer", sum(1 for _ in PDFPage.get_pages(f))
+    except Exception:
+        return None, 0
+
+
+def _fitz_pages(path: str, start: int, end: int) -> List[str]:
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, end)]
+
+
+def _pdfminer_pages(path: str, start: int, end: int) -> List[str]:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+    return ["".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+            for layout in extract_pages(path, page_numbers=range(start, end))]
+
+
+def extract_page_range(path: str, backend: str, start: int, end: int) -> List[str]:
+    """Text of pages start..end-1 (0-based); runs in the worker processes.
+
+    If PyMuPDF fails on the range, pdfminer.six gets a go at it; when that
+    fails too, the PyMuPDF error is raised.
+    """
+    if backend != "fitz":
+        return _pdfminer_pages(path, start, end)
+    try:
+        return _fitz_pages(path, start, end)
+    except Exception as error:
+        try:
+            return _pdfminer_pages(path, start, end)
+        except Exception:
+            raise error
+
+
+def ordered_map(executor: Executor, fn: Callable, args: Iterator[tuple], window: int) -> Iterator:
+    """executor.map that yields results in order with at most window tasks in flight."""
+    pending: deque = deque()
+    for item in args:
+        pending.append(executor.submit(fn, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _page_ranges(path: str, backend: str, pages: int, step: int) -> List[tuple]:
+    step = max(1, step)
+    return [(path, backend, start, min(pages, start + step)) for start in range(0, pages, step)]
+
+
+class PdfWorkerPool:
+    def __init__(self, workers: int, pages_per_task: int = 16):
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+        # spawn: the parent may already hold torch or BLAS threads
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.documents = 0
+        self.pages = 0
+        self.tasks = 0
+
+    def iter_pages(self, path: str, backend: str, pages: int) -> Iterator[str]:
+        """Text of every page of path, in order."""
+        ranges = _page_ranges(path, backend, pages, self.pages_per_task)
+        self.documents += 1
+        self.tasks += len(ranges)
+        for texts in ordered_map(self._executor, extract_page_range, iter(ranges), 2 * self.workers):
+            self.pages += len(texts)
+            yield from texts
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pages_per_task": self.pages_per_task,
+            "documents": self.documents,
+            "pages": self.pages,
+            "tasks": self.tasks,
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_pdf_pool() -> Optional[PdfWorkerPool]:
+    """Return the shared extraction pool, or None if PDF_EXTRACT_WORKERS is 0."""
+    workers = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    pool = _POOLS.get(workers)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(workers)
+            if pool is None:
+                pool = PdfWorkerPool(workers, pages_per_task=int(os.getenv("PDF_PAGES_PER_TASK", "16")))
+                _POOLS[workers] = pool
+    return pool
+
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """Text of each page of a PDF on disk, in page order; unreadable files yield nothing.
+
+    Documents of PDF_PARALLEL_MIN_PAGES or more go to the worker pool when it is enabled.
+    """
+    backend, pages = _backend(path)
+    if backend is None:
+        return
+    pool = get_pdf_pool()
+    if pool is not None and pages >= int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32")):
+        yield from pool.iter_pages(path, backend, pages)
+        return
+    for args in _page_ranges(path, backend, pages, int(os.getenv("PDF_PAGES_PER_TASK", "16"))):
+        yield from extract_page_range(*args)
+
+
+def pdf_pool_stats() -> List[dict]:
+    return [pool.stats() for pool in list(_POOLS.values())]
+
+
+def close_pdf_pools() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
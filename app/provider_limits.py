@@ -0,0 +1,446 @@
+"""
+Per-provider concurrency limiter with adaptive backoff and request hedging.
+
+Every LLM call for a provider goes through one ProviderLimiter, and its
+remote embedding calls through a second one named <provider>_embed:
+  - a token bucket caps the request rate,
+  - a concurrency gate caps in-flight calls,
+  - retryable failures (429, 5xx, timeouts, connection errors) are retried
+    with full-jitter exponential backoff, honouring Retry-After,
+  - optionally, a hedged duplicate is sent when the first attempt runs past
+    the observed latency percentile, and the first answer wins. Async losers
+    are cancelled; a sync loser cannot be, so it runs to completion in the
+    background holding its concurrency slot, and no new hedge is sent while
+    max_concurrency / 4 of them (at least one) are still running. Hedging is
+    never enabled for in-process models (llama.cpp), which would run two
+    inferences at once on one non-thread-safe instance.
+
+Settings are read as <PROVIDER>_<NAME> (e.g. GEMINI_MAX_CONCURRENCY) with
+LLM_<NAME> as the fallback:
+  - RATE_LIMIT requests/second (default: 0 = unlimited), RATE_BURST (default: rate)
+  - MAX_CONCURRENCY (default: 8, 0 = unlimited)
+  - MAX_RETRIES (default: 2), BACKOFF_BASE seconds (0.5), BACKOFF_MAX seconds (8)
+  - HEDGE (default: false), HEDGE_PERCENTILE (95), HEDGE_MIN_SAMPLES (20)
+The embedding limiter reads <PROVIDER>_EMBED_<NAME> first (e.g.
+OPENAI_EMBED_RATE_LIMIT) and reports under its provider's "embeddings" key.
+"""
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+_LIMITERS: Dict[str, "ProviderLimiter"] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+_RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+# without a status attribute, only the head of the message is read (e.g. "Gemini API error: 503
+# UNAVAILABLE"), so a prompt or response body echoed later in it cannot make an error retryable
+_MESSAGE_HEAD = 160
+_STATUS_TEXT = re.compile(r"\b([1-5]\d\d)\b")
+_RETRYABLE_TEXT = re.compile(r"\b(rate[ _-]?limit(ed)?|resource[ _]exhausted|unavailable|timed out|timeout|"
+                             r"deadline exceeded|overloaded)\b", re.IGNORECASE)
+# limiter name suffix for a provider's embedding calls
+EMBED_LIMITER_SUFFIX = "_embed"
+# providers whose model runs in this process: a hedge would be a second concurrent inference
+_IN_PROCESS = frozenset({"llama_cpp"})
+
+
+def _setting(provider: str, name: str, default: str) -> str:
+    return os.getenv(f"{provider.upper()}_{name}") or os.getenv(f"LLM_{name}", default)
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    """HTTP status of exc, or of the error it wraps (providers re-raise as RuntimeError from the HTTP error)."""
+    for err in (exc, exc.__cause__ or exc.__context__):
+        for obj in (err, getattr(err, "response", None)):
+            for attr in ("status_code", "status", "code"):
+                value = getattr(obj, attr, None)
+                if isinstance(value, int):
+                    return value
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status = _status_of(exc)
+    if status is not None:
+        return status in _RETRYABLE_STATUS
+    name = type(exc).__name__
+    if "Timeout" in name or "Connect" in name:
+        return True
+    head = str(exc).split("\n", 1)[0][:_MESSAGE_HEAD]
+    code = _STATUS_TEXT.search(head)
+    if code is not None:
+        return int(code.group(1)) in _RETRYABLE_STATUS
+    return _RETRYABLE_TEXT.search(head) is not None
+
+
+def _retry_after(exc: BaseException) -> float:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    """Rate limiter handing out reservations: reserve() returns how long to sleep."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.0
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_take(self) -> bool:
+        """Take a token only if one is available right now (used for hedges)."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class ProviderLimiter:
+    def __init__(self, name: str, rate: float = 0.0, burst: float = 0.0, max_concurrency: int = 8,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 hedge: bool = False, hedge_percentile: float = 95.0, hedge_min_samples: int = 20):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst or rate)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._latencies: deque = deque(maxlen=500)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # sync hedge losers still running in the background
+        self._orphans = 0
+        self.metrics = {
+            "calls": 0, "succeeded": 0, "failed": 0, "retries": 0,
+            "rate_limited": 0, "rate_wait_seconds": 0.0,
+            "concurrency_waits": 0, "hedges_sent": 0, "hedges_won": 0, "hedges_orphaned": 0,
+        }
+
+    # ---- bookkeeping ----
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._cond:
+            self.metrics[key] += amount
+
+    def _record_latency(self, seconds: float) -> None:
+        with self._cond:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency percentile after which a hedge is sent, once enough samples exist."""
+        if not self.hedge:
+            return None
+        with self._cond:
+            samples = sorted(self._latencies)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        idx = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100.0))
+        return samples[idx]
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        return max(delay, _retry_after(exc))
+
+    def _rate_delay(self) -> float:
+        delay = self.bucket.reserve()
+        if delay > 0:
+            self._count("rate_limited")
+            self._count("rate_wait_seconds", delay)
+        return delay
+
+    def _try_enter(self) -> bool:
+        with self._cond:
+            if self.max_concurrency > 0 and self._in_flight >= self.max_concurrency:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _enter(self) -> None:
+        with self._cond:
+            if self.max_concurrency > 0 and self._in_flight >= self.max_concurrency:
+                self.metrics["concurrency_waits"] += 1
+                while self._in_flight >= self.max_concurrency:
+                    self._cond.wait()
+            self._in_flight += 1
+
+    async def _aenter(self) -> None:
+        if self._try_enter():
+            return
+        self._count("concurrency_waits")
+        pause = 0.005
+        while not self._try_enter():
+            await asyncio.sleep(pause)
+            pause = min(0.1, pause * 2)
+
+    def _exit(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    # ---- sync path ----
+    def _attempt(self, fn: Callable, args, kwargs) -> Any:
+        time.sleep(self._rate_delay())
+        self._enter()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            self._exit()
+        self._record_latency(time.monotonic() - start)
+        return result
+
+    def _hedged_attempt(self, fn: Callable, args, kwargs) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(fn, args, kwargs)
+        if self._executor is None:
+            with self._cond:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix=f"hedge-{self.name}")
+        primary = self._executor.submit(self._attempt, fn, args, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._may_orphan() or not self.bucket.try_take():
+            return primary.result()
+        self._count("hedges_sent")
+        hedge = self._executor.submit(self._attempt_unmetered, fn, args, kwargs)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    if fut is hedge:
+                        self._count("hedges_won")
+                    for loser in pending:
+                        self._orphan(loser)
+                    return fut.result()
+                error = fut.exception()
+        raise error  # type: ignore[misc]
+
+    def _may_orphan(self) -> bool:
+        """Whether another sync hedge may be sent: its loser will run on, unbounded otherwise."""
+        limit = max(1, self.max_concurrency // 4) if self.max_concurrency > 0 else 1
+        with self._cond:
+            return self._orphans < limit
+
+    def _orphan(self, fut) -> None:
+        """Account for a losing attempt that cannot be cancelled until it finishes."""
+        with self._cond:
+            self._orphans += 1
+            self.metrics["hedges_orphaned"] += 1
+
+        def release(_):
+            with self._cond:
+                self._orphans -= 1
+
+        fut.add_done_callback(release)
+
+    def _attempt_unmetered(self, fn: Callable, args, kwargs) -> Any:
+        # hedges already took their token with try_take
+        self._enter()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            self._exit()
+        self._record_latency(time.monotonic() - start)
+        return result
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                result = self._hedged_attempt(fn, args, kwargs)
+                self._count("succeeded")
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    # ---- async path ----
+    async def _aattempt(self, afn: Callable, args, kwargs, metered: bool = True) -> Any:
+        if metered:
+            await asyncio.sleep(self._rate_delay())
+        await self._aenter()
+        start = time.monotonic()
+        try:
+            result = await afn(*args, **kwargs)
+        finally:
+            self._exit()
+        self._record_latency(time.monotonic() - start)
+        return result
+
+    async def _ahedged_attempt(self, afn: Callable, args, kwargs) -> Any:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._aattempt(afn, args, kwargs)
+        primary = asyncio.ensure_future(self._aattempt(afn, args, kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.bucket.try_take():
+            return await primary
+        self._count("hedges_sent")
+        hedge = asyncio.ensure_future(self._aattempt(afn, args, kwargs, metered=False))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    if fut.exception() is None:
+                        if fut is hedge:
+                            self._count("hedges_won")
+                        return fut.result()
+                    error = fut.exception()
+            raise error  # type: ignore[misc]
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    async def acall(self, afn: Callable, *args, **kwargs) -> Any:
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                result = await self._ahedged_attempt(afn, args, kwargs)
+                self._count("succeeded")
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    async def astream(self, astream_fn: Callable, *args, **kwargs):
+        """Limit a token stream; retries only happen before the first token."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._rate_delay())
+            await self._aenter()
+            started = False
+            try:
+                async for token in astream_fn(*args, **kwargs):
+                    started = True
+                    yield token
+                self._count("succeeded")
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                delay = self._backoff(attempt, e)
+            finally:
+                self._exit()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # ---- wrappers ----
+    def wrap(self, fn: Callable) -> Callable:
+        def limited(*args, **kwargs):
+            return self.call(fn, *args, **kwargs)
+        return limited
+
+    def awrap(self, afn: Callable) -> Callable:
+        async def limited(*args, **kwargs):
+            return await self.acall(afn, *args, **kwargs)
+        return limited
+
+    def wrap_stream(self, astream_fn: Callable) -> Callable:
+        def limited(*args, **kwargs):
+            return self.astream(astream_fn, *args, **kwargs)
+        return limited
+
+    def stats(self) -> dict:
+        with self._cond:
+            out = dict(self.metrics)
+            out["in_flight"] = self._in_flight
+            out["orphaned_in_flight"] = self._orphans
+            latency_samples = len(self._latencies)
+        out.update({
+            "max_concurrency": self.max_concurrency,
+            "rate_limit": self.bucket.rate,
+            "latency_samples": latency_samples,
+            "hedge_after_seconds": self.hedge_delay(),
+        })
+        return out
+
+
+def get_provider_limiter(name: str) -> ProviderLimiter:
+    """Return the process-wide limiter for a provider (openai, gemini, tgi, llama_cpp)."""
+    limiter = _LIMITERS.get(name)
+    if limiter is None:
+        with _LIMITERS_LOCK:
+            limiter = _LIMITERS.get(name)
+            if limiter is None:
+                rate = float(_setting(name, "RATE_LIMIT", "0"))
+                limiter = ProviderLimiter(
+                    name,
+                    rate=rate,
+                    burst=float(_setting(name, "RATE_BURST", str(rate))),
+                    max_concurrency=int(_setting(name, "MAX_CONCURRENCY", "8")),
+                    max_retries=int(_setting(name, "MAX_RETRIES", "2")),
+                    backoff_base=float(_setting(name, "BACKOFF_BASE", "0.5")),
+                    backoff_max=float(_setting(name, "BACKOFF_MAX", "8")),
+                    hedge=(name not in _IN_PROCESS
+                           and _setting(name, "HEDGE", "false").lower() in ("1", "true", "yes")),
+                    hedge_percentile=float(_setting(name, "HEDGE_PERCENTILE", "95")),
+                    hedge_min_samples=int(_setting(name, "HEDGE_MIN_SAMPLES", "20")),
+                )
+                _LIMITERS[name] = limiter
+    return limiter
+
+
+def provider_limit_stats() -> Dict[str, dict]:
+    """Stats per provider; its embedding limiter's appear under "embeddings"."""
+    out: Dict[str, dict] = {}
+    embeds = {}
+    for name, limiter in list(_LIMITERS.items()):
+        if name.endswith(EMBED_LIMITER_SUFFIX):
+            embeds[name[:-len(EMBED_LIMITER_SUFFIX)]] = limiter.stats()
+        else:
+            out[name] = limiter.stats()
+    for provider, stats in embeds.items():
+        out.setdefault(provider, {})["embeddings"] = stats
+    return out
+
+
+def reset_provider_limiters() -> None:
+    with _LIMITERS_LOCK:
+        _LIMITERS.clear()
@@ -0,0 +1,205 @@
+"""
+LLM response cache keyed on the question and the retrieved-context fingerprint.
+
+Entries are keyed by (scope, provider, model, collection, normalized question,
+ids of the retrieved chunks). Retrieval still runs on every request, so new
+documents that change the top-k naturally miss; upserting a chunk id or
+resetting a collection invalidates the entries that depend on it. Answers
+retrieved from several shards carry their collection names joined by "+",
+and any one of those collections invalidates them.
+
+With RESPONSE_CACHE_SIMILARITY set, a miss on the exact question falls back
+to any entry with the same retrieved chunks whose query embedding has cosine
+similarity at or above the threshold.
+
+Env vars:
+  - RESPONSE_CACHE_ENABLED (default: true)
+  - RESPONSE_CACHE_MAX_ENTRIES (default: 1000)
+  - RESPONSE_CACHE_TTL seconds (default: 3600)
+  - RESPONSE_CACHE_SIMILARITY (default: 0 = near-duplicate mode off)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+_CACHE: Optional["ResponseCache"] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def normalize_question(question: str) -> str:
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip("?!. ")
+
+
+def _collections(collection: str) -> List[str]:
+    return collection.split("+")
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "collection", "chunk_ids", "group", "qvec")
+
+    def __init__(self, value, expires, collection, chunk_ids, group, qvec):
+        self.value = value
+        self.expires = expires
+        self.collection = collection
+        self.chunk_ids = chunk_ids
+        self.group = group
+        self.qvec = qvec
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600.0, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # reverse indexes for invalidation and near-duplicate lookup
+        self._by_chunk: Dict[Tuple[str, str], Set[str]] = {}
+        self._by_group: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _group(scope: str, provider: str, model: str, collection: str, chunk_ids: Sequence[str]) -> str:
+        raw = "\x1f".join([scope, provider, model, collection, *chunk_ids])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(group: str, question: str) -> str:
+        return hashlib.sha256(f"{group}\x1f{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def get(self, scope: str, provider: str, model: str, collection: str, question: str,
+            chunk_ids: Sequence[str], qvec: Optional[Sequence[float]] = None) -> Optional[Any]:
+        group = self._group(scope, provider, model, collection, chunk_ids)
+        key = self._key(group, question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < now:
+                self._remove_locked(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if self.similarity_threshold > 0 and qvec is not None:
+                match = self._nearest_locked(group, qvec, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.near_hits += 1
+                    return self._entries[match].value
+            self.misses += 1
+            return None
+
+    def _nearest_locked(self, group: str, qvec: Sequence[float], now: float) -> Optional[str]:
+        q = np.asarray(qvec, dtype=np.float32)
+        qn = float(np.linalg.norm(q)) or 1.0
+        best, best_sim = None, self.similarity_threshold
+        for key in list(self._by_group.get(group, ())):
+            entry = self._entries[key]
+            if entry.expires < now:
+                self._remove_locked(key)
+                continue
+            if entry.qvec is None or entry.qvec.shape != q.shape:
+                continue
+            sim = float(entry.qvec @ q) / ((float(np.linalg.norm(entry.qvec)) or 1.0) * qn)
+            if sim >= best_sim:
+                best, best_sim = key, sim
+        return best
+
+    def put(self, scope: str, provider: str, model: str, collection: str, question: str,
+            chunk_ids: Sequence[str], value: Any, qvec: Optional[Sequence[float]] = None) -> None:
+        group = self._group(scope, provider, model, collection, chunk_ids)
+        key = self._key(group, question)
+        vec = np.asarray(qvec, dtype=np.float32) if qvec is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = _Entry(value, time.time() + self.ttl, collection, tuple(chunk_ids), group, vec)
+            for coll in _collections(collection):
+                for cid in chunk_ids:
+                    self._by_chunk.setdefault((coll, cid), set()).add(key)
+            self._by_group.setdefault(group, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+
+    def _remove_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for coll in _collections(entry.collection):
+            for cid in entry.chunk_ids:
+                keys = self._by_chunk.get((coll, cid))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_chunk[(coll, cid)]
+        keys = self._by_group.get(entry.group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_group[entry.group]
+
+    def invalidate_chunks(self, collection: str, chunk_ids: Iterable[str]) -> int:
+        """Drop entries whose answer was built from any of the given chunk ids."""
+        with self._lock:
+            stale: Set[str] = set()
+            for cid in chunk_ids:
+                stale.update(self._by_chunk.get((collection, cid), ()))
+            for key in stale:
+                self._remove_locked(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def invalidate_collection(self, collection: str) -> int:
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if collection in _collections(e.collection)]
+            for key in stale:
+                self._remove_locked(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_chunk.clear()
+            self._by_group.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "similarity_threshold": self.similarity_threshold,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.near_hits) / total) if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if RESPONSE_CACHE_ENABLED is off."""
+    global _CACHE
+    if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = ResponseCache(
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+                    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                    similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")),
+                )
+    return _CACHE
@@ -1,19 +1,200 @@
+import asyncio
 import os
-from typing import List, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 
 from .chroma_client import get_chroma_collection
-from .llm_provider import get_llm_and_embeddings
+from .lexical_index import get_lexical_index
+from .llm_provider import get_llm_and_embeddings, get_async_llm_and_embeddings
+from .sharding import search_collections
+
+
+class RetrievedChunks(NamedTuple):
+    """Top-k chunks for one query plus what identifies them (for response caching)."""
+    docs: List[str]
+    metas: List[dict]
+    ids: List[str]
+    collection: str
+    qvec: np.ndarray
+
+
+# Metadata filter in chromadb `where` syntax, e.g. {"source": "10k.pdf"} or
+# {"$and": [{"user": "alice"}, {"ingested_at": {"$gte": 1700000000}}]}
+Where = Optional[Dict[str, Any]]
+
+# reciprocal rank fusion constant: a chunk ranked r-th by one retriever scores 1 / (_RRF_K + r)
+_RRF_K = 60
+
+# searches the shards of a multi-collection query concurrently (see app/sharding.py)
+_FANOUT_POOL: Optional[ThreadPoolExecutor] = None
+_FANOUT_LOCK = threading.Lock()
+
+
+def _hybrid_enabled() -> bool:
+    """RETRIEVAL_MODE=hybrid fuses BM25 (app/lexical_index.py) with the vector ranking."""
+    return os.getenv("RETRIEVAL_MODE", "vector").lower() == "hybrid"
+
+
+def _fan_out(fn: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+    """fn over items in order; with several items, all but the first run on a shared pool."""
+    global _FANOUT_POOL
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    if _FANOUT_POOL is None:
+        with _FANOUT_LOCK:
+            if _FANOUT_POOL is None:
+                _FANOUT_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("SHARD_FANOUT_WORKERS", "8")),
+                                                  thread_name_prefix="shard-fanout")
+    futures = [_FANOUT_POOL.submit(fn, item) for item in items[1:]]
+    return [fn(items[0])] + [f.result() for f in futures]
+
+
+def _column(result: dict, key: str, qi: int) -> list:
+    col = result.get(key)
+    return list(col[qi]) if col else []
+
+
+def _query_collection(qvecs, top_k: int, where: Where = None, texts: Optional[List[str]] = None,
+                      collections: Optional[List[str]] = None) -> List[RetrievedChunks]:
+    """Search every collection (shard) for every query vector and merge the top_k by distance.
+
+    Each collection gets one multi-query collection.query call (plus BM25 over
+    texts in hybrid mode); several collections are searched concurrently.
+    """
+    qvecs = np.asarray(qvecs, dtype=np.float32)
+    if len(qvecs) == 0:
+        return []
+    shards = [get_chroma_collection(name) for name in (collections or [None])]
+    lexical = [get_lexical_index(c.name) for c in shards] if texts is not None and _hybrid_enabled() else []
+    hybrid = bool(lexical) and all(index is not None for index in lexical)
+    # in hybrid mode each retriever contributes a deeper candidate list to the fusion
+    fetch = top_k * int(os.getenv("HYBRID_CANDIDATES", "4")) if hybrid else top_k
+    kwargs = {"where": where} if where else {}
+
+    def search(s: int):
+        result = shards[s].query(query_embeddings=qvecs.tolist(), n_results=fetch, include=["documents", "metadatas", "distances"], **kwargs)  # type: ignore
+        return result, lexical[s].search_batch(texts, fetch) if hybrid else None
+
+    results = _fan_out(search, list(range(len(shards))))
+    name = "+".join(c.name for c in shards)
+    # chunks are keyed by (shard, id): two tenants may both have doc_10k.pdf_0
+    known: Dict[Tuple[int, str], Tuple[str, dict]] = {}
+    vector: List[List[Tuple[int, str]]] = []
+    for qi in range(len(qvecs)):
+        hits = []
+        for s, (result, _) in enumerate(results):
+            ids = _column(result, "ids", qi)
+            dists = _column(result, "distances", qi) or [0.0] * len(ids)
+            known.update(zip(((s, cid) for cid in ids),
+                             zip(_column(result, "documents", qi), _column(result, "metadatas", qi))))
+            hits.extend((d, s, cid) for d, cid in zip(dists, ids))
+        hits.sort(key=lambda hit: hit[0])
+        vector.append([(s, cid) for _, s, cid in hits[:fetch]])
+    if not hybrid:
+        return [_chunks(known, ranking, name, qvecs[qi]) for qi, ranking in enumerate(vector)]
+    bm25 = []
+    for qi in range(len(qvecs)):
+        hits = [(score, s, cid) for s, (_, found) in enumerate(results) for cid, score in found[qi]]
+        hits.sort(key=lambda hit: -hit[0])
+        bm25.append([(s, cid) for _, s, cid in hits[:fetch]])
+    return _fuse(shards, known, vector, bm25, top_k, where, name, qvecs)
+
+
+def _chunks(known: Dict[Tuple[int, str], Tuple[str, dict]], ranking: List[Tuple[int, str]], collection: str,
+            qvec: np.ndarray) -> RetrievedChunks:
+    return RetrievedChunks([known[key][0] for key in ranking], [known[key][1] for key in ranking],
+                           [cid for _, cid in ranking], collection, qvec)
 
 
-def retrieve_context(query: str, top_k: int = 5) -> Tuple[List[str], List[dict]]:
-    """Embed the query and retrieve top_k documents from the configured collection."""
+def _fuse(shards, known: Dict[Tuple[int, str], Tuple[str, dict]], vector: List[List[Tuple[int, str]]],
+          lexical: List[List[Tuple[int, str]]], top_k: int, where: Where, collection: str,
+          qvecs: np.ndarray) -> List[RetrievedChunks]:
+    """Reciprocal rank fusion of the vector and BM25 rankings of each query."""
+    # chunks only BM25 found: one get per shard for all queries, which also applies the where filter
+    missing: Dict[int, Dict[str, None]] = {}
+    for ranking in lexical:
+        for s, cid in ranking:
+            if (s, cid) not in known:
+                missing.setdefault(s, {})[cid] = None
+    kwargs = {"where": where} if where else {}
+
+    def get(s: int):
+        return shards[s].get(ids=list(missing[s]), include=["documents", "metadatas"], **kwargs)
+
+    for s, got in zip(missing, _fan_out(get, list(missing))):
+        known.update(zip(((s, cid) for cid in got.get("ids") or []),
+                         zip(got.get("documents") or [], got.get("metadatas") or [])))
+    fused = []
+    for qi, rankings in enumerate(zip(vector, lexical)):
+        scores: Dict[Tuple[int, str], float] = {}
+        for ranking in rankings:
+            for rank, key in enumerate(ranking):
+                if key in known:
+                    scores[key] = scores.get(key, 0.0) + 1.0 / (_RRF_K + rank + 1)
+        best = sorted(scores, key=lambda key: -scores[key])[:top_k]
+        fused.append(_chunks(known, best, collection, qvecs[qi]))
+    return fused
+
+
+def retrieve_chunks(query: str, top_k: int = 5, where: Where = None, user: Optional[str] = None) -> RetrievedChunks:
+    return retrieve_chunks_batch([query], top_k, where, user)[0]
+
+
+async def aretrieve_chunks(query: str, top_k: int = 5, where: Where = None,
+                           user: Optional[str] = None) -> RetrievedChunks:
+    return (await aretrieve_chunks_batch([query], top_k, where, user))[0]
+
+
+def retrieve_chunks_batch(queries: List[str], top_k: int = 5, where: Where = None,
+                          user: Optional[str] = None) -> List[RetrievedChunks]:
+    """Embed all queries in one call and search them with one multi-query collection.query per shard.
+
+    user selects the shards searched when SHARD_BY=user (see app/sharding.py).
+    """
+    if not queries:
+        return []
     _, embedder = get_llm_and_embeddings()
-    qvec = embedder([query])[0]
-    collection = get_chroma_collection()
-    result = collection.query(query_embeddings=[qvec], n_results=top_k, include=["documents", "metadatas", "distances"])  # type: ignore
-    docs = (result.get("documents") or [[]])[0]
-    metas = (result.get("metadatas") or [[]])[0]
-    return docs, metas
+    return _query_collection(embedder(list(queries)), top_k, where, list(queries), search_collections(user))
+
+
+async def aretrieve_chunks_batch(queries: List[str], top_k: int = 5, where: Where = None,
+                                 user: Optional[str] = None) -> List[RetrievedChunks]:
+    if not queries:
+        return []
+    _, aembed = get_async_llm_and_embeddings()
+    qvecs = await aembed(list(queries))
+    return await asyncio.to_thread(_query_collection, qvecs, top_k, where, list(queries), search_collections(user))
+
+
+def retrieve_context(query: str, top_k: int = 5, where: Where = None,
+                     user: Optional[str] = None) -> Tuple[List[str], List[dict]]:
+    """Embed the query and retrieve top_k documents from the configured collection.
+
+    where restricts the search to chunks whose metadata matches the filter.
+    """
+    found = retrieve_chunks(query, top_k, where, user)
+    return found.docs, found.metas
+
+
+async def aretrieve_context(query: str, top_k: int = 5, where: Where = None,
+                            user: Optional[str] = None) -> Tuple[List[str], List[dict]]:
+    """Async retrieve_context: awaits the provider's embedder, runs the vector query in a thread."""
+    found = await aretrieve_chunks(query, top_k, where, user)
+    return found.docs, found.metas
+
+
+def retrieve_contexts(queries: List[str], top_k: int = 5, where: Where = None,
+                      user: Optional[str] = None) -> List[Tuple[List[str], List[dict]]]:
+    """Batched retrieve_context: (docs, metas) per query from one embed call and one search."""
+    return [(found.docs, found.metas) for found in retrieve_chunks_batch(queries, top_k, where, user)]
+
+
+async def aretrieve_contexts(queries: List[str], top_k: int = 5, where: Where = None,
+                             user: Optional[str] = None) -> List[Tuple[List[str], List[dict]]]:
+    return [(found.docs, found.metas) for found in await aretrieve_chunks_batch(queries, top_k, where, user)]
 
 
 def build_rag_prompt(query: str, docs: List[str]) -> str:
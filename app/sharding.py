@@ -0,0 +1,105 @@
+"""
+Per-tenant collection sharding.
+
+With SHARD_BY=user each user's chunks go to their own collection,
+`<CHROMA_COLLECTION>__u_<user>`, so a search scans that user's rows (plus an
+optional shared knowledge shard, `<CHROMA_COLLECTION>__<SHARED_SHARD>`)
+instead of every chunk on the platform. Shards are created on first use, and
+collections nobody has touched for SHARD_IDLE_SECONDS are dropped from the
+process caches; Chroma handles and LOCAL_VECTOR_DIR collections reopen on
+their next use.
+
+Env vars:
+  - SHARD_BY=user enables sharding (default: off, everything in CHROMA_COLLECTION)
+  - SHARED_SHARD: name of the shard every search also covers (default: none)
+  - SHARD_IDLE_SECONDS (default: 900; 0 = never evict)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import List, Optional
+
+from .chroma_client import evict_idle_collections
+
+_SWEEP = {"last": time.monotonic()}
+_SWEEP_LOCK = threading.Lock()
+
+# chroma collection names: 3-63 chars of [a-zA-Z0-9._-], alphanumeric at both ends
+_UNSAFE = re.compile(r"[^a-zA-Z0-9_-]+")
+_MAX_NAME = 63
+
+
+def _base() -> str:
+    return os.getenv("CHROMA_COLLECTION", "documents")
+
+
+def sharding_enabled() -> bool:
+    return os.getenv("SHARD_BY", "").lower() == "user"
+
+
+def _safe(name: str, room: int) -> str:
+    """name as a collection-name fragment; a hash suffix keeps rewritten names distinct."""
+    safe = _UNSAFE.sub("-", name).strip("-_")
+    if safe == name and 0 < len(safe) <= room:
+        return safe
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:10]
+    return f"{safe[:max(0, room - 11)]}-{digest}".lstrip("-")
+
+
+def shard_name(user: str) -> str:
+    """Collection holding one user's chunks."""
+    prefix = f"{_base()}__u_"
+    return prefix + _safe(user, _MAX_NAME - len(prefix))
+
+
+def shared_shard_name() -> Optional[str]:
+    shared = os.getenv("SHARED_SHARD", "")
+    if not shared or not sharding_enabled():
+        return None
+    prefix = f"{_base()}__"
+    return prefix + _safe(shared, _MAX_NAME - len(prefix))
+
+
+def ingest_collection(user: Optional[str], shared: bool = False) -> str:
+    """Collection that ingest (and per-collection admin calls) for this user should target.
+
+    Raises ValueError when the shared shard is asked for but not configured.
+    """
+    if shared:
+        name = shared_shard_name()
+        if name is None:
+            raise ValueError("No shared shard configured (set SHARD_BY=user and SHARED_SHARD)")
+        return name
+    if not sharding_enabled():
+        return _base()
+    _maybe_evict()
+    return shard_name(user or "anonymous")
+
+
+def search_collections(user: Optional[str]) -> List[str]:
+    """Collections a search for this user fans out over: their shard, then the shared one."""
+    if not sharding_enabled():
+        return [_base()]
+    _maybe_evict()
+    names = [shard_name(user or "anonymous")]
+    shared = shared_shard_name()
+    if shared is not None:
+        names.append(shared)
+    return names
+
+
+def _maybe_evict() -> None:
+    """Evict idle collections at most twice per idle period."""
+    idle = float(os.getenv("SHARD_IDLE_SECONDS", "900"))
+    if idle <= 0:
+        return
+    now = time.monotonic()
+    if now - _SWEEP["last"] < idle / 2:
+        return
+    with _SWEEP_LOCK:
+        if now - _SWEEP["last"] < idle / 2:
+            return
+        _SWEEP["last"] = now
+    evict_idle_collections(idle)
@@ -0,0 +1,195 @@
+"""
+Compressed encodings of the local collection's vectors.
+
+A codec keeps a compact copy of every row that searches score against; the
+float32 matrix is then only read for the few candidates that get re-ranked
+at full precision. The codes are stored in addition to that matrix, not
+instead of it, so they only save memory when the matrix is a memory-mapped
+file (LOCAL_VECTOR_DIR): what stays resident per vector is then the code
+rather than 4 * dim bytes, with the float32 pages read in for the reranked
+candidates. chroma_client ignores LOCAL_CODEC for purely in-memory
+collections, where a codec would only add bytes per row.
+
+  - Float16Codec: half-precision rows, 2 * dim bytes. Scores are within
+    float16 rounding of exact, but scanning is slower than float32 since
+    NumPy converts each block back before the matrix product: it trades
+    query latency for resident memory.
+  - PQCodec: product quantization. Each row is split into m sub-vectors and
+    each of them replaced by the index of its nearest of 256 centroids, for m
+    bytes per row (48 bytes for 384 dims instead of 1536). Queries are scored
+    with asymmetric distance computation: the query stays in float32, one
+    (m x 256) table of sub-vector dot products is built per query, and a row's
+    score is the sum of m table lookups. It needs min_rows rows to train.
+
+Env vars (read by chroma_client):
+  - LOCAL_CODEC=f16|pq enables a codec with LOCAL_VECTOR_DIR (default: off, float32 only)
+  - LOCAL_PQ_M: sub-vectors per row (default 0 = dim / 8)
+  - LOCAL_CODEC_MIN_ROWS: rows before PQ trains; smaller collections stay exact (default 10000)
+  - LOCAL_CODEC_RERANK: candidates re-scored at full precision, as a multiple of k (default 10; 0 = off)
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+_BLOCK = 16384
+
+
+class Float16Codec:
+    name = "f16"
+    dtype = np.float16
+
+    def reset(self) -> None:
+        pass
+
+    @property
+    def trained(self) -> bool:
+        return True
+
+    def needs_training(self, rows: int) -> bool:
+        return False
+
+    def train(self, vectors: np.ndarray) -> None:
+        pass
+
+    def code_width(self, dim: int) -> int:
+        return dim
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32).astype(np.float16)
+
+    def score(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate dot products, (queries x rows)."""
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK):
+            block = codes[start:start + _BLOCK].astype(np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        return out
+
+    def save(self, path: str) -> None:
+        pass
+
+    def load(self, path: str) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"type": self.name, "trained": True}
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int, rng: np.random.Generator) -> np.ndarray:
+    """Euclidean k-means on a small sample; same sort + reduceat update as the IVF trainer."""
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        # |x - c|^2 up to the per-row |x|^2 term, computed in place
+        dist = x @ centroids.T
+        dist *= -2
+        dist += (centroids * centroids).sum(axis=1)
+        assign = np.argmin(dist, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(x[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        empty = ~nonempty
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class PQCodec:
+    name = "pq"
+    dtype = np.uint8
+
+    def __init__(self, m: int = 0, ks: int = 256, min_rows: int = 10000, iters: int = 8,
+                 max_train_rows: int = 10000, seed: int = 0):
+        self.m = m
+        self.ks = min(ks, 256)
+        self.min_rows = min_rows
+        self.iters = iters
+        self.max_train_rows = max_train_rows
+        self.seed = seed
+        self.reset()
+
+    def reset(self) -> None:
+        self.codebooks: Optional[np.ndarray] = None  # (m, ks, dim / m)
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def needs_training(self, rows: int) -> bool:
+        return not self.trained and rows >= self.min_rows
+
+    def _subspaces(self, dim: int) -> int:
+        m = min(self.m or max(1, dim // 8), dim)
+        while dim % m:
+            m -= 1
+        return m
+
+    def code_width(self, dim: int) -> int:
+        return self.codebooks.shape[0] if self.trained else self._subspaces(dim)
+
+    def train(self, vectors: np.ndarray) -> None:
+        n, dim = vectors.shape
+        m = self._subspaces(dim)
+        sub = dim // m
+        rng = np.random.default_rng(self.seed)
+        sample_idx = np.sort(rng.choice(n, size=min(n, self.max_train_rows), replace=False))
+        sample = np.asarray(vectors[sample_idx], dtype=np.float32)
+        ks = min(self.ks, len(sample))
+        self.codebooks = np.stack([_kmeans(sample[:, j * sub:(j + 1) * sub], ks, self.iters, rng)
+                                   for j in range(m)]).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        m, ks, sub = self.codebooks.shape
+        c_sq = (self.codebooks * self.codebooks).sum(axis=2)  # (m, ks)
+        out = np.empty((vectors.shape[0], m), dtype=np.uint8)
+        for start in range(0, vectors.shape[0], _BLOCK):
+            block = np.asarray(vectors[start:start + _BLOCK], dtype=np.float32)
+            for j in range(m):
+                x = block[:, j * sub:(j + 1) * sub]
+                # |x - c|^2 without the |x|^2 term, which does not change the argmin
+                out[start:start + len(block), j] = np.argmin(c_sq[j][None, :] - 2 * (x @ self.codebooks[j].T),
+                                                             axis=1)
+        return out
+
+    def score(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distance computation: approximate dot products, (queries x rows)."""
+        m, ks, sub = self.codebooks.shape
+        # one (m x ks) table per query: each query sub-vector against every centroid of its subspace
+        tables = np.einsum("qms,mks->qmk", queries.reshape(len(queries), m, sub), self.codebooks)
+        tables = tables.reshape(len(queries), m * ks)
+        offsets = (np.arange(m) * ks).astype(np.int32)
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK):
+            idx = codes[start:start + _BLOCK].astype(np.int32) + offsets
+            for qi in range(len(queries)):
+                out[qi, start:start + len(idx)] = tables[qi][idx].sum(axis=1)
+        return out
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, codebooks=self.codebooks)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            self.codebooks = data["codebooks"].astype(np.float32)
+
+    def stats(self) -> dict:
+        return {"type": self.name, "trained": self.trained, "min_rows": self.min_rows}
+
+
+def make_codec(name: str, pq_m: int = 0, min_rows: int = 10000):
+    """Codec by name ("f16" or "pq"); None for "" or "none"."""
+    name = (name or "").lower()
+    if name in ("", "none", "f32"):
+        return None
+    if name == "f16":
+        return Float16Codec()
+    if name == "pq":
+        return PQCodec(m=pq_m, min_rows=min_rows)
+    raise ValueError(f"Unknown vector codec {name!r} (expected f16 or pq)")
@@ -0,0 +1,883 @@
+"""
+In-process vector store used when chromadb is not installed.
+
+Embeddings live in one growable, contiguous float32 matrix whose rows are
+L2-normalized on insert, so a query is a single matrix product against the
+used rows followed by argpartition for the top-k. Ids, documents and
+metadata are kept in parallel Python lists indexed by row.
+
+The collection mimics the subset of the chromadb Collection API the app
+uses: upsert, query (with `where` filters), get, delete, count (plus clear
+for resets). An optional IVFIndex (app/ann_index.py) replaces the full scan
+once the collection is large, and a MetadataIndex (app/metadata_index.py)
+narrows filtered queries to the matching rows before scoring. An optional
+codec (app/vector_codecs.py) keeps a float16 or product-quantized copy of the
+rows that searches score against; the best rerank * k candidates are then
+re-scored against the float32 rows.
+
+Upsert is keyed by id: an id -> row map finds the previous row of each id,
+which is tombstoned (cleared in a boolean live mask that every search
+honours) while the new version is appended. delete() tombstones the same
+way. Once dead rows pass compact_ratio of the matrix, a background thread
+rewrites the matrix, the metadata index and the ANN lists with only the live
+rows, so memory and query cost follow live data rather than upload history.
+Writers wait for a running compaction; queries keep using the old arrays
+until the swap.
+
+PersistentCollection keeps the same matrix in a memory-mapped file so a
+restart maps the vectors instead of re-ingesting, and several worker
+processes share the pages through the OS cache. Its directory holds:
+  - manifest.json: dim, committed row and tombstone counts, and generation;
+    rewritten atomically after the data it counts is on disk, so a crash
+    mid-upsert leaves the previous state intact
+  - vectors.<gen>.f32: raw row-major float32 matrix (capacity x dim)
+  - records.<gen>.jsonl: append-only sidecar, one {id, document, metadata} per row
+  - tombstones.<gen>.i64: append-only dead row numbers
+  - ivf.npz / ivf_assign.<gen>.i32: ANN centroids and the append-only
+    row -> cell assignments, when an index is configured
+  - codec.npz / codes.<gen>.bin: PQ codebooks and the append-only row codes,
+    when a codec is configured
+Compaction and clear() write the next generation's files, switch the
+manifest to it and only then remove the old ones.
+"""
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: only threads within one process are serialized
+    fcntl = None
+
+import numpy as np
+
+from .ann_index import IVFIndex
+from .metadata_index import MetadataIndex
+from .vector_codecs import Float16Codec, PQCodec
+
+Codec = Union[Float16Codec, PQCodec]
+
+logger = logging.getLogger(__name__)
+
+_MIN_CAPACITY = 1024
+_COPY_BATCH = 16384
+
+
+def _as_matrix(vectors: Any) -> np.ndarray:
+    mat = np.asarray(vectors, dtype=np.float32)
+    if mat.ndim == 1:
+        mat = mat.reshape(1, -1)
+    return mat
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / np.clip(norms, 1e-12, None)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores per row, best first."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def _copy_rows(dst: np.ndarray, src: np.ndarray, rows: np.ndarray) -> None:
+    """dst[:len(rows)] = src[rows], in bounded-memory batches."""
+    for start in range(0, len(rows), _COPY_BATCH):
+        block = rows[start:start + _COPY_BATCH]
+        dst[start:start + len(block)] = src[block]
+
+
+class MemoryCollection:
+    def __init__(self, name: str, index: Optional[IVFIndex] = None, compact_ratio: float = 0.25,
+                 compact_min_rows: int = 1000, codec: Optional[Codec] = None, rerank: int = 10):
+        self.name = name
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self.rerank = rerank
+        self._index = index
+        self._codec = codec
+        self._meta_index = MetadataIndex()
+        self._lock = threading.Lock()
+        # serializes writers (upsert, delete, clear, compaction); queries only take _lock
+        self._write_lock = threading.Lock()
+        self._compacting = False
+        self._vectors: Optional[np.ndarray] = None
+        self._live: Optional[np.ndarray] = None
+        self._codes: Optional[np.ndarray] = None
+        self._coded = 0
+        self._size = 0
+        self._deleted = 0
+        self._ids: List[str] = []
+        self._docs: List[Optional[str]] = []
+        self._metas: List[Optional[Dict[str, Any]]] = []
+        self._row_of: Dict[str, int] = {}
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self._vectors is None else int(self._vectors.shape[1])
+
+    @contextmanager
+    def _writing(self):
+        with self._write_lock:
+            yield
+
+    @contextmanager
+    def quiesced(self):
+        """Yield True with writers held off, or False while a write or compaction is running.
+
+        Lets a cache drop the collection only when no thread is modifying it.
+        """
+        if self._compacting or not self._write_lock.acquire(blocking=False):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._write_lock.release()
+
+    def _reset_locked(self) -> None:
+        self._vectors, self._live = None, None
+        self._codes, self._coded = None, 0
+        self._size, self._deleted = 0, 0
+        self._ids, self._docs, self._metas = [], [], []
+        self._row_of = {}
+        self._meta_index.reset()
+        if self._index is not None:
+            self._index.reset()
+        if self._codec is not None:
+            self._codec.reset()
+
+    def _reserve_locked(self, extra: int, dim: int) -> None:
+        if self._vectors is None:
+            cap = max(_MIN_CAPACITY, extra)
+            self._vectors = np.empty((cap, dim), dtype=np.float32)
+            self._live = np.zeros(cap, dtype=bool)
+            return
+        if dim != self._vectors.shape[1]:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimensionality "
+                             f"{self._vectors.shape[1]}")
+        needed = self._size + extra
+        if needed > self._vectors.shape[0]:
+            cap = max(needed, self._vectors.shape[0] * 2)
+            grown = np.empty((cap, dim), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._grow_live_locked()
+
+    def _grow_live_locked(self) -> None:
+        cap = self._vectors.shape[0]
+        if self._live is None or len(self._live) < cap:
+            live = np.zeros(cap, dtype=bool)
+            if self._live is not None:
+                live[:self._size] = self._live[:self._size]
+            self._live = live
+
+    # ---- writes ----
+    def upsert(self, ids=None, documents=None, metadatas=None, embeddings=None):
+        ids = list(ids or [])
+        if not ids:
+            return
+        if embeddings is None or len(embeddings) == 0:
+            raise ValueError("embeddings are required")
+        mat = _as_matrix(embeddings)
+        if mat.shape[0] != len(ids):
+            raise ValueError(f"Got {len(ids)} ids for {mat.shape[0]} embeddings")
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        if len(set(ids)) != len(ids):
+            # an id repeated within one call: the last occurrence wins
+            keep = sorted({id_: n for n, id_ in enumerate(ids)}.values())
+            ids = [ids[n] for n in keep]
+            documents = [documents[n] for n in keep]
+            metadatas = [metadatas[n] for n in keep]
+            mat = mat[keep]
+        mat = _normalize_rows(mat)
+        with self._writing():
+            with self._lock:
+                self._reserve_locked(len(ids), mat.shape[1])
+                stale = [self._row_of[i] for i in ids if i in self._row_of]
+                self._append_locked(ids, documents, metadatas, mat)
+                if stale:
+                    self._tombstone_locked(np.asarray(stale, dtype=np.int64))
+                self._commit_locked()
+            self._train_index()
+        self._maybe_compact()
+
+    def delete(self, ids=None, where=None) -> List[str]:
+        """Tombstone the rows matching ids and/or where; returns the deleted ids."""
+        if ids is None and not where:
+            raise ValueError("delete needs ids or a where filter")
+        with self._writing(), self._lock:
+            rows = self._select_locked(ids, where)
+            deleted = [self._ids[r] for r in rows]
+            if len(rows):
+                self._tombstone_locked(rows)
+                self._commit_locked()
+        self._maybe_compact()
+        return deleted
+
+    def _append_locked(self, ids: List[str], documents: list, metadatas: list, mat: np.ndarray) -> None:
+        start = self._size
+        self._vectors[start:start + len(ids)] = mat
+        self._add_rows_locked(ids, documents, metadatas)
+        self._index_rows_locked(start)
+        self._encode_rows_locked(start)
+
+    def _add_rows_locked(self, ids: List[str], documents: list, metadatas: list) -> None:
+        """Book-keeping for rows whose vectors are already in the matrix at _size.."""
+        start = self._size
+        self._live[start:start + len(ids)] = True
+        self._size += len(ids)
+        self._ids.extend(ids)
+        self._docs.extend(documents)
+        self._metas.extend(metadatas)
+        for offset, id_ in enumerate(ids):
+            self._row_of[id_] = start + offset
+        self._meta_index.add(start, metadatas)
+
+    def _tombstone_locked(self, rows: np.ndarray) -> None:
+        rows = rows[self._live[rows]]
+        self._live[rows] = False
+        self._deleted += len(rows)
+        for r in rows.tolist():
+            id_ = self._ids[r]
+            if self._row_of.get(id_) == r:
+                del self._row_of[id_]
+
+    def _commit_locked(self) -> None:
+        """Publish the writes so far to other handles; nothing to do in memory."""
+
+    def _index_rows_locked(self, start: int) -> Optional[np.ndarray]:
+        """Add rows start.. to a trained ANN index; returns their cells (None without an index).
+
+        (Re)training happens afterwards in _train_index, outside _lock.
+        """
+        idx = self._index
+        if idx is None or not idx.trained:
+            return None
+        return idx.add(self._vectors[start:self._size], start)
+
+    def _train_index(self) -> None:
+        """(Re)train the ANN index when due; called inside _writing() but not under _lock.
+
+        k-means runs on the committed rows while queries go on (exact, or
+        against the old index); the new centroids and lists are swapped in
+        under _lock, as compaction swaps its arrays. Writers are held off by
+        _writing(), so no rows arrive in between.
+        """
+        idx = self._index
+        if idx is None:
+            return
+        with self._lock:
+            size, vectors = self._size, self._vectors
+            if not idx.needs_training(size):
+                return
+        centroids = idx.fit(vectors[:size])
+        assignments = idx.assign(vectors[:size], centroids)
+        with self._lock:
+            self._install_index_locked(centroids, size, assignments)
+
+    def _install_index_locked(self, centroids: np.ndarray, trained_rows: int, assignments: np.ndarray) -> None:
+        self._index.install(centroids, trained_rows, assignments)
+
+    def _encode_rows_locked(self, start: int) -> Tuple[bool, Optional[np.ndarray]]:
+        """Encode rows start.. with the codec, training it first when due.
+
+        Returns (trained, codes): every row's codes right after training,
+        otherwise just the new rows' codes.
+        """
+        codec = self._codec
+        if codec is None:
+            return False, None
+        trained = codec.needs_training(self._size)
+        if trained:
+            codec.train(self._vectors[:self._size])
+            start = 0
+        elif not codec.trained:
+            return False, None
+        codes = codec.encode(self._vectors[start:self._size])
+        self._store_codes_locked(start, codes)
+        return trained, codes
+
+    def _store_codes_locked(self, start: int, codes: np.ndarray) -> None:
+        cap = self._vectors.shape[0]
+        if start == 0 or self._codes is None or self._codes.shape[0] < start + len(codes):
+            # a new array, never an in-place rewrite of rows a query may be scoring
+            grown = np.empty((max(cap, start + len(codes)), codes.shape[1]), dtype=codes.dtype)
+            if start:
+                grown[:start] = self._codes[:start]
+            self._codes = grown
+        self._codes[start:start + len(codes)] = codes
+        self._coded = start + len(codes)
+
+    # ---- compaction ----
+    def _maybe_compact(self) -> None:
+        """Start a background compaction once enough of the matrix is tombstoned."""
+        with self._lock:
+            due = (not self._compacting and self._deleted >= self.compact_min_rows
+                   and self._deleted >= self.compact_ratio * self._size)
+            if not due:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name=f"compact-{self.name}", daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Compaction of collection {self.name} failed: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self) -> int:
+        """Rewrite the matrix and indexes with only the live rows; returns the rows reclaimed."""
+        with self._writing():
+            with self._lock:
+                if self._deleted == 0:
+                    return 0
+                reclaimed = self._deleted
+                vectors = self._vectors
+                keep = np.flatnonzero(self._live[:self._size])
+                idx = self._index
+                cells = idx.assignments()[keep] if idx is not None and idx.trained else None
+                codes = self._codes if self._codes is not None and self._coded == self._size else None
+            # no writer can run while _writing() is held, so the lists are stable; queries go on
+            rows = keep.tolist()
+            ids = [self._ids[r] for r in rows]
+            docs = [self._docs[r] for r in rows]
+            metas = [self._metas[r] for r in rows]
+            codes = codes[keep] if codes is not None else None
+            compacted = self._write_compacted(vectors, keep, ids, docs, metas, cells, codes)
+            with self._lock:
+                self._install_compacted_locked(compacted, ids, docs, metas, cells, codes)
+            return reclaimed
+
+    def _write_compacted(self, vectors: np.ndarray, keep: np.ndarray, ids: List[str], documents: list,
+                         metadatas: list, cells: Optional[np.ndarray], codes: Optional[np.ndarray]) -> np.ndarray:
+        """The live rows copied into a new matrix (PersistentCollection also writes its files)."""
+        out = np.empty((max(_MIN_CAPACITY, len(keep)), vectors.shape[1]), dtype=np.float32)
+        _copy_rows(out, vectors, keep)
+        return out
+
+    def _install_compacted_locked(self, vectors: np.ndarray, ids: List[str], documents: list, metadatas: list,
+                                  cells: Optional[np.ndarray], codes: Optional[np.ndarray]) -> None:
+        # new arrays and lists rather than in-place edits: in-flight queries keep their snapshot
+        self._vectors = vectors
+        self._live = np.zeros(vectors.shape[0], dtype=bool)
+        self._live[:len(ids)] = True
+        self._size, self._deleted = len(ids), 0
+        self._ids, self._docs, self._metas = ids, documents, metadatas
+        self._row_of = {id_: r for r, id_ in enumerate(ids)}
+        self._meta_index.reset()
+        self._meta_index.add(0, metadatas)
+        if cells is not None:
+            self._index.load_assignments(cells)
+        self._codes, self._coded = codes, 0 if codes is None else len(codes)
+
+    # ---- reads ----
+    def _select_locked(self, ids=None, where=None) -> np.ndarray:
+        """Sorted live rows matching ids and/or where; every live row when both are None."""
+        if ids is not None:
+            if isinstance(ids, str):
+                ids = [ids]
+            rows = np.asarray(sorted({self._row_of[i] for i in ids if i in self._row_of}), dtype=np.int64)
+            if where:
+                rows = np.intersect1d(rows, self._meta_index.rows(where), assume_unique=True)
+            return rows
+        if where:
+            rows = self._meta_index.rows(where)
+            return rows[self._live[rows]] if len(rows) else rows
+        if self._live is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self._live[:self._size])
+
+    def _search(self, queries: np.ndarray, vectors: np.ndarray, k: int, snapshot,
+                candidates: Optional[np.ndarray] = None, live: Optional[np.ndarray] = None,
+                codes: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, scores) best first for each query.
+
+        Exact unless an index snapshot is given; candidates (sorted rows from a
+        metadata filter) restrict the search to that slice, and live (a row mask,
+        passed only once rows have been tombstoned) leaves out dead rows. With
+        codes, the codec's approximate scores pick rerank * k candidates that
+        are then re-scored against the float32 rows.
+        """
+        if codes is None:
+            return self._scan(queries, vectors, k, snapshot, candidates, live)
+        if not self.rerank:
+            return self._scan(queries, vectors, k, snapshot, candidates, live, codes)
+        results = []
+        for qi, (rows, _) in enumerate(self._scan(queries, vectors, k * self.rerank, snapshot, candidates, live,
+                                                  codes)):
+            rows = np.sort(rows)  # sequential reads from the (possibly memory-mapped) matrix
+            exact = vectors[rows] @ queries[qi]
+            best = top_k(exact[None, :], k)[0]
+            results.append((rows[best], exact[best]))
+        return results
+
+    def _scan(self, queries: np.ndarray, vectors: np.ndarray, k: int, snapshot, candidates: Optional[np.ndarray],
+              live: Optional[np.ndarray], codes: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if codes is None:
+            def score(q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+                return q @ (vectors if rows is None else vectors[rows]).T
+            scorer = None
+        else:
+            codec = self._codec
+
+            def score(q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+                return codec.score(q, codes if rows is None else codes[rows])
+
+            def scorer(q: np.ndarray, rows: np.ndarray) -> np.ndarray:
+                return codec.score(q[None, :], codes[rows])[0]
+        if live is not None:
+            if candidates is not None:
+                candidates = candidates[live[candidates]]
+            elif snapshot is not None:
+                return IVFIndex.search(snapshot, vectors, queries, k, self._index.nprobe, live, scorer)
+        if candidates is not None:
+            nprobe_share = self._index.nprobe / max(1, len(snapshot[1])) if snapshot is not None else 1.0
+            if len(candidates) <= len(vectors) * nprobe_share:
+                # the filtered slice is smaller than an index scan: score it exactly
+                scores = score(queries, candidates)
+                rows = top_k(scores, k)
+                return [(candidates[r], scores[qi, r]) for qi, r in enumerate(rows)]
+            allowed = np.zeros(len(vectors), dtype=bool)
+            allowed[candidates] = True
+            return IVFIndex.search(snapshot, vectors, queries, k, self._index.nprobe, allowed, scorer)
+        if snapshot is not None:
+            return IVFIndex.search(snapshot, vectors, queries, k, self._index.nprobe, scorer=scorer)
+        scores = score(queries)
+        if live is None:
+            rows = top_k(scores, k)
+            return [(r, scores[qi, r]) for qi, r in enumerate(rows)]
+        scores[:, ~live] = -np.inf
+        results = []
+        for qi, r in enumerate(top_k(scores, k)):
+            s = scores[qi, r]
+            found = np.isfinite(s)
+            results.append((r[found], s[found]))
+        return results
+
+    def query(self, query_embeddings=None, n_results: int = 5, where=None, include=None):
+        include = include or ["documents", "metadatas", "distances"]
+        if query_embeddings is None or len(query_embeddings) == 0:
+            return {k: [[]] for k in ["ids", *include]}
+        queries = _normalize_rows(_as_matrix(query_embeddings))
+        with self._lock:
+            # rows past _size are never written in place and compaction swaps in new
+            # arrays instead of rewriting these, so the views stay valid
+            size = self._size
+            vectors = self._vectors[:size] if self._vectors is not None else None
+            live = self._live[:size] if self._deleted else None
+            codes = self._codes[:size] if self._codes is not None and self._coded == size else None
+            ids, docs, metas = self._ids, self._docs, self._metas
+            snapshot = self._index.snapshot() if self._index is not None and self._index.trained else None
+            candidates = self._meta_index.rows(where) if where else None
+        out: Dict[str, List[list]] = {k: [] for k in ["ids", *include]}
+        if vectors is None or size == 0:
+            for k in out:
+                out[k] = [[] for _ in range(len(queries))]
+            return out
+        if queries.shape[1] != vectors.shape[1]:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match collection dimensionality "
+                             f"{vectors.shape[1]}")
+        for row_idx, scores in self._search(queries, vectors, n_results, snapshot, candidates, live, codes):
+            out["ids"].append([ids[r] for r in row_idx])
+            if "documents" in out:
+                out["documents"].append([docs[r] for r in row_idx])
+            if "metadatas" in out:
+                out["metadatas"].append([metas[r] for r in row_idx])
+            if "distances" in out:
+                out["distances"].append((1.0 - scores).tolist())
+            if "embeddings" in out:
+                out["embeddings"].append(vectors[row_idx].tolist())
+        return out
+
+    def get(self, ids=None, where=None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include=None):
+        """Live rows by id and/or filter, in row order, like chromadb's Collection.get."""
+        include = ["metadatas", "documents"] if include is None else include
+        with self._lock:
+            rows = self._select_locked(ids, where)[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            out: Dict[str, Any] = {"ids": [self._ids[r] for r in rows]}
+            if "documents" in include:
+                out["documents"] = [self._docs[r] for r in rows]
+            if "metadatas" in include:
+                out["metadatas"] = [self._metas[r] for r in rows]
+            if "embeddings" in include:
+                out["embeddings"] = self._vectors[rows].tolist() if len(rows) else []
+        return out
+
+    def count(self) -> int:
+        return self._size - self._deleted
+
+    def index_stats(self) -> dict:
+        return {
+            "ann": self._index.stats() if self._index is not None else None,
+            "metadata": self._meta_index.stats(),
+            "codec": self._codec_stats(),
+            "rows": self._size,
+            "tombstones": self._deleted,
+        }
+
+    def _codec_stats(self) -> Optional[dict]:
+        if self._codec is None:
+            return None
+        codes = self._codes
+        per_vector = None if codes is None else int(codes.shape[1] * codes.itemsize)
+        return dict(self._codec.stats(), rerank=self.rerank, bytes_per_vector=per_vector,
+                    float32_bytes_per_vector=None if self.dim is None else 4 * self.dim,
+                    code_bytes=0 if per_vector is None else per_vector * self._coded)
+
+    def clear(self) -> int:
+        """Drop every row; returns how many live rows there were."""
+        with self._writing(), self._lock:
+            before = self._size - self._deleted
+            self._reset_locked()
+            return before
+
+
+_FILES = {
+    "vectors": "vectors.{}.f32",
+    "records": "records.{}.jsonl",
+    "tombstones": "tombstones.{}.i64",
+    "assign": "ivf_assign.{}.i32",
+    "codes": "codes.{}.bin",
+}
+
+
+class PersistentCollection(MemoryCollection):
+    def __init__(self, name: str, path: str, index: Optional[IVFIndex] = None, compact_ratio: float = 0.25,
+                 compact_min_rows: int = 1000, codec: Optional[Codec] = None, rerank: int = 10):
+        super().__init__(name, index, compact_ratio, compact_min_rows, codec, rerank)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._manifest_path = os.path.join(path, "manifest.json")
+        self._lock_path = os.path.join(path, ".lock")
+        self._ivf_path = os.path.join(path, "ivf.npz")
+        self._ivf_stamp = None
+        self._codec_path = os.path.join(path, "codec.npz")
+        self._codec_stamp = None
+        self._generation = 0
+        self._rec_offset = 0
+        self._manifest_stamp = None
+        with self._lock:
+            self._refresh_locked()
+
+    # ---- on-disk state ----
+    def _file(self, kind: str, generation: Optional[int] = None) -> str:
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.path, _FILES[kind].format(generation))
+
+    @contextmanager
+    def _file_lock(self):
+        """Serialize writers across processes sharing the directory."""
+        with open(self._lock_path, "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        with self._write_lock, self._file_lock():
+            with self._lock:
+                self._refresh_locked()
+            yield
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"dim": None, "count": 0, "deleted": 0, "generation": 0}
+
+    def _write_manifest_locked(self) -> None:
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": self._size, "deleted": self._deleted,
+                       "generation": self._generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._manifest_path)
+        st = os.stat(self._manifest_path)
+        self._manifest_stamp = (st.st_ino, st.st_mtime_ns)
+
+    def _remove_generation(self, generation: int) -> None:
+        for kind in _FILES:
+            path = self._file(kind, generation)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _map_locked(self, dim: int, min_rows: int) -> None:
+        """(Re)map the current generation's vector file with room for at least min_rows rows."""
+        path = self._file("vectors")
+        row_bytes = dim * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        capacity = size // row_bytes
+        if capacity < min_rows:
+            capacity = max(min_rows, capacity * 2, _MIN_CAPACITY)
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        self._grow_live_locked()
+
+    def _refresh_locked(self) -> None:
+        """Pick up rows and tombstones committed by this or another process since the last look."""
+        try:
+            st = os.stat(self._manifest_path)
+            # the manifest is replaced, never rewritten in place, so the inode changes on every commit
+            stamp = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            stamp = None
+        if stamp == self._manifest_stamp and stamp is not None:
+            return
+        manifest = self._read_manifest()
+        self._manifest_stamp = stamp
+        if manifest.get("generation", 0) != self._generation or manifest.get("count", 0) < self._size:
+            # cleared or compacted elsewhere: start over from the new generation's files
+            self._generation = manifest.get("generation", 0)
+            self._reset_locked()
+            self._rec_offset = 0
+            self._ivf_stamp = self._codec_stamp = None
+        count, dim = int(manifest.get("count", 0)), manifest.get("dim")
+        if count > self._size:
+            if self._vectors is None or self._vectors.shape[0] < count:
+                self._map_locked(int(dim), count)
+            ids, docs, metas = [], [], []
+            with open(self._file("records"), "rb") as f:
+                f.seek(self._rec_offset)
+                while self._size + len(ids) < count:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        raise RuntimeError(f"{self._file('records')} is shorter than its manifest")
+                    rec = json.loads(line)
+                    ids.append(rec["id"])
+                    docs.append(rec.get("document"))
+                    metas.append(rec.get("metadata"))
+                self._rec_offset = f.tell()
+            self._add_rows_locked(ids, docs, metas)
+            self._sync_index_locked()
+            self._sync_codes_locked()
+        deleted = int(manifest.get("deleted", 0))
+        if deleted > self._deleted:
+            rows = np.fromfile(self._file("tombstones"), dtype=np.int64, count=deleted - self._deleted,
+                               offset=self._deleted * 8)
+            MemoryCollection._tombstone_locked(self, rows)
+
+    def _sync_index_locked(self) -> None:
+        """Bring the ANN index up to the committed rows, reusing persisted assignments."""
+        idx = self._index
+        if idx is None:
+            return
+        try:
+            st = os.stat(self._ivf_path)
+        except OSError:
+            if idx.trained:
+                idx.reset()
+            self._ivf_stamp = None
+            return
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp != self._ivf_stamp:
+            idx.load_centroids(self._ivf_path)
+            idx.load_assignments(self._read_assignments(0, self._size, idx))
+            self._ivf_stamp = stamp
+        elif idx._size < self._size:
+            start = idx._size
+            idx.add(self._vectors[start:self._size], start, self._read_assignments(start, self._size, idx))
+
+    def _read_assignments(self, start: int, end: int, idx: IVFIndex) -> np.ndarray:
+        """Persisted cells of rows start..end; rows missing from the file are assigned now."""
+        path = self._file("assign")
+        assign = np.zeros(0, dtype=np.int32)
+        if os.path.exists(path):
+            assign = np.fromfile(path, dtype=np.int32, count=end - start, offset=start * 4)
+        nlist = idx.centroids.shape[0]
+        if len(assign) and int(assign.max()) >= nlist:
+            # assignments from an interrupted retrain: recompute
+            assign = assign[:0]
+        if len(assign) < end - start:
+            missing = idx.assign(self._vectors[start + len(assign):end])
+            assign = np.concatenate([assign, missing])
+        return assign
+
+    def _index_rows_locked(self, start: int) -> Optional[np.ndarray]:
+        assign = super()._index_rows_locked(start)
+        if assign is not None:
+            with open(self._file("assign"), "ab") as f:
+                f.truncate(start * 4)
+                f.write(assign.astype(np.int32).tobytes())
+        return assign
+
+    def _install_index_locked(self, centroids: np.ndarray, trained_rows: int, assignments: np.ndarray) -> None:
+        super()._install_index_locked(centroids, trained_rows, assignments)
+        path = self._file("assign")
+        tmp = path + ".tmp"
+        assignments.astype(np.int32).tofile(tmp)
+        os.replace(tmp, path)
+        self._index.save(self._ivf_path)
+        st = os.stat(self._ivf_path)
+        self._ivf_stamp = (st.st_ino, st.st_mtime_ns)
+
+    def _sync_codes_locked(self) -> None:
+        """Bring the codes up to the committed rows, loading codebooks trained by another process."""
+        codec = self._codec
+        if codec is None:
+            return
+        start = self._coded
+        try:
+            st = os.stat(self._codec_path)
+            stamp = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            stamp = None
+        if stamp is not None and stamp != self._codec_stamp:
+            codec.load(self._codec_path)
+            self._codec_stamp = stamp
+            start = 0
+        if not codec.trained or start >= self._size:
+            return
+        width = codec.code_width(self.dim)
+        codes = np.zeros((0, width), dtype=codec.dtype)
+        path = self._file("codes")
+        if os.path.exists(path):
+            itemsize = np.dtype(codec.dtype).itemsize
+            flat = np.fromfile(path, dtype=codec.dtype, count=(self._size - start) * width,
+                               offset=start * width * itemsize)
+            codes = flat[:len(flat) // width * width].reshape(-1, width)
+        if start + len(codes) < self._size:
+            missing = codec.encode(self._vectors[start + len(codes):self._size])
+            codes = np.concatenate([codes, missing])
+        self._store_codes_locked(start, codes)
+
+    def _encode_rows_locked(self, start: int) -> Tuple[bool, Optional[np.ndarray]]:
+        trained, codes = super()._encode_rows_locked(start)
+        if codes is None:
+            return trained, codes
+        path = self._file("codes")
+        if trained:
+            tmp = path + ".tmp"
+            codes.tofile(tmp)
+            os.replace(tmp, path)
+            self._codec.save(self._codec_path)
+            if os.path.exists(self._codec_path):
+                st = os.stat(self._codec_path)
+                self._codec_stamp = (st.st_ino, st.st_mtime_ns)
+        else:
+            with open(path, "ab") as f:
+                f.truncate(start * codes.shape[1] * codes.itemsize)
+                f.write(codes.tobytes())
+        return trained, codes
+
+    # ---- MemoryCollection hooks, called inside _writing() ----
+    def _reserve_locked(self, extra: int, dim: int) -> None:
+        if self._vectors is not None and dim != self._vectors.shape[1]:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimensionality "
+                             f"{self._vectors.shape[1]}")
+        if self._vectors is None or self._size + extra > self._vectors.shape[0]:
+            self._map_locked(dim, self._size + extra)
+
+    def _append_locked(self, ids: List[str], documents: list, metadatas: list, mat: np.ndarray) -> None:
+        start = self._size
+        self._vectors[start:start + len(ids)] = mat
+        self._vectors.flush()
+        lines = "".join(json.dumps({"id": i, "document": d, "metadata": m}) + "\n"
+                        for i, d, m in zip(ids, documents, metadatas))
+        with open(self._file("records"), "ab") as f:
+            # drop any tail a crashed writer appended without committing
+            f.truncate(self._rec_offset)
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            self._rec_offset = f.tell()
+        self._add_rows_locked(ids, documents, metadatas)
+        self._index_rows_locked(start)
+        self._encode_rows_locked(start)
+
+    def _tombstone_locked(self, rows: np.ndarray) -> None:
+        rows = rows[self._live[rows]]
+        with open(self._file("tombstones"), "ab") as f:
+            f.truncate(self._deleted * 8)
+            f.write(rows.astype(np.int64).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        super()._tombstone_locked(rows)
+
+    def _commit_locked(self) -> None:
+        self._write_manifest_locked()
+
+    def _write_compacted(self, vectors: np.ndarray, keep: np.ndarray, ids: List[str], documents: list,
+                         metadatas: list, cells: Optional[np.ndarray], codes: Optional[np.ndarray]) -> np.ndarray:
+        generation = self._generation + 1
+        # leftovers of a compaction that died before switching the manifest
+        self._remove_generation(generation)
+        out = np.memmap(self._file("vectors", generation), dtype=np.float32, mode="w+",
+                        shape=(max(_MIN_CAPACITY, len(keep)), vectors.shape[1]))
+        _copy_rows(out, vectors, keep)
+        out.flush()
+        with open(self._file("records", generation), "wb") as f:
+            for i, d, m in zip(ids, documents, metadatas):
+                f.write((json.dumps({"id": i, "document": d, "metadata": m}) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        if cells is not None:
+            cells.astype(np.int32).tofile(self._file("assign", generation))
+        if codes is not None:
+            codes.tofile(self._file("codes", generation))
+        return out
+
+    def _install_compacted_locked(self, vectors: np.ndarray, ids: List[str], documents: list, metadatas: list,
+                                  cells: Optional[np.ndarray], codes: Optional[np.ndarray]) -> None:
+        old = self._generation
+        super()._install_compacted_locked(vectors, ids, documents, metadatas, cells, codes)
+        self._generation = old + 1
+        self._rec_offset = os.path.getsize(self._file("records"))
+        self._write_manifest_locked()
+        self._remove_generation(old)
+
+    def query(self, query_embeddings=None, n_results: int = 5, where=None, include=None):
+        with self._lock:
+            self._refresh_locked()
+        return super().query(query_embeddings=query_embeddings, n_results=n_results, where=where, include=include)
+
+    def get(self, ids=None, where=None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include=None):
+        with self._lock:
+            self._refresh_locked()
+        return super().get(ids=ids, where=where, limit=limit, offset=offset, include=include)
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh_locked()
+            return self._size - self._deleted
+
+    def clear(self) -> int:
+        with self._writing(), self._lock:
+            before = self._size - self._deleted
+            old = self._generation
+            self._reset_locked()
+            self._rec_offset = 0
+            self._ivf_stamp = self._codec_stamp = None
+            self._generation = old + 1
+            self._write_manifest_locked()
+            self._remove_generation(old)
+            for path in (self._ivf_path, self._codec_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return before
@@ -30,8 +30,32 @@ def fetch_wikipedia_summary(query: str) -> Tuple[List[str], List[str]]:
     return [], []
 
 
+async def afetch_wikipedia_summary(query: str) -> Tuple[List[str], List[str]]:
+    """Async fetch_wikipedia_summary over the shared pooled HTTP client."""
+    from .llm_provider import get_async_http_client
+
+    topic = _slugify(query.split("?")[0])[:120]
+    url = WIKI_SUMMARY.format(topic)
+    try:
+        r = await get_async_http_client().get(url, timeout=5)
+        if r.status_code == 200:
+            data = r.json()
+            extract = data.get("extract") or ""
+            page_url = data.get("content_urls",{}).get("desktop",{}).get("page", f"https://en.wikipedia.org/wiki/{topic}")
+            if extract:
+                return [extract], [page_url]
+    except Exception:
+        pass
+    return [], []
+
+
 def search_and_fetch(query: str, max_docs: int = 2) -> Tuple[List[str], List[str]]:
     """Attempts to fetch a couple of public web summaries related to the query.
     Currently uses Wikipedia summary as a safe fallback. Returns (docs, sources)."""
     docs, srcs = fetch_wikipedia_summary(query)
     return docs[:max_docs], srcs[:max_docs]
+
+
+async def asearch_and_fetch(query: str, max_docs: int = 2) -> Tuple[List[str], List[str]]:
+    docs, srcs = await afetch_wikipedia_summary(query)
+    return docs[:max_docs], srcs[:max_docs]
@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.ann_index import IVFIndex  # type: ignore
+from app.vector_store import MemoryCollection  # type: ignore
+from bench_common import synthetic, timed_queries  # type: ignore
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall@k vs latency of the IVF index against exact search")
+    ap.add_argument("--n", type=int, default=200000, help="Number of vectors")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--clusters", type=int, default=256, help="Clusters in the synthetic data")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--nlist", type=int, default=0, help="0 = 4 * sqrt(n)")
+    ap.add_argument("--nprobe", default="1,4,8,16,32,64")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    vectors = synthetic(args.n, args.dim, args.clusters, args.seed)
+    ids = [f"c{i}" for i in range(args.n)]
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(args.n, size=args.queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    exact = MemoryCollection("exact")
+    exact.upsert(ids=ids, embeddings=vectors)
+    truth, exact_ms = timed_queries(exact, queries, args.k)
+
+    index = IVFIndex(nlist=args.nlist, min_rows=1)
+    ann = MemoryCollection("ivf", index=index)
+    start = time.perf_counter()
+    ann.upsert(ids=ids, embeddings=vectors)
+    print(f"IVF build: nlist={index.stats()['nlist']} in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'search':<14}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>10}")
+    print(f"{'exact':<14}{1.0:>10.3f}{np.median(exact_ms):>10.2f}{np.percentile(exact_ms, 95):>10.2f}{1.0:>10.1f}")
+    for nprobe in (int(p) for p in args.nprobe.split(",")):
+        index.nprobe = nprobe
+        got, ms = timed_queries(ann, queries, args.k)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(truth, got)])
+        speedup = np.median(exact_ms) / np.median(ms)
+        print(f"{'ivf/' + str(nprobe):<14}{recall:>10.3f}{np.median(ms):>10.2f}{np.percentile(ms, 95):>10.2f}"
+              f"{speedup:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.vector_codecs import make_codec  # type: ignore
+from app.vector_store import MemoryCollection  # type: ignore
+from bench_common import synthetic, timed_queries  # type: ignore
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Memory per vector and recall@k of the vector codecs")
+    ap.add_argument("--n", type=int, default=100000, help="Number of vectors")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--clusters", type=int, default=256, help="Clusters in the synthetic data")
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--pq-m", type=int, default=0, help="PQ sub-vectors per row (0 = dim / 8)")
+    ap.add_argument("--rerank", default="0,4,10", help="Re-rank multiples of k to try")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    vectors = synthetic(args.n, args.dim, args.clusters, args.seed)
+    ids = [f"c{i}" for i in range(args.n)]
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(args.n, size=args.queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    exact = MemoryCollection("exact")
+    exact.upsert(ids=ids, embeddings=vectors)
+    truth, exact_ms = timed_queries(exact, queries, args.k)
+
+    print(f"{'codec':<14}{'bytes/vec':>10}{'vs f32':>8}{'recall@' + str(args.k):>10}{'p50 ms':>10}")
+    print(f"{'f32':<14}{4 * args.dim:>10}{1.0:>8.1f}{1.0:>10.3f}{np.median(exact_ms):>10.2f}")
+    for name in ("f16", "pq"):
+        coll = MemoryCollection(name, codec=make_codec(name, pq_m=args.pq_m, min_rows=1))
+        start = time.perf_counter()
+        coll.upsert(ids=ids, embeddings=vectors)
+        build_s = time.perf_counter() - start
+        per_vector = coll.index_stats()["codec"]["bytes_per_vector"]
+        for rerank in (int(r) for r in args.rerank.split(",")):
+            coll.rerank = rerank
+            got, ms = timed_queries(coll, queries, args.k)
+            recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(truth, got)])
+            label = f"{name}/rerank={rerank}"
+            print(f"{label:<14}{per_vector:>10}{4 * args.dim / per_vector:>8.1f}{recall:>10.3f}"
+                  f"{np.median(ms):>10.2f}")
+        print(f"  ({name} encode: {build_s:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
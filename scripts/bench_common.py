@@ -0,0 +1,23 @@
+"""Helpers shared by the vector store benchmarks (bench_ann.py, bench_codecs.py)."""
+import time
+
+import numpy as np
+
+
+def synthetic(n, dim, clusters, seed):
+    """n clustered float32 vectors, so nearest neighbours are meaningful."""
+    rng = np.random.default_rng(seed)
+    means = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return means[labels] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def timed_queries(coll, queries, k):
+    """Top-k ids per query and the latency of each query in milliseconds."""
+    ids, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        res = coll.query(query_embeddings=[q.tolist()], n_results=k, include=["distances"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append(res["ids"][0])
+    return ids, np.asarray(latencies)
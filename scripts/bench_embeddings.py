@@ -0,0 +1,92 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.onnx_embedder import OnnxEmbedder  # type: ignore
+
+try:
+    from sentence_transformers import SentenceTransformer  # type: ignore
+except Exception:
+    raise SystemExit("sentence-transformers is required. Install with `pip install -r requirements-ml.txt`.")
+
+
+_SAMPLE = [
+    "Revenue grew 12% year over year driven by subscription sales.",
+    "Operating expenses increased due to higher marketing spend in Q3.",
+    "The company repurchased $2.1 billion of common stock during the quarter.",
+    "An emergency fund should cover three to six months of living expenses.",
+    "Form 10-K includes audited financial statements and risk factors.",
+    "Net interest margin compressed as deposit costs rose.",
+    "Free cash flow was negative because of elevated capital expenditures.",
+    "Diversification reduces unsystematic risk in an investment portfolio.",
+]
+
+
+def load_corpus(path: str, limit: int):
+    if not path:
+        return [f"{s} (variant {i})" for i in range(limit // len(_SAMPLE) + 1) for s in _SAMPLE][:limit]
+    texts = []
+    for fp in sorted(glob.glob(os.path.join(path, "**", "*.txt"), recursive=True)):
+        with open(fp, encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        texts.extend(text[i:i + 800] for i in range(0, len(text), 700))
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def throughput(encode, texts, batch_size):
+    encode(texts[:batch_size])  # warm up
+    start = time.perf_counter()
+    vectors = np.asarray(encode(texts), dtype=np.float32)
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+
+def topk(vectors, queries, k):
+    v = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    q = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+    return np.argsort(-(q @ v.T), axis=1)[:, :k]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare PyTorch and ONNX Runtime (fp32/int8) embedding backends")
+    ap.add_argument("--model", default=os.getenv("LOCAL_EMBED_MODEL", "all-MiniLM-L6-v2"))
+    ap.add_argument("--corpus", default="", help="Directory of .txt files (default: synthetic financial sentences)")
+    ap.add_argument("--n", type=int, default=2000, help="Number of chunks to embed")
+    ap.add_argument("--queries", type=int, default=100, help="Number of corpus chunks reused as queries")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--onnx-dir", default=None)
+    args = ap.parse_args()
+
+    texts = load_corpus(args.corpus, args.n)
+    rng = np.random.default_rng(0)
+    qidx = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+
+    torch_model = SentenceTransformer(args.model)
+    base, base_tps = throughput(lambda t: torch_model.encode(t, batch_size=args.batch_size), texts, args.batch_size)
+    base_top = topk(base, base[qidx], args.k)
+    print(f"{'backend':<12}{'texts/s':>10}{'speedup':>10}{'recall@' + str(args.k):>12}{'cosine':>10}")
+    print(f"{'torch':<12}{base_tps:>10.1f}{1.0:>10.2f}{1.0:>12.3f}{1.0:>10.4f}")
+
+    for quantize in (False, True):
+        model = OnnxEmbedder(args.model, onnx_dir=args.onnx_dir, quantize=quantize)
+        vecs, tps = throughput(lambda t: model.encode(t, batch_size=args.batch_size), texts, args.batch_size)
+        # recall: how many of the torch top-k neighbours the ONNX vectors also return
+        top = topk(vecs, vecs[qidx], args.k)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(base_top, top)])
+        a = base / np.linalg.norm(base, axis=1, keepdims=True)
+        b = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+        cosine = float(np.mean(np.sum(a * b, axis=1)))
+        name = "onnx-int8" if quantize else "onnx-fp32"
+        print(f"{name:<12}{tps:>10.1f}{tps / base_tps:>10.2f}{recall:>12.3f}{cosine:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
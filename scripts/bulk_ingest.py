@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dotenv import load_dotenv
+
+from app.ingest_pipeline import collect_paths, ingest_documents  # type: ignore
+from app.sharding import ingest_collection  # type: ignore
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingest a directory, files or zip/tar archives through the ingest pipeline")
+    ap.add_argument("paths", nargs="+", help="Directories (walked recursively), files or archives")
+    ap.add_argument("--user", default="anonymous", help="Uploader recorded on every chunk (selects the user shard)")
+    ap.add_argument("--shared", action="store_true", help="Ingest into the shared shard (SHARED_SHARD)")
+    ap.add_argument("--collection", default=None, help="Target collection (overrides --user/--shared routing)")
+    ap.add_argument("--batch-size", type=int, default=None, help="Chunks per embedding batch (INGEST_BATCH_CHUNKS)")
+    ap.add_argument("--extract-workers", type=int, default=None)
+    ap.add_argument("--embed-workers", type=int, default=None)
+    ap.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = ap.parse_args()
+    load_dotenv()
+
+    collection = args.collection or ingest_collection(args.user, args.shared)
+
+    def report(result):
+        if args.quiet:
+            return
+        if "error" in result:
+            print(f"FAILED     {result['filename']}: {result['error']}")
+        elif "skipped" in result:
+            print(f"skipped    {result['filename']}: {result['skipped']}")
+        elif result["unchanged"]:
+            print(f"unchanged  {result['filename']}")
+        else:
+            print(f"{result['embedded']:>4}/{result['chunks']:<5} {result['filename']}")
+
+    scratch = tempfile.mkdtemp(prefix="bulk-ingest-")
+    try:
+        items = collect_paths(args.paths, scratch)
+        summary = ingest_documents(items, user=args.user, collection_name=collection, batch_size=args.batch_size,
+                                   extract_workers=args.extract_workers, embed_workers=args.embed_workers,
+                                   on_document=report)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    summary.pop("files")
+    print(json.dumps(dict(summary, collection=collection), indent=2))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.chroma_client as chroma_client
+
+
+class _FakeCollection:
+    def __init__(self, name, server):
+        self.name = name
+        self.server = server
+        self.generation = server.generation
+
+    def count(self):
+        if self.generation != self.server.generation:
+            raise ValueError("Collection does not exist")
+        return 3
+
+    def query(self, where=None):
+        self.server.queries += 1
+        if where == "refused":
+            raise ConnectionError("connection refused")
+        raise ValueError(f"Invalid where clause: {where}")
+
+
+class _FakeServer:
+    def __init__(self):
+        self.clients = 0
+        self.opens = 0
+        self.generation = 0
+        self.queries = 0
+
+
+def _fake_chromadb(server):
+    def HttpClient(host, port):
+        server.clients += 1
+        client = types.SimpleNamespace()
+
+        def get_or_create_collection(name):
+            server.opens += 1
+            return _FakeCollection(name, server)
+
+        def delete_collection(name):
+            server.generation += 1
+
+        client.get_or_create_collection = get_or_create_collection
+        client.delete_collection = delete_collection
+        client.heartbeat = lambda: 1
+        return client
+
+    return types.SimpleNamespace(HttpClient=HttpClient)
+
+
+def test_client_and_collection_are_cached_and_revalidated(monkeypatch):
+    server = _FakeServer()
+    monkeypatch.setitem(sys.modules, "chromadb", _fake_chromadb(server))
+    monkeypatch.setenv("CHROMA_HOST", "chroma.test")
+    monkeypatch.setattr(chroma_client, "_CLIENTS", {})
+    monkeypatch.setattr(chroma_client, "_COLLECTIONS", {})
+
+    for _ in range(3):
+        assert chroma_client.get_chroma_collection("docs").count() == 3
+    assert (server.clients, server.opens) == (1, 1)
+
+    # another process recreated the collection: the stale handle reopens once and succeeds
+    server.generation += 1
+    assert chroma_client.get_chroma_collection("docs").count() == 3
+    assert (server.clients, server.opens) == (1, 2)
+
+    # reset drops the cached handle for the deleted collection
+    assert chroma_client.reset_chroma_collection("docs") == 3
+    assert chroma_client.get_chroma_collection("docs").count() == 3
+    assert server.clients == 1
+
+
+def test_only_connection_and_stale_collection_errors_are_retried(monkeypatch):
+    import pytest
+
+    server = _FakeServer()
+    monkeypatch.setitem(sys.modules, "chromadb", _fake_chromadb(server))
+    monkeypatch.setenv("CHROMA_HOST", "chroma.test")
+    monkeypatch.setattr(chroma_client, "_CLIENTS", {})
+    monkeypatch.setattr(chroma_client, "_COLLECTIONS", {})
+    coll = chroma_client.get_chroma_collection("docs")
+
+    with pytest.raises(ValueError):
+        coll.query(where={"$bad": 1})
+    assert (server.queries, server.opens) == (1, 1)
+    with pytest.raises(ConnectionError):
+        coll.query(where="refused")
+    assert (server.queries, server.opens) == (3, 2)
@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.ann_index import IVFIndex
+from app.vector_store import MemoryCollection, PersistentCollection
+
+
+def _fill(coll, vectors, prefix="c", source="a.pdf"):
+    n = len(vectors)
+    coll.upsert(ids=[f"{prefix}{i}" for i in range(n)], documents=[f"{prefix} {i}" for i in range(n)],
+                metadatas=[{"source": source, "i": i} for i in range(n)], embeddings=vectors)
+
+
+def test_upsert_replaces_rows_by_id():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(20, 8)).astype(np.float32)
+    coll = MemoryCollection("u")
+    _fill(coll, vectors)
+    _fill(coll, vectors)
+    assert coll.count() == 20
+
+    coll.upsert(ids=["c3"], documents=["new"], metadatas=[{"source": "b.pdf"}], embeddings=[-vectors[3]])
+    assert coll.count() == 20
+    res = coll.query(query_embeddings=[vectors[3].tolist()], n_results=20)
+    assert res["ids"][0].count("c3") == 1 and res["ids"][0][-1] == "c3"
+    assert coll.get(ids=["c3"])["documents"] == ["new"]
+    assert coll.get(where={"source": "a.pdf"}, include=[])["ids"] == [f"c{i}" for i in range(20) if i != 3]
+
+
+def test_delete_by_ids_and_where():
+    rng = np.random.default_rng(1)
+    coll = MemoryCollection("d")
+    _fill(coll, rng.normal(size=(10, 8)).astype(np.float32), "a", "a.pdf")
+    _fill(coll, rng.normal(size=(10, 8)).astype(np.float32), "b", "b.pdf")
+
+    assert coll.delete(where={"source": "a.pdf"}) == [f"a{i}" for i in range(10)]
+    assert coll.delete(ids=["b0", "b1", "missing"]) == ["b0", "b1"]
+    assert coll.delete(ids=["b2", "b3"], where={"i": 3}) == ["b3"]
+    assert coll.count() == 7
+    ids = coll.query(query_embeddings=[[1.0] * 8], n_results=20)["ids"][0]
+    assert sorted(ids) == sorted(f"b{i}" for i in (2, 4, 5, 6, 7, 8, 9))
+    assert coll.query(query_embeddings=[[1.0] * 8], n_results=20, where={"source": "a.pdf"})["ids"] == [[]]
+
+
+def test_compaction_reclaims_tombstones_and_keeps_results():
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(3000, 16)).astype(np.float32)
+    coll = MemoryCollection("c", index=IVFIndex(nlist=16, nprobe=16, min_rows=1000), compact_min_rows=10 ** 9)
+    _fill(coll, vectors)
+    coll.delete(ids=[f"c{i}" for i in range(0, 3000, 2)])
+    q = vectors[1].tolist()
+    before = coll.query(query_embeddings=[q], n_results=10)
+
+    assert coll.compact() == 1500
+    stats = coll.index_stats()
+    assert stats["rows"] == 1500 and stats["tombstones"] == 0 and stats["ann"]["indexed_rows"] == 1500
+    assert coll.query(query_embeddings=[q], n_results=10) == before
+    assert coll.get(where={"i": 7})["ids"] == ["c7"]
+
+
+def test_background_compaction_is_triggered():
+    rng = np.random.default_rng(3)
+    coll = MemoryCollection("b", compact_ratio=0.5, compact_min_rows=10)
+    _fill(coll, rng.normal(size=(40, 8)).astype(np.float32))
+    coll.delete(where={"i": {"$lt": 30}})
+    for t in [t for t in threading.enumerate() if t.name == "compact-b"]:
+        t.join(5)
+    assert coll.index_stats()["rows"] == 10 and coll.count() == 10
+
+
+def test_persistent_deletes_and_compaction_survive_reopen(tmp_path):
+    rng = np.random.default_rng(4)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    coll = PersistentCollection("p", str(tmp_path), compact_min_rows=10 ** 9)
+    _fill(coll, vectors)
+    coll.upsert(ids=["c0"], documents=["again"], metadatas=[{"source": "a.pdf"}], embeddings=[vectors[0]])
+    coll.delete(ids=[f"c{i}" for i in range(1, 21)])
+
+    other = PersistentCollection("p", str(tmp_path))
+    assert other.count() == 30
+    assert other.get(ids=["c0"])["documents"] == ["again"]
+
+    assert coll.compact() == 21
+    assert sorted(os.listdir(tmp_path)) == [".lock", "manifest.json", "records.1.jsonl", "vectors.1.f32"]
+    # the other handle notices the new generation and reloads it
+    assert other.count() == 30
+    res = other.query(query_embeddings=[vectors[30].tolist()], n_results=1)
+    assert res["ids"] == [["c30"]]
+    assert PersistentCollection("p", str(tmp_path)).get(ids=["c0", "c5"])["ids"] == ["c0"]
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.embed_pool as embed_pool
+from app.embed_pool import EmbeddingWorkerPool, shard_bounds
+
+
+class _StubModel:
+    """Stands in for the sentence-transformers model: a deterministic vector per text."""
+
+    def encode(self, texts):
+        return [[len(t), sum(map(ord, t)) % 997, t.count("a")] for t in texts]
+
+
+def _stub_worker(model_name, threads, backend):
+    # runs in each spawned worker instead of loading a real model
+    embed_pool._WORKER_MODEL = _StubModel()
+
+
+def test_pool_shards_cover_input_in_order():
+    bounds = shard_bounds(1000, workers=4, max_shard=128)
+    assert bounds[0] == (0, 128) and bounds[-1][1] == 1000
+    assert all(a[1] == b[0] for a, b in zip(bounds, bounds[1:]))
+    assert shard_bounds(10, workers=4, max_shard=128) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+
+
+def test_pooled_encode_matches_serial_order(monkeypatch):
+    monkeypatch.setattr(embed_pool, "_init_worker", _stub_worker)
+    texts = [f"chunk {i} " + "a" * (i % 11) for i in range(50)]
+    pool = EmbeddingWorkerPool("stub", workers=2, shard_size=7)
+    try:
+        pooled = pool.encode(texts)
+    finally:
+        pool.close()
+    serial = np.asarray(_StubModel().encode(texts), dtype=np.float32)
+    assert pooled.shape == (50, 3) and np.array_equal(pooled, serial)
+    assert pool.stats()["shards"] == 8
@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.embed_scheduler import EmbeddingScheduler
+
+
+def test_concurrent_requests_share_a_batch():
+    batches = []
+
+    def embed_fn(texts):
+        batches.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    scheduler = EmbeddingScheduler(embed_fn, window_ms=200, max_batch=16)
+    results = {}
+
+    def call(text):
+        results[text] = scheduler.embed([text])
+
+    threads = [threading.Thread(target=call, args=("x" * n,)) for n in range(1, 5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # every caller gets back its own row
+    assert all(results["x" * n].tolist() == [[float(n)]] for n in range(1, 5))
+    assert len(batches) < 4
+    stats = scheduler.stats()
+    assert stats["requests"] == 4
+    assert stats["texts"] == 4
+    scheduler.close()
+
+
+def test_full_batches_bypass_the_queue():
+    scheduler = EmbeddingScheduler(lambda texts: [[1.0] for _ in texts], window_ms=50, max_batch=2)
+    assert scheduler.embed(["a", "b", "c"]).shape == (3, 1)
+    assert scheduler.stats()["bypassed"] == 1
+
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+
+from app.embedding_cache import EmbeddingCache
+
+
+def test_cache_hits_skip_compute(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"))
+    calls = []
+
+    def compute(texts):
+        calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    first = cache.embed("m", 2, ["a", "bb", "a"], compute)
+    assert first.dtype == np.float32 and first.shape == (3, 2)
+    assert calls == [["a", "bb"]]
+
+    second = cache.embed("m", 2, ["bb", "ccc"], compute)
+    assert calls[-1] == ["ccc"]
+    assert second[0].tolist() == [2.0, 1.0]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+    # a different model id never shares vectors
+    cache.embed("other", 2, ["a"], compute)
+    assert calls[-1] == ["a"]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), max_entries=2)
+    compute = lambda texts: [[1.0] for _ in texts]
+    cache.embed("m", 1, ["a"], compute)
+    cache.embed("m", 1, ["b"], compute)
+    cache.embed("m", 1, ["c"], compute)
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
@@ -21,3 +21,63 @@ def test_ingest_bytes_txt(monkeypatch):
     assert res["filename"] == "test.txt"
     assert res["chunks"] >= 1
     assert isinstance(res["collection"], str)
+
+
+def test_iter_chunks_matches_simple_chunk():
+    from app.ingest import iter_chunks
+
+    text = "".join(chr(97 + (i * 7) % 26) for i in range(5000))
+    for cut in (1, 37, 800, 801, 4999):
+        segments = [text[i:i + cut] for i in range(0, len(text), cut)]
+        assert list(iter_chunks(segments, chunk_size=100, overlap=10)) == simple_chunk(text, 100, 10)
+    assert list(iter_chunks([text[:800]])) == simple_chunk(text[:800])
+    assert list(iter_chunks([])) == []
+
+
+def test_ingest_file_path_streams_in_batches(monkeypatch, tmp_path):
+    import asyncio
+    import io
+
+    import app.ingest as ingest
+    from app.chroma_client import get_chroma_collection, reset_chroma_collection
+
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("INGEST_BATCH_CHUNKS", "8")
+    batches = []
+    embed = ingest.embed_texts
+    monkeypatch.setattr(ingest, "embed_texts", lambda texts: batches.append(len(texts)) or embed(texts))
+
+    class Upload:
+        filename = "big.txt"
+
+        def __init__(self, data):
+            self._f = io.BytesIO(data)
+
+        async def read(self, n):
+            return self._f.read(n)
+
+    # multi-byte characters straddle the spool and read blocks
+    text = "Net income rose 4% — €1.2bn. " * 700
+    path = asyncio.run(ingest.spool_upload(Upload(text.encode("utf-8")), str(tmp_path), block_size=1000))
+    reset_chroma_collection("stream_test")
+    res = ingest.ingest_file_path(path, "big.txt", collection_name="stream_test")
+    assert res["chunks"] == len(simple_chunk(text)) and max(batches) == 8
+
+    (tmp_path / "small.txt").write_text(text[:2000], encoding="utf-8")
+    assert ingest.ingest_file_path(str(tmp_path / "small.txt"), "big.txt", collection_name="stream_test")["chunks"] == 3
+    coll = get_chroma_collection("stream_test")
+    assert coll.count() == 3
+    assert coll.get(ids=["doc_big.txt_2"])["documents"] == [simple_chunk(text[:2000])[2]]
+
+
+def test_joined_pages_match_the_stripped_document_text():
+    from app.ingest import _join_pages
+
+    for pages in (["  \n", " Revenue  ", "", "grew. \n\n", "  \t"], ["", "x"], ["a", " ", "b "], ["  "]):
+        starts = []
+        text = "".join(_join_pages(pages, starts))
+        assert text == "\n".join(pages).strip() and len(starts) == len(pages)
+    starts = []
+    "".join(_join_pages(["  a ", "b", " c"], starts))
+    assert starts == [0, 3, 5]
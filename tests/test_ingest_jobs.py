@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.ingest_jobs as ingest_jobs
+from app.chroma_client import get_chroma_collection, reset_chroma_collection
+from app.ingest_jobs import IngestJobQueue
+
+
+def _setup(monkeypatch, tmp_path):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("INGEST_MANIFEST_PATH", str(tmp_path / "manifest.sqlite3"))
+    reset_chroma_collection("jobs_test")
+
+
+def _upload(jobs, name, text):
+    path = os.path.join(jobs.uploads, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def _wait(jobs, job_id, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_reports_stage_progress_and_timings(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    jobs = IngestJobQueue(str(tmp_path / "jobs"), workers=1)
+    jobs.start()
+    try:
+        text = "Quarterly cash flow statement. " * 200
+        path = _upload(jobs, "cash.txt", text)
+        job = jobs.submit(path, "cash.txt", "alice", "jobs_test")
+        assert job["status"] == "queued" and job["stage"] == "queued"
+
+        done = _wait(jobs, job["id"])
+        assert done["status"] == "done" and done["error"] is None
+        assert done["progress"]["chunks"] == done["progress"]["embedded"] > 1
+        assert {"queued", "hashing", "extracting", "embedding", "finalizing"} <= set(done["timings"])
+        assert done["result"]["collection"] == "jobs_test" and not os.path.exists(path)
+        assert get_chroma_collection("jobs_test").count() == done["progress"]["chunks"]
+        assert "path" not in done and all("path" not in j for j in jobs.list("alice"))
+
+        def broken(*args, **kwargs):
+            raise RuntimeError("embedding backend down")
+
+        monkeypatch.setattr(ingest_jobs, "ingest_file_path", broken)
+        path = _upload(jobs, "broken.txt", "Deferred revenue. " * 50)
+        failed = _wait(jobs, jobs.submit(path, "broken.txt", "alice", "jobs_test")["id"])
+        assert failed["status"] == "failed" and "backend down" in failed["error"] and not os.path.exists(path)
+        assert [j["id"] for j in jobs.list("alice")] == [failed["id"], job["id"]] and jobs.list("bob") == []
+    finally:
+        jobs.close()
+
+
+def test_unfinished_jobs_resume_after_restart(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    directory = str(tmp_path / "jobs")
+    jobs = IngestJobQueue(directory)  # never started: the job is left queued
+    job = jobs.submit(_upload(jobs, "notes.txt", "Expense review notes. " * 80), "notes.txt", "alice", "jobs_test")
+    jobs.close()
+
+    restarted = IngestJobQueue(directory, workers=1)
+    restarted.start()
+    try:
+        assert restarted.get(job["id"])["status"] in ("queued", "running", "done")
+        assert _wait(restarted, job["id"])["status"] == "done"
+        assert get_chroma_collection("jobs_test").count() > 0
+    finally:
+        restarted.close()
+
+
+def test_stop_leaves_the_backlog_queued(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    release = threading.Event()
+    started = []
+
+    def slow(path, filename, **kwargs):
+        started.append(filename)
+        release.wait(5)
+        return {"filename": filename, "chunks": 0, "collection": "", "embedded": 0, "deleted": 0, "unchanged": False}
+
+    monkeypatch.setattr(ingest_jobs, "ingest_file_path", slow)
+    directory = str(tmp_path / "jobs")
+    jobs = IngestJobQueue(directory, workers=1)
+    jobs.start()
+    ids = [jobs.submit(_upload(jobs, f"n{i}.txt", "Accruals. " * 20), f"n{i}.txt", "alice", "jobs_test")["id"]
+           for i in range(3)]
+    while not started:
+        time.sleep(0.01)
+    threading.Timer(0.2, release.set).start()
+    jobs.close()  # waits for the running job, then stops without touching the backlog
+
+    again = IngestJobQueue(directory)
+    try:
+        assert started == ["n0.txt"]
+        assert [again.get(i)["status"] for i in ids] == ["done", "queued", "queued"]
+    finally:
+        again.close()
+
+
+def test_only_expired_leases_are_requeued(monkeypatch, tmp_path):
+    _setup(monkeypatch, tmp_path)
+    directory = str(tmp_path / "jobs")
+    live = IngestJobQueue(directory)
+    alive = live.submit(_upload(live, "a.txt", "Accruals. " * 20), "a.txt", "alice", "jobs_test")["id"]
+    dead = live.submit(_upload(live, "b.txt", "Accruals. " * 20), "b.txt", "alice", "jobs_test")["id"]
+    now = time.time()
+    # one job held by a live process, one whose process stopped renewing its lease
+    live._update(alive, status="running", owner="other", lease_until=now + 60)
+    live._update(dead, status="running", owner="gone", lease_until=now - 1)
+    live.close()
+
+    other = IngestJobQueue(directory, workers=1)
+    other.start()
+    try:
+        assert _wait(other, dead)["status"] == "done"
+        assert other.get(alive)["status"] == "running" and other.stats()["reclaimed"] == 1
+    finally:
+        other.close()
@@ -0,0 +1,130 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.ingest as ingest
+from app.chroma_client import delete_source, get_chroma_collection, reset_chroma_collection
+
+
+def _setup(monkeypatch, tmp_path):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("INGEST_MANIFEST_PATH", str(tmp_path / "manifest.sqlite3"))
+    embedded = []
+    embed = ingest.embed_texts
+    monkeypatch.setattr(ingest, "embed_texts", lambda texts: embedded.extend(texts) or embed(texts))
+    return embedded
+
+
+def test_reingest_embeds_only_what_changed(monkeypatch, tmp_path):
+    embedded = _setup(monkeypatch, tmp_path)
+    reset_chroma_collection("manifest_test")
+    text = "".join(f"Line {i}: operating margin commentary. " for i in range(120))
+    path = tmp_path / "notes.txt"
+    path.write_text(text, encoding="utf-8")
+
+    first = ingest.ingest_file_path(str(path), collection_name="manifest_test")
+    assert first["embedded"] == first["chunks"] == len(ingest.simple_chunk(text)) and not first["unchanged"]
+
+    embedded.clear()
+    again = ingest.ingest_file_path(str(path), collection_name="manifest_test")
+    assert again["unchanged"] and again["embedded"] == 0 and embedded == []
+
+    # an edit near the end only touches the chunks that contain it
+    edited = text[:-300] + "Revised guidance. " + text[-282:]
+    path.write_text(edited, encoding="utf-8")
+    res = ingest.ingest_file_path(str(path), collection_name="manifest_test")
+    changed = [a != b for a, b in zip(ingest.simple_chunk(text), ingest.simple_chunk(edited))]
+    assert res["embedded"] == sum(changed) == len(embedded) and 0 < res["embedded"] < res["chunks"]
+
+    path.write_text(edited[:1500], encoding="utf-8")
+    res = ingest.ingest_file_path(str(path), collection_name="manifest_test")
+    assert res["chunks"] == 2 and res["embedded"] == 0 and res["deleted"] == first["chunks"] - 2
+    assert get_chroma_collection("manifest_test").count() == 2
+
+    # after a reset or delete the manifest no longer vouches for the chunks
+    delete_source("notes.txt", "manifest_test")
+    assert ingest.ingest_file_path(str(path), collection_name="manifest_test")["embedded"] == 2
+    reset_chroma_collection("manifest_test")
+    assert ingest.ingest_file_path(str(path), collection_name="manifest_test")["embedded"] == 2
+    # a different uploader re-tags every chunk
+    assert ingest.ingest_file_path(str(path), user="bob", collection_name="manifest_test")["embedded"] == 2
+
+
+def test_manifest_keeps_page_digests_not_page_text(monkeypatch, tmp_path):
+    import sqlite3
+
+    from app.ingest_manifest import IngestManifest, chunk_digest, get_ingest_manifest
+
+    # a manifest from before pages were only digested, with its text cache
+    old = sqlite3.connect(str(tmp_path / "manifest.sqlite3"))
+    old.execute("CREATE TABLE documents (collection TEXT NOT NULL, source TEXT NOT NULL, user TEXT NOT NULL,"
+                " file_hash TEXT NOT NULL, text_hash TEXT NOT NULL, chunk_hashes BLOB NOT NULL,"
+                " updated_at REAL NOT NULL, PRIMARY KEY (collection, source))")
+    old.execute("CREATE TABLE extracted_pages (file_hash TEXT, page INTEGER, text TEXT)")
+    old.execute("INSERT INTO documents VALUES ('legacy', 'old.txt', '', 'f', 't', x'', 0)")
+    old.commit()
+    old.close()
+
+    _setup(monkeypatch, tmp_path)
+    pages = ["a" * 900, "b" * 400]
+    monkeypatch.setattr(ingest, "iter_pdf_pages", lambda path: iter(pages))
+    pdf = tmp_path / "annual.pdf"
+    pdf.write_bytes(b"%PDF- annual report")
+    reset_chroma_collection("pages_a")
+    ingest.ingest_file_path(str(pdf), collection_name="pages_a")
+
+    manifest = get_ingest_manifest()
+    assert manifest.get("pages_a", "annual.pdf").page_hashes == [chunk_digest(p) for p in pages]
+    assert manifest.get("legacy", "old.txt").page_hashes == []
+    tables = {row[0] for row in sqlite3.connect(manifest.path).execute("SELECT name FROM sqlite_master")}
+    assert "extracted_pages" not in tables and isinstance(manifest, IngestManifest)
+    metas = get_chroma_collection("pages_a").get(include=["metadatas"])["metadatas"]
+    assert sorted((m["page_start"], m["page_end"]) for m in metas) == [(1, 1), (1, 2)]
+
+
+def test_unchanged_chunks_get_fresh_metadata(monkeypatch, tmp_path):
+    from app.ingest_pipeline import ingest_documents
+
+    embedded = _setup(monkeypatch, tmp_path)
+    # both versions extract to the same text, but the page break moves
+    versions = {b"%PDF- v1": ["a" * 700, "b" * 300 + "\n" + "b" * 299],
+                b"%PDF- v2": ["a" * 700 + "\n" + "b" * 300, "b" * 299]}
+    versions[b"%PDF- v2 resaved"] = versions[b"%PDF- v2"]
+    monkeypatch.setattr(ingest, "iter_pdf_pages", lambda path: iter(versions[open(path, "rb").read()]))
+    pdf = tmp_path / "deck.pdf"
+    reset_chroma_collection("refresh_test")
+
+    def spans():
+        got = get_chroma_collection("refresh_test").get(include=["metadatas"])
+        return {cid: (m["page_start"], m["page_end"], m["ingested_at"]) for cid, m in zip(got["ids"], got["metadatas"])}
+
+    pdf.write_bytes(b"%PDF- v1")
+    monkeypatch.setattr(ingest.time, "time", lambda: 1000.0)
+    ingest.ingest_file_path(str(pdf), collection_name="refresh_test")
+    assert spans() == {"doc_deck.pdf_0": (1, 2, 1000), "doc_deck.pdf_1": (1, 2, 1000)}
+
+    embedded.clear()
+    pdf.write_bytes(b"%PDF- v2")
+    monkeypatch.setattr(ingest.time, "time", lambda: 2000.0)
+    res = ingest.ingest_file_path(str(pdf), collection_name="refresh_test")
+    assert res["embedded"] == 0 and not res["unchanged"] and embedded == []
+    assert spans() == {"doc_deck.pdf_0": (1, 1, 2000), "doc_deck.pdf_1": (1, 2, 2000)}
+
+    # new bytes, same pages: nothing to rewrite
+    pdf.write_bytes(b"%PDF- v2 resaved")
+    monkeypatch.setattr(ingest.time, "time", lambda: 2500.0)
+    assert ingest.ingest_file_path(str(pdf), collection_name="refresh_test")["unchanged"]
+    pdf.write_bytes(b"%PDF- v2")
+    assert ingest_documents([(str(pdf), "deck.pdf")], collection_name="refresh_test")["unchanged"] == 1
+    assert spans() == {"doc_deck.pdf_0": (1, 1, 2000), "doc_deck.pdf_1": (1, 2, 2000)}
+
+    pdf.write_bytes(b"%PDF- v1")
+    monkeypatch.setattr(ingest.time, "time", lambda: 3000.0)
+    res = ingest_documents([(str(pdf), "deck.pdf")], collection_name="refresh_test")
+    assert res["embedded"] == 0 and res["chunks"] == 2 and embedded == []
+    assert spans() == {"doc_deck.pdf_0": (1, 2, 3000), "doc_deck.pdf_1": (1, 2, 3000)}
+    hits = get_chroma_collection("refresh_test").query(query_embeddings=ingest.embed_texts(["a" * 700]).tolist(),
+                                                       n_results=1)
+    assert hits["ids"][0] == ["doc_deck.pdf_0"]
@@ -0,0 +1,108 @@
+import io
+import os
+import sys
+import tarfile
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.ingest as ingest
+from app.chroma_client import get_chroma_collection, reset_chroma_collection
+from app.ingest_pipeline import UnpackBudget, ingest_documents, iter_directory, unpack_archive
+
+
+def _setup(monkeypatch, tmp_path):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("INGEST_MANIFEST_PATH", str(tmp_path / "manifest.sqlite3"))
+    calls = []
+    embed = ingest.embed_texts
+    monkeypatch.setattr(ingest, "embed_texts", lambda texts: calls.append(len(texts)) or embed(texts))
+    return calls
+
+
+def _contents(name):
+    got = get_chroma_collection(name).get(include=["documents", "metadatas"])
+    return {cid: (doc, {k: v for k, v in meta.items() if k != "ingested_at"})
+            for cid, doc, meta in zip(got["ids"], got["documents"], got["metadatas"])}
+
+
+def test_pipeline_matches_one_file_at_a_time(monkeypatch, tmp_path):
+    calls = _setup(monkeypatch, tmp_path)
+    monkeypatch.setattr(ingest, "iter_pdf_pages", lambda path: iter(["p" * 900, "q" * 700]))
+    corpus = tmp_path / "corpus"
+    (corpus / "sub").mkdir(parents=True)
+    for i in range(12):
+        (corpus / ("sub" if i % 2 else "") / f"memo{i}.txt").write_text(f"Memo {i} on budget variance. " * (5 + 20 * i))
+    (corpus / "deck.pdf").write_bytes(b"%PDF- deck")
+    (corpus / ".DS_Store").write_bytes(b"\x00")
+    items = list(iter_directory(str(corpus)))
+    assert len(items) == 13 and ("sub/memo1.txt" in dict((s, p) for p, s in items))
+
+    reset_chroma_collection("serial_test")
+    for path, source in items:
+        ingest.ingest_file_path(path, source, user="alice", collection_name="serial_test")
+    serial_calls = len(calls)
+
+    calls.clear()
+    reset_chroma_collection("bulk_test")
+    seen = []
+    res = ingest_documents(items + [(str(corpus / "missing.txt"), "missing.txt"), items[0]], user="alice",
+                           collection_name="bulk_test", batch_size=64, extract_workers=3, on_document=seen.append)
+    assert _contents("bulk_test") == _contents("serial_test")
+    assert res["documents"] == 15 and res["failed"] == 1 and res["skipped"] == 1 and res["unchanged"] == 0
+    assert res["chunks"] == res["embedded"] == get_chroma_collection("bulk_test").count()
+    # small documents share embedding batches
+    assert len(calls) < serial_calls and max(calls) <= 64
+    assert len(seen) == 15 and {r["filename"] for r in res["files"] if "error" in r} == {"missing.txt"}
+    assert [r["filename"] for r in seen if "skipped" in r] == [items[0][1]]
+
+    again = ingest_documents(items, user="alice", collection_name="bulk_test", batch_size=64)
+    assert again["unchanged"] == 13 and again["embedded"] == 0
+
+
+def test_unpack_archive_skips_unsafe_and_unwanted_members(tmp_path):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("reports/q1.txt", "first quarter")
+        zf.writestr("../escape.txt", "nope")
+        zf.writestr("__MACOSX/reports/._q1.txt", "junk")
+        zf.writestr("reports/logo.png", b"\x89PNG")
+    (tmp_path / "bundle.zip").write_bytes(buf.getvalue())
+    items = unpack_archive(str(tmp_path / "bundle.zip"), str(tmp_path / "zip"))
+    assert [s for _, s in items] == ["reports/q1.txt"]
+    assert open(items[0][0]).read() == "first quarter" and not (tmp_path / "escape.txt").exists()
+
+    with tarfile.open(tmp_path / "bundle.tar.gz", "w:gz") as tf:
+        for name, data in (("notes/a.md", b"alpha"), ("/etc/passwd.txt", b"root")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo("notes/link.txt")
+        link.type, link.linkname = tarfile.SYMTYPE, "/etc/passwd"
+        tf.addfile(link)
+    items = unpack_archive(str(tmp_path / "bundle.tar.gz"), str(tmp_path / "tar"))
+    assert [s for _, s in items] == ["notes/a.md"]
+
+
+def test_archives_share_one_budget(tmp_path):
+    for n in range(2):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            for i in range(3):
+                zf.writestr(f"part{n}/doc{i}.txt", "x" * 100)
+        (tmp_path / f"b{n}.zip").write_bytes(buf.getvalue())
+    # each archive fits on its own
+    assert len(unpack_archive(str(tmp_path / "b0.zip"), str(tmp_path / "solo"), UnpackBudget(max_files=4))) == 3
+
+    budget = UnpackBudget(max_files=4)
+    unpack_archive(str(tmp_path / "b0.zip"), str(tmp_path / "0"), budget)
+    with pytest.raises(ValueError, match="more than 4 files"):
+        unpack_archive(str(tmp_path / "b1.zip"), str(tmp_path / "1"), budget)
+
+    budget = UnpackBudget(max_bytes=500)
+    unpack_archive(str(tmp_path / "b0.zip"), str(tmp_path / "2"), budget)
+    with pytest.raises(ValueError, match="more than 500 bytes"):
+        unpack_archive(str(tmp_path / "b1.zip"), str(tmp_path / "3"), budget)
@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.lexical_index import LexicalIndex, tokenize
+
+
+def test_tokenize_keeps_financial_tokens_whole():
+    assert tokenize("BRK.B filed its 10-K for Q3 (FY2024).") == ["brk.b", "filed", "10-k", "q3", "fy2024"]
+
+
+def test_bm25_ranking_replace_delete_and_reopen(tmp_path):
+    path = str(tmp_path / "lex.sqlite3")
+    index = LexicalIndex(path, compact_min_docs=10 ** 9)
+    index.add(["a", "b", "c"], ["Apple filed its 10-K; the 10-K covers Q3.", "AAPL rose after Q3 earnings.",
+                                "Tesla deliveries fell."])
+    assert [cid for cid, _ in index.search("10-K Q3")] == ["a", "b"]
+    assert index.search("tesla deliveries")[0][0] == "c"
+    assert index.search("unknown words") == []
+
+    index.add(["a"], ["Apple filed a 10-Q."])
+    assert index.search("10-K") == []
+    index.delete(["b"])
+    assert index.search("aapl") == []
+    assert index.stats()["dead_docs"] == 2
+
+    # another handle (or process) on the same file sees the same postings
+    other = LexicalIndex(path)
+    assert {cid for cid, _ in other.search("10-q tesla")} == {"a", "c"}
+
+    assert index.compact() == 2
+    stats = other.stats()
+    assert stats["docs"] == 2 and stats["dead_docs"] == 0 and stats["blocks"] == stats["terms"]
+    assert [cid for cid, _ in other.search("10-q")] == ["a"]
+    index.add(["d"], ["Q3 guidance raised"])
+    assert other.search("guidance")[0][0] == "d"
+
+
+def test_hybrid_retrieval_finds_exact_tokens(monkeypatch, tmp_path):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path))
+    from app.chroma_client import reset_chroma_collection
+    from app.ingest import ingest_file_bytes
+    from app.retrieval import retrieve_chunks
+
+    reset_chroma_collection()
+    ingest_file_bytes("filler.txt", b"General commentary on markets and the economy. " * 60)
+    ingest_file_bytes("form.txt", b"Form 8-K item 2.02 results for ticker ZQX.")
+
+    monkeypatch.setenv("RETRIEVAL_MODE", "hybrid")
+    found = retrieve_chunks("ZQX 8-K", top_k=2)
+    assert found.ids[0] == "doc_form.txt_0"
+    assert found.metas[0]["source"] == "form.txt"
+    # where filters still apply to chunks only BM25 found
+    assert "doc_form.txt_0" not in retrieve_chunks("ZQX 8-K", top_k=2, where={"source": "filler.txt"}).ids
+
+
+def test_index_is_only_kept_for_hybrid_retrieval(monkeypatch, tmp_path):
+    from app.lexical_index import get_lexical_index
+
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path))
+    monkeypatch.delenv("LEXICAL_INDEX_ENABLED", raising=False)
+    monkeypatch.delenv("RETRIEVAL_MODE", raising=False)
+    assert get_lexical_index("vector_only") is None
+    monkeypatch.setenv("RETRIEVAL_MODE", "hybrid")
+    assert get_lexical_index("hybrid_mode") is not None
+    monkeypatch.setenv("LEXICAL_INDEX_ENABLED", "false")
+    assert get_lexical_index("hybrid_mode") is None
@@ -0,0 +1,123 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import llm_provider
+from app.llm_provider import get_llm_and_embeddings, reload_llm_and_embeddings
+
+
+def test_provider_reused_per_config(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "gemini")
+    monkeypatch.setenv("LOCAL_EMBED_DIM", "16")
+    first = get_llm_and_embeddings()
+    assert get_llm_and_embeddings() is first
+
+    # a different config gets its own entry
+    monkeypatch.setenv("LOCAL_EMBED_DIM", "32")
+    second = get_llm_and_embeddings()
+    assert second is not first
+    assert len(second[1](["abc"])[0]) == 32
+
+
+def test_reload_clears_registry(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "gemini")
+    first = get_llm_and_embeddings()
+    reload_llm_and_embeddings()
+    assert get_llm_and_embeddings() is not first
+    assert all(k[0] == "gemini" for k in llm_provider._PROVIDERS)
+
+
+def _loop_hash_embed(texts, dim):
+    # reference: the original per-byte implementation
+    vectors = []
+    for t in texts:
+        v = [0] * dim
+        for i, ch in enumerate(t.encode("utf-8")):
+            v[i % dim] = (v[i % dim] + ch) % 1000
+        vectors.append([float(x) for x in v])
+    return vectors
+
+
+def test_hash_embed_matches_reference():
+    texts = ["", "hello world", "Überschuss € 10%", "x" * 5000, "abc" * 700]
+    out = llm_provider.hash_embed(texts, 384)
+    assert out.dtype.name == "float32" and out.flags["C_CONTIGUOUS"]
+    assert out.tolist() == _loop_hash_embed(texts, 384)
+
+
+def test_async_embed_matches_sync(monkeypatch):
+    import asyncio
+
+    monkeypatch.setenv("LLM_PROVIDER", "gemini")
+    _, embedder = get_llm_and_embeddings()
+    _, aembed = llm_provider.get_async_llm_and_embeddings()
+    out = asyncio.run(aembed(["net income", "cash flow"]))
+    assert out.tolist() == embedder(["net income", "cash flow"]).tolist()
+
+
+def test_gemini_async_embed_runs_off_the_event_loop(monkeypatch):
+    import asyncio
+    import threading
+
+    monkeypatch.delenv("EMBED_BATCH_WINDOW_MS", raising=False)
+    threads = []
+
+    def embed(texts):
+        threads.append(threading.current_thread())
+        return llm_provider.hash_embed(texts, 8)
+
+    _, aembed = llm_provider.get_gemini_async_clients(embed)
+    out = asyncio.run(aembed(["operating income"]))
+    assert out.shape == (1, 8) and threads[0] is not threading.main_thread()
+
+
+def test_async_http_client_is_pooled_per_loop():
+    import asyncio
+
+    async def grab():
+        first = llm_provider.get_async_http_client()
+        second = llm_provider.get_async_http_client()
+        await llm_provider.close_async_http_client()
+        return first, second
+
+    first, second = asyncio.run(grab())
+    assert first is second
+    assert first.is_closed
+
+
+def test_openai_embeddings_go_through_their_own_limiter(monkeypatch):
+    import asyncio
+
+    from app.provider_limits import provider_limit_stats, reset_provider_limiters
+
+    monkeypatch.setenv("EMBED_CACHE_ENABLED", "false")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_EMBED_BACKOFF_BASE", "0.001")
+    monkeypatch.setenv("OPENAI_EMBED_BACKOFF_MAX", "0.001")
+    reset_provider_limiters()
+    calls = []
+
+    class _Response:
+        def __init__(self, status, texts):
+            self.status_code, self.texts = status, texts
+
+        def raise_for_status(self):
+            if self.status_code != 200:
+                raise RuntimeError(f"HTTP {self.status_code}")
+
+        def json(self):
+            return {"data": [{"index": i, "embedding": [float(len(t))]} for i, t in enumerate(self.texts)]}
+
+    class _Client:
+        async def post(self, url, headers=None, json=None):
+            calls.append(url)
+            return _Response(429 if len(calls) == 1 else 200, json["input"])
+
+    monkeypatch.setattr(llm_provider, "get_async_http_client", lambda: _Client())
+    _, aembed = llm_provider.get_openai_async_clients()
+    out = asyncio.run(aembed(["ebitda", "capex"]))
+    assert [row[0] for row in out.tolist()] == [6.0, 5.0] and len(calls) == 2
+    stats = provider_limit_stats()["openai"]["embeddings"]
+    assert stats["calls"] == 1 and stats["retries"] == 1 and stats["succeeded"] == 1
+    reset_provider_limiters()
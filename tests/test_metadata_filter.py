@@ -0,0 +1,92 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.metadata_index import validate_where
+from app.vector_store import MemoryCollection
+
+
+def _collection():
+    rng = np.random.default_rng(3)
+    coll = MemoryCollection("f")
+    metas = [{"source": f"doc{i % 4}.pdf", "user": "alice" if i % 2 else "bob", "ingested_at": 1000 + i}
+             for i in range(40)]
+    coll.upsert(ids=[f"c{i}" for i in range(40)], documents=[f"d{i}" for i in range(40)],
+                metadatas=metas, embeddings=rng.normal(size=(40, 8)).astype(np.float32))
+    return coll, metas
+
+
+def _matching(coll, where):
+    res = coll.query(query_embeddings=[[1.0] * 8], n_results=100, where=where)
+    return {int(i[1:]) for i in res["ids"][0]}
+
+
+def test_where_filters_select_the_matching_rows():
+    coll, metas = _collection()
+    assert _matching(coll, {"source": "doc1.pdf"}) == {i for i, m in enumerate(metas) if m["source"] == "doc1.pdf"}
+    assert _matching(coll, {"$and": [{"user": "alice"}, {"ingested_at": {"$gte": 1030}}]}) == \
+        {i for i in range(30, 40) if i % 2}
+    assert _matching(coll, {"$or": [{"source": {"$in": ["doc0.pdf", "doc2.pdf"]}}, {"ingested_at": {"$lt": 1003}}]}) == \
+        {i for i in range(40) if i % 2 == 0} | {1}
+    assert _matching(coll, {"user": {"$ne": "bob"}}) == {i for i in range(40) if i % 2}
+    assert _matching(coll, {"source": "missing.pdf"}) == set()
+
+
+def test_filtered_top_k_is_best_within_the_slice():
+    coll, _ = _collection()
+    unfiltered = coll.query(query_embeddings=[[1.0] * 8], n_results=40)
+    expected = [i for i in unfiltered["ids"][0] if int(i[1:]) % 4 == 3][:3]
+    res = coll.query(query_embeddings=[[1.0] * 8], n_results=3, where={"source": "doc3.pdf"})
+    assert res["ids"][0] == expected
+
+
+@pytest.mark.parametrize("where", [
+    {"source": ["a.pdf", "b.pdf"]},
+    {"source": {"$eq": ["a.pdf"]}},
+    {"ingested_at": {"$gt": None}},
+    {"ingested_at": {"$lt": True}},
+    {"source": {"$in": ["a.pdf", 3]}},
+    {"source": {"$in": []}},
+    {"source": {"$like": "a%"}},
+    {"$not": {"source": "a.pdf"}},
+    {"$and": {"source": "a.pdf"}},
+    {"$or": [{"source": "a.pdf"}, "b.pdf"]},
+    {"source": {}},
+])
+def test_malformed_where_is_a_value_error(where):
+    with pytest.raises(ValueError):
+        validate_where(where)
+    coll, _ = _collection()
+    with pytest.raises(ValueError):
+        coll.query(query_embeddings=[[1.0] * 8], n_results=5, where=where)
+
+
+def test_query_endpoint_rejects_malformed_where_with_400(monkeypatch):
+    import asyncio
+
+    from fastapi import HTTPException
+
+    from app import main
+
+    monkeypatch.setattr(main.app.state, "llm", lambda prompt: "", raising=False)
+    validate_where({"$and": [{"user": "alice"}, {"ingested_at": {"$gte": 1030}}], "source": {"$nin": ["x"]}})
+    with pytest.raises(HTTPException) as err:
+        asyncio.run(main.query(main.QueryRequest(query="revenue", where={"source": {"$eq": ["a.pdf"]}})))
+    assert err.value.status_code == 400 and "$eq" in err.value.detail
+
+
+def test_booleans_and_numbers_do_not_match_each_other():
+    coll = MemoryCollection("types")
+    metas = [{"page": 1}, {"page": True}, {"page": 0}, {"page": False}, {"page": 1.0}]
+    coll.upsert(ids=[f"c{i}" for i in range(5)], documents=[f"d{i}" for i in range(5)], metadatas=metas,
+                embeddings=np.eye(5, 8, dtype=np.float32))
+    assert _matching(coll, {"page": 1}) == {0, 4}
+    assert _matching(coll, {"page": True}) == {1}
+    assert _matching(coll, {"page": {"$eq": 0}}) == {2}
+    assert _matching(coll, {"page": {"$in": [False]}}) == {3}
+    assert _matching(coll, {"page": {"$ne": 1}}) == {1, 2, 3}
+    assert _matching(coll, {"page": {"$nin": [True, False]}}) == {0, 2, 4}
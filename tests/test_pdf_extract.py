@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.pdf_extract import ordered_map
+
+
+def test_ordered_map_keeps_order_and_bounds_in_flight():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work(i):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.002 * (i % 3))
+        with lock:
+            running[0] -= 1
+        return i * i
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(ordered_map(pool, work, ((i,) for i in range(40)), window=3)) == [i * i for i in range(40)]
+    assert peak[0] <= 3
+
+
+def test_pdf_chunks_carry_page_numbers(monkeypatch, tmp_path):
+    import app.ingest as ingest
+    from app.chroma_client import get_chroma_collection, reset_chroma_collection
+
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("INGEST_MANIFEST_PATH", str(tmp_path / "manifest.sqlite3"))
+    pages = ["  \n", "a" * 1000, "", "b" * 500]
+    monkeypatch.setattr(ingest, "iter_pdf_pages", lambda path: iter(pages))
+    (tmp_path / "report.pdf").write_bytes(b"%PDF-")
+
+    reset_chroma_collection("pages_test")
+    res = ingest.ingest_file_path(str(tmp_path / "report.pdf"), collection_name="pages_test")
+    got = get_chroma_collection("pages_test").get(include=["metadatas", "documents"])
+    spans = {cid: (m["page_start"], m["page_end"]) for cid, m in zip(got["ids"], got["metadatas"])}
+    assert res["chunks"] == 3
+    # page 1 is blank, so the text starts with page 2; chunk 1 covers 700..1499
+    assert spans == {"doc_report.pdf_0": (2, 2), "doc_report.pdf_1": (2, 4), "doc_report.pdf_2": (4, 4)}
+    assert got["documents"][got["ids"].index("doc_report.pdf_2")].endswith("b" * 100)
+
+
+def test_parallel_extraction_matches_serial(monkeypatch, tmp_path):
+    fitz = pytest.importorskip("fitz")
+    from app.pdf_extract import close_pdf_pools, iter_pdf_pages
+
+    doc = fitz.open()
+    for i in range(40):
+        doc.new_page().insert_text((72, 72), f"Page {i + 1} revenue line")
+    path = str(tmp_path / "long.pdf")
+    doc.save(path)
+
+    serial = list(iter_pdf_pages(path))
+    monkeypatch.setenv("PDF_EXTRACT_WORKERS", "2")
+    monkeypatch.setenv("PDF_PAGES_PER_TASK", "7")
+    try:
+        assert list(iter_pdf_pages(path)) == serial
+    finally:
+        close_pdf_pools()
+    assert "Page 40" in serial[-1]
+
+
+def test_range_pymupdf_cannot_read_falls_back_to_pdfminer(monkeypatch):
+    import app.pdf_extract as pdf_extract
+
+    def broken(path, start, end):
+        if start >= 2:
+            raise RuntimeError("cannot decode page")
+        return [f"fitz {i}" for i in range(start, end)]
+
+    monkeypatch.setattr(pdf_extract, "_backend", lambda path: ("fitz", 5))
+    monkeypatch.setattr(pdf_extract, "_fitz_pages", broken)
+    monkeypatch.setattr(pdf_extract, "_pdfminer_pages", lambda path, start, end: [f"miner {i}" for i in range(start, end)])
+    monkeypatch.setenv("PDF_PAGES_PER_TASK", "2")
+    assert list(pdf_extract.iter_pdf_pages("x.pdf")) == ["fitz 0", "fitz 1", "miner 2", "miner 3", "miner 4"]
+
+    def unavailable(path, start, end):
+        raise ImportError("pdfminer")
+
+    monkeypatch.setattr(pdf_extract, "_pdfminer_pages", unavailable)
+    with pytest.raises(RuntimeError, match="cannot decode"):
+        pdf_extract.extract_page_range("x.pdf", "fitz", 2, 4)
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.provider_limits import ProviderLimiter, TokenBucket, is_retryable
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_retries_transient_errors_then_succeeds():
+    limiter = ProviderLimiter("t", max_retries=3, backoff_base=0.001, backoff_max=0.001)
+    calls = []
+
+    def flaky(prompt):
+        calls.append(prompt)
+        if len(calls) < 3:
+            raise _HTTPError(429)
+        return "ok"
+
+    assert limiter.call(flaky, "q") == "ok"
+    assert len(calls) == 3
+    assert limiter.stats()["retries"] == 2
+
+
+def test_does_not_retry_client_errors():
+    limiter = ProviderLimiter("t", max_retries=3, backoff_base=0.001)
+    calls = []
+
+    def bad(prompt):
+        calls.append(prompt)
+        raise _HTTPError(400)
+
+    with pytest.raises(_HTTPError):
+        limiter.call(bad, "q")
+    assert len(calls) == 1
+    assert limiter.stats()["failed"] == 1
+    assert is_retryable(RuntimeError("Gemini API error: 503 UNAVAILABLE"))
+    assert not is_retryable(RuntimeError("GEMINI_API_KEY/GOOGLE_API_KEY not set"))
+    # only the head of a status-less message counts, and a status code found there decides
+    assert not is_retryable(RuntimeError("OpenAI API error: 400 Bad Request: prompt mentions error 503 twice"))
+    assert not is_retryable(RuntimeError("Invalid value: " + "x" * 200 + " service unavailable"))
+    assert is_retryable(RuntimeError("Gemini API error: RESOURCE_EXHAUSTED quota"))
+    try:
+        try:
+            raise _HTTPError(400)
+        except _HTTPError as e:
+            raise RuntimeError("Gemini API error: timeout mentioned in the prompt") from e
+    except RuntimeError as wrapped:
+        assert not is_retryable(wrapped)
+
+
+def test_concurrency_is_capped():
+    limiter = ProviderLimiter("t", max_concurrency=2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work(_):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+
+    threads = [threading.Thread(target=limiter.call, args=(work, i)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2
+    assert limiter.stats()["concurrency_waits"] > 0
+
+
+def test_token_bucket_reserves_future_slots():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+
+
+def test_hedge_wins_over_slow_attempt():
+    limiter = ProviderLimiter("t", hedge=True, hedge_min_samples=1)
+    limiter._record_latency(0.01)
+    attempts = []
+
+    async def agen(prompt):
+        attempts.append(prompt)
+        # the first attempt stalls; the hedge returns immediately
+        await asyncio.sleep(1.0 if len(attempts) == 1 else 0)
+        return f"answer {len(attempts)}"
+
+    assert asyncio.run(limiter.acall(agen, "q")) == "answer 2"
+    stats = limiter.stats()
+    assert stats["hedges_sent"] == 1 and stats["hedges_won"] == 1
+
+
+def test_sync_hedge_losers_are_bounded_and_in_process_models_never_hedge(monkeypatch):
+    from app.provider_limits import get_provider_limiter, reset_provider_limiters
+
+    limiter = ProviderLimiter("t", hedge=True, hedge_min_samples=1, max_concurrency=4)
+    limiter._record_latency(0.01)
+    release = threading.Event()
+    attempts = []
+
+    def gen(prompt):
+        attempts.append(prompt)
+        if len(attempts) == 1:
+            release.wait(5)  # the first attempt stalls until released
+        return "answer"
+
+    assert limiter.call(gen, "q") == "answer"
+    assert limiter.stats()["hedges_won"] == 1 and limiter.stats()["orphaned_in_flight"] == 1
+    # with one loser still running (limit 4 // 4), the next slow call is not hedged
+    slow = []
+    assert limiter.call(lambda p: slow.append(p) or time.sleep(0.1) or "late", "q2") == "late"
+    assert slow == ["q2"] and limiter.stats()["hedges_sent"] == 1
+    release.set()
+    deadline = time.monotonic() + 5
+    while limiter.stats()["orphaned_in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.stats()["orphaned_in_flight"] == 0
+
+    monkeypatch.setenv("LLM_HEDGE", "true")
+    reset_provider_limiters()
+    try:
+        assert get_provider_limiter("llama_cpp").hedge is False
+        assert get_provider_limiter("openai").hedge is True
+    finally:
+        reset_provider_limiters()
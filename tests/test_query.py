@@ -21,3 +21,15 @@ def test_retrieval_after_ingest(monkeypatch):
     docs, metas = retrieve_context("What happened to Apple revenue?", top_k=3)
     assert isinstance(docs, list)
     assert len(docs) >= 1
+
+
+def test_batched_retrieval_matches_single_queries(monkeypatch):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    from app.retrieval import retrieve_contexts
+
+    ingest_file_bytes("batch.txt", b"Microsoft cloud revenue rose. Tesla deliveries fell in the quarter.")
+    queries = ["Microsoft cloud revenue", "Tesla deliveries"]
+    batched = retrieve_contexts(queries, top_k=2)
+    assert len(batched) == 2
+    for q, (docs, metas) in zip(queries, batched):
+        assert (docs, metas) == retrieve_context(q, top_k=2)
@@ -25,3 +25,21 @@ def test_reset_clears_collection(monkeypatch):
     # Stats after
     after = collection_stats()
     assert after.get("count", 0) == 0
+
+
+def test_reingest_and_delete_source(monkeypatch):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    from app.main import collection_delete_source
+
+    collection_reset()
+    ingest_file_bytes("keep.txt", b"Other document.")
+    ingest_file_bytes("src.txt", b"x" * 3000)
+    ingest_file_bytes("src.txt", b"x" * 3000)
+    # a shorter re-upload replaces the old chunks instead of adding to them
+    ingest_file_bytes("src.txt", b"short")
+    assert collection_stats()["count"] == 2
+
+    res = collection_delete_source("src.txt")
+    assert res["deleted"] == 1
+    assert collection_stats()["count"] == 1
+    assert collection_delete_source("src.txt")["deleted"] == 0
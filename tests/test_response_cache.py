@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.response_cache import ResponseCache
+
+
+def test_hit_requires_same_question_and_chunks():
+    cache = ResponseCache(max_entries=10)
+    cache.put("query", "gemini", "m", "documents", "What is an emergency fund?", ["a", "b"], "answer")
+    assert cache.get("query", "gemini", "m", "documents", "  what is an EMERGENCY fund", ["a", "b"]) == "answer"
+    assert cache.get("query", "gemini", "m", "documents", "What is an emergency fund?", ["a", "c"]) is None
+    assert cache.get("query", "openai", "m", "documents", "What is an emergency fund?", ["a", "b"]) is None
+
+
+def test_ttl_lru_and_invalidation():
+    cache = ResponseCache(max_entries=2, ttl_seconds=-1)
+    cache.put("query", "p", "m", "documents", "q1", ["a"], "v1")
+    assert cache.get("query", "p", "m", "documents", "q1", ["a"]) is None  # already expired
+
+    cache = ResponseCache(max_entries=2)
+    cache.put("query", "p", "m", "documents", "q1", ["a"], "v1")
+    cache.put("query", "p", "m", "documents", "q2", ["b"], "v2")
+    cache.put("query", "p", "m", "documents", "q3", ["c"], "v3")
+    assert cache.get("query", "p", "m", "documents", "q1", ["a"]) is None  # evicted
+
+    assert cache.invalidate_chunks("documents", ["b"]) == 1
+    assert cache.get("query", "p", "m", "documents", "q2", ["b"]) is None
+    assert cache.invalidate_collection("documents") == 1
+
+
+def test_near_duplicate_questions():
+    cache = ResponseCache(similarity_threshold=0.95)
+    cache.put("query", "p", "m", "documents", "what is an emergency fund", ["a"], "v", qvec=[1.0, 0.0])
+    assert cache.get("query", "p", "m", "documents", "what's an emergency fund", ["a"], qvec=[0.99, 0.05]) == "v"
+    assert cache.get("query", "p", "m", "documents", "how do bonds work", ["a"], qvec=[0.0, 1.0]) is None
+    assert cache.stats()["near_hits"] == 1
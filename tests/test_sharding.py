@@ -0,0 +1,70 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.chroma_client import evict_idle_collections, get_chroma_collection, reset_chroma_collection
+from app.ingest import ingest_file_bytes
+from app.response_cache import get_response_cache
+from app.retrieval import retrieve_chunks
+from app.sharding import ingest_collection, search_collections, shard_name
+
+
+def _sharded(monkeypatch, tmp_path):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("SHARD_BY", "user")
+    monkeypatch.setenv("SHARED_SHARD", "global")
+    monkeypatch.setenv("LOCAL_VECTOR_DIR", str(tmp_path / "vectors"))
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    monkeypatch.setenv("LEXICAL_INDEX_ENABLED", "true")
+    # shards cached by an earlier test still point at its LOCAL_VECTOR_DIR
+    evict_idle_collections(0)
+    for name in search_collections("alice") + search_collections("bob")[:1]:
+        reset_chroma_collection(name)
+
+
+def test_shard_names_are_valid_and_distinct():
+    names = {shard_name(u) for u in ("alice", "Alice", "a.b@example.com", "a-b-example-com", "", "x" * 200)}
+    assert len(names) == 6
+    for name in names:
+        assert 3 <= len(name) <= 63 and re.fullmatch(r"[a-zA-Z0-9][a-zA-Z0-9._-]*[a-zA-Z0-9]", name)
+
+
+def test_fan_out_covers_own_and_shared_shard_only(monkeypatch, tmp_path):
+    _sharded(monkeypatch, tmp_path)
+    ingest_file_bytes("alice.txt", b"Alice holds municipal bonds in her brokerage account.", user="alice")
+    ingest_file_bytes("bob.txt", b"Bob holds municipal bonds in his retirement account.", user="bob")
+    ingest_file_bytes("guide.txt", b"Municipal bonds pay interest that is often tax exempt.",
+                      collection_name=ingest_collection(None, shared=True))
+
+    found = retrieve_chunks("municipal bonds", top_k=5, user="alice")
+    assert sorted(m["source"] for m in found.metas) == ["alice.txt", "guide.txt"]
+    assert found.collection == "+".join(search_collections("alice"))
+    assert [m["source"] for m in retrieve_chunks("municipal bonds", top_k=5, user="bob").metas].count("alice.txt") == 0
+
+    # re-ingesting into the shared shard drops answers that used its chunks
+    cache = get_response_cache()
+    cache.put("query", "p", "m", found.collection, "q", found.ids, "answer")
+    ingest_file_bytes("guide.txt", b"Municipal bonds are issued by states and cities.",
+                      collection_name=ingest_collection(None, shared=True))
+    assert cache.get("query", "p", "m", found.collection, "q", found.ids) is None
+
+    monkeypatch.setenv("RETRIEVAL_MODE", "hybrid")
+    hybrid = retrieve_chunks("brokerage", top_k=2, user="alice")
+    assert hybrid.metas[0]["source"] == "alice.txt"
+
+
+def test_idle_shards_are_evicted_and_reopened(monkeypatch, tmp_path):
+    _sharded(monkeypatch, tmp_path)
+    ingest_file_bytes("alice.txt", b"Quarterly dividend reinvestment plan.", user="alice")
+    name = ingest_collection("alice")
+    before = get_chroma_collection(name)
+
+    # a collection being written to or compacted stays cached
+    with before.quiesced() as idle:
+        assert idle and name not in evict_idle_collections(0)
+    assert name in evict_idle_collections(0)
+    reopened = get_chroma_collection(name)
+    assert reopened is not before and reopened.count() == 1
+    assert retrieve_chunks("dividend", top_k=1, user="alice").metas[0]["source"] == "alice.txt"
@@ -0,0 +1,31 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app import main
+from app.main import QueryRequest, query_stream
+
+
+def test_query_stream_emits_tokens(monkeypatch):
+    monkeypatch.delenv("CHROMA_HOST", raising=False)
+    monkeypatch.setenv("LLM_PROVIDER", "gemini")
+
+    async def fake_stream(prompt):
+        for token in ("Revenue ", "grew."):
+            yield token
+
+    monkeypatch.setattr(main, "get_llm_stream", lambda: fake_stream)
+    monkeypatch.setattr(main.app.state, "llm", lambda prompt: "", raising=False)
+
+    async def collect():
+        resp = await query_stream(QueryRequest(query="How did revenue change?"))
+        return [chunk async for chunk in resp.body_iterator]
+
+    events = asyncio.run(collect())
+    names = [e.split("\n", 1)[0] for e in events]
+    assert names == ["event: sources", "event: token", "event: token", "event: done"]
+    done = json.loads(events[-1].split("data: ", 1)[1])
+    assert done["response"] == "Revenue grew."
@@ -0,0 +1,86 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.ann_index import IVFIndex
+from app.vector_codecs import Float16Codec, PQCodec
+from app.vector_store import MemoryCollection, PersistentCollection
+
+
+def _clustered(rng, n, dim, centers=32):
+    means = rng.normal(size=(centers, dim))
+    return (means[rng.integers(0, centers, size=n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def _recall(coll, exact, queries, k=10):
+    hits = 0
+    for q in queries:
+        got = coll.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0]
+        want = exact.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0]
+        hits += len(set(got) & set(want))
+    return hits / (k * len(queries))
+
+
+def _fill(coll, vectors):
+    coll.upsert(ids=[f"c{i}" for i in range(len(vectors))], documents=[str(i) for i in range(len(vectors))],
+                metadatas=[{"even": i % 2 == 0} for i in range(len(vectors))], embeddings=vectors)
+
+
+def test_codecs_shrink_vectors_and_keep_recall():
+    rng = np.random.default_rng(0)
+    vectors = _clustered(rng, 3000, 32)
+    queries = vectors[rng.choice(3000, size=20, replace=False)] + 0.05
+    exact = MemoryCollection("exact")
+    _fill(exact, vectors)
+
+    half = MemoryCollection("f16", codec=Float16Codec())
+    _fill(half, vectors)
+    assert half.index_stats()["codec"]["bytes_per_vector"] == 64
+    assert _recall(half, exact, queries) >= 0.99
+
+    pq = MemoryCollection("pq", codec=PQCodec(m=8, min_rows=1000), rerank=10)
+    _fill(pq, vectors[:1500])
+    _fill(pq, vectors)  # rows after training are encoded incrementally
+    stats = pq.index_stats()["codec"]
+    assert stats["trained"] and stats["bytes_per_vector"] == 8 and stats["float32_bytes_per_vector"] == 128
+    assert _recall(pq, exact, queries) >= 0.9
+    res = pq.query(query_embeddings=[queries[0].tolist()], n_results=5, where={"even": True})
+    assert all(int(i[1:]) % 2 == 0 for i in res["ids"][0])
+
+
+def test_pq_with_ivf_and_persistence(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = _clustered(rng, 3000, 32)
+    q = (vectors[5] + 0.05).tolist()
+
+    def open_collection():
+        return PersistentCollection("p", str(tmp_path), index=IVFIndex(nlist=16, nprobe=16, min_rows=1000),
+                                    codec=PQCodec(m=8, min_rows=1000), compact_min_rows=10 ** 9)
+
+    coll = open_collection()
+    _fill(coll, vectors)
+    before = coll.query(query_embeddings=[q], n_results=10)["ids"]
+
+    reopened = open_collection()
+    assert reopened.index_stats()["codec"]["code_bytes"] == 3000 * 8
+    assert reopened.query(query_embeddings=[q], n_results=10)["ids"] == before
+
+    coll.delete(where={"even": False})
+    assert coll.compact() == 1500
+    # the other handle reloads the compacted generation, codes included
+    assert reopened.count() == 1500
+    assert reopened.index_stats()["codec"]["code_bytes"] == 1500 * 8
+    assert os.path.exists(tmp_path / "codes.1.bin")
+    assert reopened.query(query_embeddings=[q], n_results=5)["ids"] == \
+        coll.query(query_embeddings=[q], n_results=5)["ids"]
+
+
+def test_codec_only_applies_to_memory_mapped_collections(monkeypatch, tmp_path):
+    from app.chroma_client import _collection_options
+
+    monkeypatch.setenv("LOCAL_CODEC", "f16")
+    assert _collection_options(persistent=False)["codec"] is None
+    assert isinstance(_collection_options(persistent=True)["codec"], Float16Codec)
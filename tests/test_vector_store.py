@@ -0,0 +1,114 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.ann_index import IVFIndex
+from app.vector_store import MemoryCollection, PersistentCollection
+
+
+def _exact(vectors, query, k):
+    v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = query / np.linalg.norm(query)
+    return list(np.argsort(-(v @ q))[:k])
+
+
+def test_query_matches_exact_cosine_across_growth():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 16)).astype(np.float32)
+    coll = MemoryCollection("t")
+    # several upserts force the matrix to grow past its initial capacity
+    for start in range(0, 3000, 700):
+        end = min(3000, start + 700)
+        coll.upsert(ids=[f"c{i}" for i in range(start, end)], documents=[f"doc {i}" for i in range(start, end)],
+                    metadatas=[{"i": i} for i in range(start, end)], embeddings=vectors[start:end].tolist())
+    assert coll.count() == 3000
+
+    query = rng.normal(size=16).astype(np.float32)
+    res = coll.query(query_embeddings=[query.tolist()], n_results=5)
+    expected = _exact(vectors, query, 5)
+    assert res["ids"][0] == [f"c{i}" for i in expected]
+    assert res["documents"][0][0] == f"doc {expected[0]}"
+    assert res["metadatas"][0][0] == {"i": int(expected[0])}
+    assert res["distances"][0] == sorted(res["distances"][0])
+
+
+def test_dimension_mismatch_and_clear():
+    coll = MemoryCollection("t")
+    coll.upsert(ids=["a"], documents=["x"], metadatas=[{}], embeddings=[[1.0, 0.0]])
+    with pytest.raises(ValueError):
+        coll.upsert(ids=["b"], documents=["y"], metadatas=[{}], embeddings=[[1.0, 0.0, 0.0]])
+    assert coll.query(query_embeddings=[[0.0, 1.0]], n_results=5)["ids"] == [["a"]]
+    assert coll.clear() == 1
+    assert coll.count() == 0
+    assert coll.query(query_embeddings=[[0.0, 1.0]], n_results=5)["ids"] == [[]]
+
+
+def test_persistent_collection_survives_reopen(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    coll = PersistentCollection("p", str(tmp_path))
+    coll.upsert(ids=[f"c{i}" for i in range(50)], documents=[f"doc {i}" for i in range(50)],
+                metadatas=[{"i": i} for i in range(50)], embeddings=vectors)
+
+    # a second handle (another worker process, or a restart) maps the same files
+    other = PersistentCollection("p", str(tmp_path))
+    assert other.count() == 50
+    res = other.query(query_embeddings=[vectors[7].tolist()], n_results=1)
+    assert res["ids"] == [["c7"]] and res["metadatas"] == [[{"i": 7}]]
+
+    other.upsert(ids=["new"], documents=["n"], metadatas=[{}], embeddings=[vectors[0] * -1])
+    assert coll.count() == 51
+    assert other.clear() == 51
+    assert coll.count() == 0
+    assert PersistentCollection("p", str(tmp_path)).count() == 0
+
+
+def _clustered(rng, n, dim, centers=32):
+    means = rng.normal(size=(centers, dim))
+    return (means[rng.integers(0, centers, size=n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def test_ivf_index_recall_and_persistence(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = _clustered(rng, 4000, 16)
+    ids = [f"c{i}" for i in range(4000)]
+    coll = PersistentCollection("a", str(tmp_path), index=IVFIndex(nlist=32, nprobe=8, min_rows=2000))
+    coll.upsert(ids=ids[:2500], documents=ids[:2500], metadatas=[{}] * 2500, embeddings=vectors[:2500])
+    # later rows are assigned to the trained cells incrementally
+    coll.upsert(ids=ids[2500:], documents=ids[2500:], metadatas=[{}] * 1500, embeddings=vectors[2500:])
+    stats = coll.index_stats()["ann"]
+    assert stats["trained"] and stats["indexed_rows"] == 4000 and stats["trained_rows"] == 2500
+
+    queries = vectors[rng.choice(4000, size=20, replace=False)] + 0.05
+    hits = 0
+    for q in queries:
+        got = coll.query(query_embeddings=[q.tolist()], n_results=10)["ids"][0]
+        hits += len(set(got) & {f"c{i}" for i in _exact(vectors, q, 10)})
+    assert hits / 200 >= 0.9
+
+    reopened = PersistentCollection("a", str(tmp_path), index=IVFIndex(nlist=32, nprobe=8, min_rows=2000))
+    assert reopened.index_stats()["ann"]["indexed_rows"] == 4000
+    q = queries[0].tolist()
+    assert reopened.query(query_embeddings=[q], n_results=10)["ids"] == coll.query(query_embeddings=[q], n_results=10)["ids"]
+
+
+def test_ivf_trains_outside_the_query_lock():
+    rng = np.random.default_rng(3)
+    vectors = _clustered(rng, 1200, 8)
+    coll = MemoryCollection("train", index=IVFIndex(nlist=8, nprobe=8, min_rows=1000))
+    held = []
+    fit = coll._index.fit
+
+    def watched_fit(rows):
+        held.append(coll._lock.locked())
+        # a query during training is answered (exactly, as the index is not trained yet)
+        assert len(coll.query(query_embeddings=[vectors[0].tolist()], n_results=1)["ids"][0]) == 1
+        return fit(rows)
+
+    coll._index.fit = watched_fit
+    coll.upsert(ids=[f"r{i}" for i in range(1200)], embeddings=vectors)
+    assert held == [False] and coll.index_stats()["ann"]["indexed_rows"] == 1200